@@ -0,0 +1,33 @@
+import pandas as pd
+
+AGING_LABELS = ['Lancar', '1-30 Hari', '31-60 Hari', '61-90 Hari', '>90 Hari']
+AGING_EDGES = [1, 31, 61, 91]
+TYPE_COLUMNS = {'KUR': 'KUR', 'KUR Khusus': 'KUR_Khusus'}
+SEGMENTS = ['Petani Individu', 'Kelompok Tani', 'Pemula (<2 tahun)', 'Berpengalaman (>2 tahun)']
+
+
+def _npl_rate(outstanding, collectibility):
+    total = outstanding.sum()
+    return 100 * outstanding[collectibility >= 3].sum() / total if total else 0.0
+
+
+def segment_frame(loans, borrowers):
+    """Debtor count, credit and NPL for the (overlapping) farmer segments."""
+    book = loans.merge(borrowers[['borrower_id', 'farmer_group', 'experience_years']], on='borrower_id')
+    masks = {
+        'Petani Individu': book['farmer_group'].isna(),
+        'Kelompok Tani': book['farmer_group'].notna(),
+        'Pemula (<2 tahun)': book['experience_years'] < 2,
+        'Berpengalaman (>2 tahun)': book['experience_years'] >= 2,
+    }
+    rows = []
+    for segment in SEGMENTS:
+        group = book[masks[segment]]
+        live = group[group['status'] != 'Closed']
+        rows.append({
+            'Segmen': segment,
+            'Jumlah': group['borrower_id'].nunique(),
+            'Total_Kredit': group['disbursed_amount'].sum(),
+            'NPL_Rate': _npl_rate(live['outstanding_balance'], live['collectibility_category']),
+        })
+    return pd.DataFrame(rows)
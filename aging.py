@@ -0,0 +1,239 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import schema
+from aggregates import AGING_EDGES, AGING_LABELS, TYPE_COLUMNS
+
+# OJK collectibility: 1 Lancar, 2 DPK (1-90), 3 Kurang Lancar (91-120), 4 Diragukan (121-180), 5 Macet (>180)
+COLLECTIBILITY_EDGES = [1, 91, 121, 181]
+COLLECTIBILITY_LABELS = ['Lancar', 'Dalam Perhatian Khusus', 'Kurang Lancar', 'Diragukan', 'Macet']
+DAYS_PER_MONTH = 30.4375  # installment spacing used by the loan book
+LOAN_COLUMNS = ['loan_id', 'loan_type', 'disbursement_date', 'maturity_date', 'disbursed_amount',
+                'region', 'bank']
+PAYMENT_COLUMNS = ['loan_id', 'payment_date', 'principal_amount', 'late_days']
+
+# As-of days whose evaluation is kept: the newest data, plus one other (e.g. the previous period)
+EVALUATED_DAYS = 2
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+def _days(values):
+    """Dates as int32 days since the epoch."""
+    return (np.asarray(values, dtype='datetime64[D]') - _EPOCH).astype(np.int32)
+
+
+def _bin(values, edges):
+    """np.digitize for a few ascending edges, as int8 comparisons."""
+    codes = np.zeros(len(values), dtype=np.int8)
+    for edge in edges:
+        codes += values >= edge
+    return codes
+
+
+class AgingEngine:
+    """Days-past-due, aging bucket and collectibility for every loan as of any date.
+
+    Loans are held sorted by loan_id, and payments grouped per loan in date order,
+    as flat integer/float arrays. Evaluating an as-of date is a running count of
+    the settled payment rows, a gather from the running principal total, and
+    element-wise arithmetic over the loans; no Python-level loops.
+    An evaluated state carries the loan ids, dates and dimension codes it was
+    computed from, so a reader masks it consistently even across a merge.
+    """
+
+    def __init__(self, loans, payments):
+        self._lock = threading.Lock()
+        self._evaluated = OrderedDict()
+        self._generation = 0
+        arrays = self._loan_arrays(loans)
+        arrays.update(self._payment_arrays(payments, arrays['loan_ids']))
+        self._swap(arrays)
+
+    @staticmethod
+    def _loan_arrays(loans):
+        loans = loans.sort_values('loan_id', kind='stable')
+        disbursed_on = _days(loans['disbursement_date'])
+        matures_on = _days(loans['maturity_date'])
+        labels = {}
+        codes = {}
+        for dim in ('loan_type', 'region', 'bank'):
+            dim_codes, dim_labels = pd.factorize(loans[dim], sort=True)
+            codes[dim] = dim_codes.astype(np.int8)
+            labels[dim] = np.asarray(dim_labels)
+        codes['masa_tanam'] = (loans['disbursement_date'].dt.month > 6).to_numpy(np.int8)
+        labels['masa_tanam'] = np.asarray(['Musim Tanam 1', 'Musim Tanam 2'])
+        return {
+            'loan_ids': loans['loan_id'].to_numpy(np.int64),
+            'disbursed_on': disbursed_on,
+            'tenor': np.maximum(np.round((matures_on - disbursed_on) / DAYS_PER_MONTH), 1).astype(np.int32),
+            'disbursed': loans['disbursed_amount'].to_numpy(np.float64),
+            'labels': labels,
+            'codes': codes,
+            '_frame': loans[LOAN_COLUMNS],
+        }
+
+    @staticmethod
+    def _payment_arrays(payments, loan_ids):
+        payments = payments[payments['loan_id'].isin(loan_ids)]
+        pay_loan = np.searchsorted(loan_ids, payments['loan_id'].to_numpy(np.int64))
+        paid_on = _days(payments['payment_date'])
+        # Each loan's payments form one contiguous, date-ordered run
+        order = np.lexsort((paid_on, pay_loan))
+        principal = payments['principal_amount'].to_numpy(np.float64)[order]
+        principal_before = np.concatenate([[0.0], np.cumsum(principal)])
+        rows = np.bincount(pay_loan, minlength=len(loan_ids))
+        first_row = np.cumsum(rows) - rows
+        return {
+            'paid_on': paid_on[order],
+            'due_on': paid_on[order] - payments['late_days'].to_numpy(np.int32)[order],
+            'principal_before': principal_before,
+            'rows': rows,
+            'first_row': first_row,
+            'principal_at_start': principal_before[first_row],
+            '_payments': payments[PAYMENT_COLUMNS],
+        }
+
+    def _swap(self, arrays):
+        """Install new loan and/or payment arrays together, dropping every evaluation made from the old ones."""
+        with self._lock:
+            for name, value in arrays.items():
+                setattr(self, name, value)
+            self._evaluated = OrderedDict()
+            self._generation += 1
+
+    @property
+    def last_date(self):
+        """Newest date the payment history covers; later as-of dates would read as arrears."""
+        latest = max(self.paid_on.max(initial=0), self.disbursed_on.max(initial=0))
+        return (_EPOCH + latest).astype('datetime64[D]').item()
+
+    def merge(self, loans=None, payments=None, borrowers=None, productivity=None):
+        """Upsert changed loans and append new payments.
+
+        The new arrays are built on the side and swapped in at once (copy-on-write),
+        so a concurrent evaluate() sees either the old book or the new one.
+        """
+        arrays = {}
+        loan_ids = self.loan_ids
+        if loans is not None and len(loans):
+            kept = self._frame[~self._frame['loan_id'].isin(loans['loan_id'])]
+            arrays = self._loan_arrays(schema.concat([kept, loans[LOAN_COLUMNS]], ignore_index=True))
+            loan_ids = arrays['loan_ids']
+        if payments is not None and len(payments):
+            arrays.update(self._payment_arrays(schema.concat([self._payments, payments[PAYMENT_COLUMNS]],
+                                                             ignore_index=True), loan_ids))
+        elif arrays:
+            arrays.update(self._payment_arrays(self._payments, loan_ids))
+        if arrays:
+            self._swap(arrays)
+
+    def evaluate(self, as_of):
+        """Per-loan outstanding balance, days past due, bucket and collectibility as of a date."""
+        day = _days(np.datetime64(as_of, 'D'))[()]
+        with self._lock:
+            if day in self._evaluated:
+                self._evaluated.move_to_end(day)
+                return self._evaluated[day]
+            # One consistent set of arrays, even if a merge swaps in new ones meanwhile
+            generation = self._generation
+            loan_ids, codes, labels = self.loan_ids, self.codes, self.labels
+            disbursed_on, tenor, disbursed = self.disbursed_on, self.tenor, self.disbursed
+            paid_on, due_on, rows, first_row = self.paid_on, self.due_on, self.rows, self.first_row
+            principal_before, principal_at_start = self.principal_before, self.principal_at_start
+        n = len(disbursed_on)
+
+        # Rows paid by the as-of date are a prefix of each loan's run: count them off a running total
+        settled_rows = paid_on <= day
+        settled_before = np.concatenate([[0], np.cumsum(settled_rows, dtype=np.int32)])
+        settled = settled_before[first_row + rows] - settled_before[first_row]
+        repaid = principal_before[first_row + settled] - principal_at_start
+
+        # Installments already due but paid only after the as-of date are open arrears (rare rows)
+        open_rows = np.flatnonzero((due_on <= day) & ~settled_rows)
+        open_loan = np.searchsorted(first_row, open_rows, side='right') - 1
+        oldest_open = np.full(n, day, dtype=np.int32)
+        np.minimum.at(oldest_open, open_loan, due_on[open_rows])
+        rows_due = settled + np.bincount(open_loan, minlength=n)
+
+        # Installments that should be due by now but have no payment row at all
+        elapsed = (day - disbursed_on) * 16 // 487  # whole months of 30.4375 days
+        missing = np.clip(elapsed, 0, tenor) > rows_due
+        first_missing = disbursed_on + ((rows_due + 1) * 487 + 8) // 16
+
+        dpd = np.maximum(day - oldest_open, np.where(missing, day - first_missing, 0))
+        outstanding = np.maximum(disbursed - repaid, 0)
+        live = (disbursed_on <= day) & (outstanding > 0.5)
+        dpd = np.where(live, dpd, 0).astype(np.int32)
+        state = {
+            'outstanding': np.where(live, outstanding, 0.0),
+            'days_past_due': dpd,
+            'bucket': _bin(dpd, AGING_EDGES),
+            'collectibility': _bin(dpd, COLLECTIBILITY_EDGES) + 1,
+            'live': live,
+            # The book the state describes, for readers that mask or group it
+            'loan_ids': loan_ids,
+            'disbursed_on': disbursed_on,
+            'disbursed': disbursed,
+            'codes': codes,
+            'labels': labels,
+        }
+        with self._lock:
+            if generation != self._generation:
+                return state  # computed from the book a merge has since replaced; not kept
+            self._evaluated[day] = state
+            while len(self._evaluated) > EVALUATED_DAYS:
+                self._evaluated.popitem(last=False)
+        return state
+
+    def mask(self, region=None, bank=None, loan_type=None, masa_tanam=None, state=None):
+        """Loans matching the filters, in the loan order of `state` (default: the current book)."""
+        if state is None:
+            with self._lock:
+                codes, labels = self.codes, self.labels
+        else:
+            codes, labels = state['codes'], state['labels']
+        keep = np.ones(len(codes['region']), dtype=bool)
+        for dim, value in (('region', region), ('bank', bank), ('loan_type', loan_type),
+                           ('masa_tanam', masa_tanam)):
+            if value is not None:
+                hits = np.flatnonzero(labels[dim] == value)
+                keep &= codes[dim] == (hits[0] if len(hits) else -1)
+        return keep
+
+    def _as_of(self, until):
+        last = self.last_date
+        return min(pd.Timestamp(until).date(), last) if until is not None else last
+
+    def aging(self, until=None, **filters):
+        """Outstanding per aging bucket and loan type, shaped like the original aging_data."""
+        state = self.evaluate(self._as_of(until))
+        labels = state['labels']
+        weights = np.where(self.mask(state=state, **filters), state['outstanding'], 0.0)
+        n_types = len(labels['loan_type'])
+        cells = np.bincount(state['bucket'].astype(np.int64) * n_types + state['codes']['loan_type'],
+                            weights=weights, minlength=len(AGING_LABELS) * n_types)
+        cells = cells.reshape(len(AGING_LABELS), n_types)
+        frame = pd.DataFrame({'Kategori': AGING_LABELS})
+        for loan_type, col in TYPE_COLUMNS.items():
+            hits = np.flatnonzero(labels['loan_type'] == loan_type)
+            frame[col] = cells[:, hits].sum(axis=1)
+        return frame
+
+    def collectibility(self, until=None, **filters):
+        """Outstanding, loan count and share of the book per collectibility category."""
+        state = self.evaluate(self._as_of(until))
+        keep = self.mask(state=state, **filters) & state['live']
+        codes = state['collectibility'][keep].astype(np.int64) - 1
+        outstanding = np.bincount(codes, weights=state['outstanding'][keep], minlength=5)
+        total = outstanding.sum()
+        return pd.DataFrame({
+            'Kolektibilitas': np.arange(1, 6),
+            'Kategori': COLLECTIBILITY_LABELS,
+            'Outstanding': outstanding,
+            'Jumlah_Kredit': np.bincount(codes, minlength=5),
+            'Persentase': 100 * outstanding / total if total else np.zeros(5),
+        })
@@ -0,0 +1,257 @@
+import ast
+import json
+import os
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+# User-defined rules, a JSON list of AlertRule fields (override with KUR_ALERT_RULES)
+RULES_FILE = os.getenv('KUR_ALERT_RULES', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                       'data', 'alert_rules.json'))
+
+AlertRule = namedtuple('AlertRule', ['name', 'expression', 'priority', 'action', 'enabled'])
+PRIORITIES = ['🔴 Tinggi', '🟡 Sedang', '🟢 Rendah']
+
+# Names a rule expression can use, with their meaning for the editor's help text
+VARIABLES = {
+    'late_days': 'Hari tunggakan (days past due)',
+    'outstanding_balance': 'Outstanding (Rp)',
+    'disbursed_amount': 'Plafon (Rp)',
+    'collectibility': 'Kolektibilitas 1-5',
+    'days_to_maturity': 'Hari menuju jatuh tempo',
+    'regional_npl': 'NPL region (%)',
+    'productivity_drop': 'Penurunan produktivitas panen terakhir (%)',
+    'price_drop': 'Penurunan harga jual panen terakhir (%)',
+    'region': 'Region',
+    'bank': 'Bank',
+    'loan_type': "Jenis kredit ('KUR', 'KUR Khusus')",
+    'masa_tanam': "Masa tanam ('Musim Tanam 1', 'Musim Tanam 2')",
+}
+# Variables held as integer codes; rules compare them with labels, compiled to code comparisons
+CATEGORIES = ['region', 'bank', 'loan_type', 'masa_tanam']
+
+_COMPARE = {ast.Eq: np.equal, ast.NotEq: np.not_equal, ast.Lt: np.less, ast.LtE: np.less_equal,
+            ast.Gt: np.greater, ast.GtE: np.greater_equal}
+_ARITHMETIC = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.true_divide}
+
+
+class RuleError(ValueError):
+    pass
+
+
+class Variables:
+    """Rule inputs over one set of loans, each built on first use and shared by every rule.
+
+    `getters` maps each name in VARIABLES to a zero-argument function returning the
+    array; comparison masks are memoized too, so a condition repeated across
+    hundreds of rules is computed once per batch.
+    """
+
+    def __init__(self, getters, size):
+        self._getters = getters
+        self.size = size
+        self._arrays = {}
+        self.masks = {}
+
+    def __getitem__(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = self._getters[name]()
+        return self._arrays[name]
+
+
+class _Compiler:
+    """Translates a whitelisted expression AST into nested numpy operations.
+
+    Only names from VARIABLES, numbers, labels of the categorical variables,
+    arithmetic, comparisons and and/or/not are accepted; anything else (calls,
+    attributes, subscripts, ...) is rejected before a rule is ever run.
+    """
+
+    def __init__(self, vocabulary):
+        self.vocabulary = vocabulary
+
+    def compile(self, expression):
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError as e:
+            raise RuleError(f"Sintaks tidak valid: {e.msg}") from None
+        if not isinstance(tree.body, (ast.BoolOp, ast.Compare, ast.UnaryOp)):
+            raise RuleError("Rule harus berupa kondisi, mis. late_days > 30")
+        return self.condition(tree.body)
+
+    def condition(self, node):
+        if isinstance(node, ast.BoolOp):
+            parts = [self.condition(v) for v in node.values]
+            combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+
+            def bool_op(variables):
+                result = parts[0](variables)
+                for part in parts[1:]:
+                    result = combine(result, part(variables))
+                return result
+            return bool_op
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            operand = self.condition(node.operand)
+            return lambda variables: ~operand(variables)
+        if isinstance(node, ast.Compare):
+            left, terms = node.left, []
+            for op, right in zip(node.ops, node.comparators):
+                terms.append(self.comparison(left, op, right))
+                left = right
+            if len(terms) == 1:
+                return terms[0]
+            return lambda variables: np.logical_and.reduce([term(variables) for term in terms])
+        raise RuleError(f"Bukan kondisi: {ast.unparse(node)}")
+
+    def comparison(self, left, op, right):
+        key = ast.dump(ast.Compare(left, [op], [right]))
+        if isinstance(left, ast.Name) and left.id in CATEGORIES:
+            evaluate = self.category(left.id, op, right)
+        elif isinstance(right, ast.Name) and right.id in CATEGORIES and isinstance(op, (ast.Eq, ast.NotEq)):
+            evaluate = self.category(right.id, op, left)
+        elif type(op) in _COMPARE:
+            compare, a, b = _COMPARE[type(op)], self.number(left), self.number(right)
+
+            def evaluate(variables):
+                return compare(a(variables), b(variables))
+        else:
+            raise RuleError(f"Operator tidak didukung: {ast.unparse(ast.Compare(left, [op], [right]))}")
+
+        def memoized(variables):
+            if key not in variables.masks:
+                variables.masks[key] = evaluate(variables)
+            return variables.masks[key]
+        return memoized
+
+    def category(self, name, op, labels_node):
+        labels = list(self.vocabulary[name])
+        if isinstance(op, (ast.Eq, ast.NotEq)) and isinstance(labels_node, ast.Constant):
+            values = [labels_node.value]
+        elif isinstance(op, (ast.In, ast.NotIn)) and isinstance(labels_node, (ast.List, ast.Tuple, ast.Set)):
+            values = [e.value for e in labels_node.elts if isinstance(e, ast.Constant)]
+            if len(values) != len(labels_node.elts):
+                raise RuleError(f"{name} hanya dibandingkan dengan daftar label")
+        else:
+            raise RuleError(f"{name} hanya dibandingkan dengan ==, !=, in atau not in terhadap label")
+        unknown = [v for v in values if v not in labels]
+        if unknown:
+            raise RuleError(f"{name} tidak mengenal {', '.join(map(repr, unknown))}; pilihan: {', '.join(labels)}")
+        codes = np.array([labels.index(v) for v in values])
+        negate = isinstance(op, (ast.NotEq, ast.NotIn))
+        return lambda variables: np.isin(variables[name], codes, invert=negate)
+
+    def number(self, node):
+        if isinstance(node, ast.Name):
+            if node.id not in VARIABLES:
+                raise RuleError(f"Variabel tidak dikenal: {node.id}")
+            if node.id in CATEGORIES:
+                raise RuleError(f"{node.id} adalah label, bukan angka")
+            return lambda variables: variables[node.id]
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            return lambda variables: node.value
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            operand = self.number(node.operand)
+            return lambda variables: -operand(variables)
+        if isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC:
+            operation, a, b = _ARITHMETIC[type(node.op)], self.number(node.left), self.number(node.right)
+            return lambda variables: operation(a(variables), b(variables))
+        raise RuleError(f"Ekspresi tidak didukung: {ast.unparse(node)}")
+
+
+def compile_rule(expression, vocabulary):
+    """Validate an expression and compile it into a function of Variables returning a boolean mask."""
+    return _Compiler(vocabulary).compile(expression)
+
+
+def check_rules(rules, vocabulary):
+    """(errors, compiled, failed) for the given rules, which are saved only when there are no errors.
+
+    `compiled` pairs each enabled, error-free rule with its mask function; `failed`
+    holds the positions of the rules with errors.
+    """
+    errors, compiled, failed, names = [], [], set(), set()
+    for i, rule in enumerate(rules):
+        problems = []
+        if not rule.name or rule.name in names:
+            problems.append(f"Nama rule kosong atau ganda: {rule.name!r}")
+        names.add(rule.name)
+        if rule.priority not in PRIORITIES:
+            problems.append(f"{rule.name}: prioritas harus salah satu dari {', '.join(PRIORITIES)}")
+        try:
+            mask = compile_rule(rule.expression, vocabulary)
+        except RuleError as e:
+            problems.append(f"{rule.name}: {e}")
+        if problems:
+            errors += problems
+            failed.add(i)
+        elif rule.enabled:
+            compiled.append((rule, mask))
+    return errors, compiled, failed
+
+
+def load_rules(path, vocabulary):
+    """The saved rules, the enabled ones compiled, and the errors of those that no longer check.
+
+    A rule with an error (e.g. a label since dropped from the data) is kept but
+    switched off, for the editor to show and fix; the other rules still run.
+    """
+    if not os.path.exists(path):
+        return [], [], []
+    with open(path) as f:
+        rules = [AlertRule(r['name'], r['expression'], r.get('priority', PRIORITIES[1]), r.get('action', ''),
+                           r.get('enabled', True)) for r in json.load(f)]
+    errors, compiled, failed = check_rules(rules, vocabulary)
+    return [rule._replace(enabled=False) if i in failed else rule for i, rule in enumerate(rules)], compiled, errors
+
+
+class RuleBook:
+    """The user-defined alert rules, persisted as JSON and compiled once per revision.
+
+    Rules are checked and compiled when loaded or saved, not when run; a batch run
+    is then a handful of numpy comparisons per distinct condition over the whole book.
+    `errors` lists the rules that failed their check at load or on a new vocabulary;
+    those rules are skipped until fixed.
+    """
+
+    def __init__(self, vocabulary, path=RULES_FILE):
+        self.path = path
+        self.rules, compiled, self.errors = load_rules(path, vocabulary)
+        self.revision = 0
+        self._compiled = (self._key(vocabulary), compiled)
+        self._lock = threading.Lock()
+
+    def _key(self, vocabulary):
+        return self.revision, tuple((k, tuple(v)) for k, v in sorted(vocabulary.items()))
+
+    def validate(self, rules, vocabulary):
+        """Error messages for the given rules; empty if they can all be saved."""
+        return check_rules(rules, vocabulary)[0]
+
+    def save(self, rules, vocabulary):
+        errors = self.validate(rules, vocabulary)
+        if errors:
+            raise RuleError("\n".join(errors))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump([rule._asdict() for rule in rules], f, indent=1, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        with self._lock:
+            self.rules = list(rules)
+            self.errors = []
+            self.revision += 1
+
+    def compiled(self, vocabulary):
+        """(rule, mask function) for the enabled rules, compiled once per revision and vocabulary."""
+        with self._lock:
+            key = self._key(vocabulary)
+            if self._compiled[0] != key:
+                self.errors, compiled, _ = check_rules(self.rules, vocabulary)
+                self._compiled = (key, compiled)
+            return self._compiled[1]
+
+    def evaluate(self, variables, vocabulary):
+        """One boolean mask per enabled rule, over the loans `variables` describes."""
+        return {rule.name: np.broadcast_to(np.asarray(mask(variables), dtype=bool), variables.size)
+                for rule, mask in self.compiled(vocabulary)}
@@ -4,6 +4,28 @@ import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime, timedelta
 import numpy as np
+import functools
+import uuid
+
+import alert_rules
+import db_loader
+import downsample
+import drilldown
+import ews
+import export
+import formatting
+import perf
+import productivity_bands
+import query_engine
+from aggregates import segment_frame
+from cube import loan_frame
+from data_store import DataStore, loan_filter, open_store
+from digest import DigestScheduler
+from figures import FigureCache
+from refresh import build_refresher
+from report import ReportQueue
+from shared_cache import SharedCache
+from warmup import CacheWarmer
 
 # Page configuration
 st.set_page_config(page_title="Dashboard Monitoring Pembiayaan Petani Tebu", layout="wide")
@@ -39,52 +61,261 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Generate sample data
-@st.cache_data
-def generate_sample_data():
-    np.random.seed(42)
-    
-    # Monthly portfolio data
-    months = pd.date_range(start='2024-01-01', end='2025-11-01', freq='MS')
-    portfolio_data = pd.DataFrame({
-        'Bulan': months,
-        'KUR_Disbursed': np.random.randint(5000, 15000, len(months)) * 1000000,
-        'KUR_Khusus_Disbursed': np.random.randint(3000, 8000, len(months)) * 1000000,
-        'KUR_Outstanding': np.cumsum(np.random.randint(3000, 10000, len(months)) * 1000000),
-        'KUR_Khusus_Outstanding': np.cumsum(np.random.randint(2000, 6000, len(months)) * 1000000),
-        'NPL_Rate': np.random.uniform(1.5, 4.5, len(months)),
-        'Collection_Rate': np.random.uniform(85, 97, len(months))
-    })
-    
-    # Regional data
-    regions = ['Jawa Timur', 'Jawa Tengah', 'Lampung', 'Sumatera Selatan', 'Sulawesi Selatan']
-    regional_data = pd.DataFrame({
-        'Region': regions,
-        'Total_Kredit': np.random.randint(50000, 200000, len(regions)) * 1000000,
-        'Jumlah_Debitur': np.random.randint(500, 2000, len(regions)),
-        'NPL_Rate': np.random.uniform(1.0, 5.0, len(regions)),
-        'Luas_Lahan_Ha': np.random.randint(1000, 5000, len(regions)),
-        'Rata_Kredit_per_Petani': np.random.randint(20, 80, len(regions)) * 1000000
-    })
-    
-    # Loan aging data
-    aging_data = pd.DataFrame({
-        'Kategori': ['Lancar', '1-30 Hari', '31-60 Hari', '61-90 Hari', '>90 Hari'],
-        'KUR': [850000000000, 45000000000, 25000000000, 15000000000, 35000000000],
-        'KUR_Khusus': [520000000000, 28000000000, 18000000000, 10000000000, 24000000000]
-    })
-    
-    # Farmer segmentation
-    segment_data = pd.DataFrame({
-        'Segmen': ['Petani Individu', 'Kelompok Tani', 'Pemula (<2 tahun)', 'Berpengalaman (>2 tahun)'],
-        'Jumlah': [3200, 1800, 1500, 3500],
-        'Total_Kredit': [640000000000, 480000000000, 280000000000, 840000000000],
-        'NPL_Rate': [3.2, 1.8, 4.5, 2.1]
+# With KUR_DB_URL set, the store mirrors that database: synced on startup and before every refresh
+@st.cache_resource
+def get_database_sync():
+    return db_loader.DatabaseSync(DataStore()) if db_loader.DB_URL else None
+
+# Load data from the columnar store
+@st.cache_resource
+def get_store():
+    sync = get_database_sync()
+    if sync is None:
+        return open_store()
+    sync.sync()
+    return sync.store
+
+@st.cache_resource
+def get_refresher():
+    return build_refresher(get_store(), source=get_database_sync())
+
+@st.cache_resource
+def get_figure_cache():
+    return FigureCache()
+
+@st.cache_resource
+def get_shared_cache():
+    return SharedCache()
+
+@st.cache_resource
+def get_query_engine():
+    # Aggregations in DuckDB, joined to the store's borrower files; None falls back to pandas
+    return query_engine.QueryEngine(get_store()) if query_engine.available() else None
+
+@st.cache_resource
+def get_report_queue():
+    return ReportQueue()
+
+@st.cache_resource
+def get_ews():
+    # Runs the rules over the whole book every few minutes and keeps the `alerts` table
+    refresher = get_refresher()
+    return refresher.targets['ews'].start(refresher)
+
+@st.cache_resource
+def get_snapshots():
+    # Month-end snapshots of the closed months; missing ones are built in the background
+    return get_refresher().targets['snapshots'].start()
+
+@st.cache_resource
+def get_digest_scheduler():
+    # Early-warning rows of the digest: section 7's table for the recipient's scope, as of the period's end
+    def alerts(until, region, bank):
+        snapshot = get_snapshots().get(until)
+        if snapshot is not None:
+            return snapshot.alert_summary(region=region, bank=bank)
+        return get_ews().summary(until, region=region, bank=bank)
+
+    return DigestScheduler(get_refresher().cube, alerts).start()
+
+# Results other processes on the host may already have computed are keyed on the refresher's
+# watermark: unlike the cube's version counters, it names the same data in every process
+
+def load_segment_data(filters):
+    # Not held per process: read from the shared cache, and computed from the loan book pinned to the
+    # watermark in its key, so a refresh meanwhile cannot put newer data under an older key
+    pinned = get_refresher().pinned
+
+    def compute():
+        loans = loan_frame(pinned.axes, pinned.state, **dict(filters))
+        engine = get_query_engine()
+        if engine is not None:
+            with perf.span('duckdb.segments'):
+                return engine.segments(loans)
+        with perf.span('store.load'):
+            borrowers = get_store().load('borrowers', columns=['borrower_id', 'farmer_group', 'experience_years'])
+        with perf.span('segment_frame'):
+            return segment_frame(loans, borrowers)
+
+    shared = get_shared_cache()
+    return shared.frame(shared.key('segment', filters, str(pinned.watermark)), compute)
+
+def warm_view(view):
+    """Compute what a session needs for one filter view, apart from its figures."""
+    filters = {key: view.get(key) for key in ('until', 'region', 'loan_type', 'masa_tanam', 'bank')}
+    if get_snapshots().get(filters['until']) is None:
+        # A closed month's segments and alerts are read from its snapshot
+        load_segment_data(tuple(filters.items()))
+        get_ews().summary(**filters)
+
+def warm_candidates():
+    # The default view first, then each region and each bank on their own
+    axes = get_refresher().cube.axes
+    default = {'region': None, 'loan_type': None, 'masa_tanam': None, 'bank': None}
+    return ([default] + [{**default, 'region': region} for region in axes['region']]
+            + [{**default, 'bank': bank} for bank in axes['bank']])
+
+@st.cache_resource
+def get_warmer():
+    warmer = CacheWarmer(warm_view, warm_candidates)
+    get_refresher().listeners.append(lambda result: warmer.start('refresh'))
+    return warmer.start()
+
+def load_loan_index(scope, filters, sort_by, ascending, status, collectibility, version):
+    # Not held per process: the index is read memory-mapped from the shared cache on every call
+    def compute():
+        store = get_store()
+        expression = drilldown.scope_filter(store, dict(filters), status=status, collectibility=collectibility,
+                                            **dict(scope))
+        return drilldown.build_index(store, expression, sort_by, ascending)
+
+    # The index reads the store itself: it is only shared if no refresh moved the watermark meanwhile
+    shared = get_shared_cache()
+    key = shared.key('loan_index', scope, filters, sort_by, ascending, status, collectibility, version)
+    return drilldown.LoanIndex(shared.table(key, compute, lambda: str(get_refresher().watermark) == version))
+
+@st.cache_data(max_entries=256)
+def load_loan_page(scope, filters, sort_by, ascending, status, collectibility, version, page):
+    index = load_loan_index(scope, filters, sort_by, ascending, status, collectibility, version)
+    return drilldown.fetch_page(get_store(), index, page)
+
+def render_perf_panel(trace):
+    """Flame-style breakdown of the last rerun in the sidebar."""
+    records = pd.DataFrame(trace.records())
+    st.sidebar.markdown(f"**Rerun terakhir: {trace.total * 1000:,.0f} ms**")
+    figure_cache = get_figure_cache()
+    st.sidebar.caption(f"Cache grafik: {figure_cache.hits:,} hit / {figure_cache.misses:,} miss, "
+                       f"{len(figure_cache)} grafik, {figure_cache.bytes / 2**20:.1f} MB")
+    shared = get_shared_cache()
+    st.sidebar.caption(f"Cache bersama: {shared.hits:,} hit / {shared.misses:,} miss, "
+                       f"{shared.bytes / 2**20:.1f} MB di {shared.root}")
+    memory = get_store().memory
+    if memory:
+        st.sidebar.caption("Memori frame: " + ", ".join(f"{name} {rows:,} baris {mb:.1f} MB"
+                                                         for name, (rows, mb) in memory.items()))
+    if warmer.last_run is not None:
+        st.sidebar.caption(f"Warm-up ({warmer.last_run.reason}): {warmer.last_run.views} tampilan, "
+                           f"{warmer.last_run.seconds:.1f} s{', dibatalkan' if warmer.last_run.cancelled else ''}")
+    fig_flame = go.Figure(go.Bar(
+        y=records['depth'],
+        x=records['ms'],
+        base=records['start_ms'],
+        orientation='h',
+        text=records['name'],
+        textposition='inside',
+        insidetextanchor='start',
+        hovertext=records['path'] + records['ms'].map(lambda ms: f": {ms:,.1f} ms"),
+        hoverinfo='text',
+        marker=dict(color=records['depth'], colorscale='Oranges_r')
+    ))
+    fig_flame.update_layout(
+        height=120 + 40 * (records['depth'].max() + 1),
+        margin=dict(l=0, r=0, t=10, b=0),
+        xaxis_title='ms',
+        yaxis=dict(autorange='reversed', showticklabels=False),
+        bargap=0.05
+    )
+    st.sidebar.plotly_chart(fig_flame, use_container_width=True)
+    slowest = records.nlargest(10, 'self_ms')[['path', 'ms', 'self_ms']]
+    st.sidebar.dataframe(slowest, hide_index=True, column_config={
+        "path": "Span",
+        "ms": st.column_config.NumberColumn("Total (ms)", format="%.1f"),
+        "self_ms": st.column_config.NumberColumn("Self (ms)", format="%.1f"),
     })
-    
-    return portfolio_data, regional_data, aging_data, segment_data
 
-portfolio_data, regional_data, aging_data, segment_data = generate_sample_data()
+# Timing spans: always on with KUR_PERF=1 (JSON log lines), or per session via the sidebar panel
+show_perf = st.sidebar.toggle("⏱️ Performance", key='perf_panel', help="Rincian waktu rerun terakhir per bagian dashboard")
+perf.begin_run(perf.ENABLED or show_perf, session=st.session_state.setdefault('session_tag', uuid.uuid4().hex[:8]))
+
+perf.mark('Data')
+with perf.span('get_refresher'):
+    refresher = get_refresher()
+cube = refresher.cube
+aging_engine = refresher.targets['aging']
+ews_engine = get_ews()
+snapshots = get_snapshots()
+get_digest_scheduler()  # sends the monthly management digest in the background
+warmer = get_warmer()  # precomputes the most used views at startup and after each refresh
+
+# Trend charts fill a half-width column of the wide layout, about this many pixels across;
+# their series are downsampled to it (downsample.POINTS_PER_PIXEL points per pixel)
+TREND_CHART_WIDTH = 700
+
+def zoom_range(data, key):
+    """Date-range slider for trend charts; a narrower range is re-read at full resolution."""
+    first, last = data['Bulan'].iloc[0].date(), data['Bulan'].iloc[-1].date()
+    if first == last:
+        return first, last
+    return st.slider("🔍 Rentang waktu", min_value=first, max_value=last, value=(first, last),
+                     format="MMM YYYY", key=f"{key}_{first}_{last}")
+
+DRILL_SORT = {
+    'outstanding_balance': 'Outstanding',
+    'disbursed_amount': 'Plafon',
+    'disbursement_date': 'Tanggal Pencairan',
+    'collectibility_category': 'Kolektibilitas',
+    'loan_id': 'ID Kredit',
+}
+
+def loan_drilldown(title, scope, filters, key):
+    """Loans behind a selected table row, sorted, filtered and paged in the store."""
+    st.markdown(f"#### 🔎 {title}")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        sort_by = st.selectbox("Urutkan", list(DRILL_SORT), format_func=DRILL_SORT.get, key=f"{key}_sort")
+    with col2:
+        ascending = st.selectbox("Urutan", ["Terbesar", "Terkecil"], key=f"{key}_order") == "Terkecil"
+    with col3:
+        status = tuple(st.multiselect("Status", ["Active", "Default", "Closed"], key=f"{key}_status"))
+    with col4:
+        collectibility = tuple(st.multiselect("Kolektibilitas", [1, 2, 3, 4, 5], key=f"{key}_kol"))
+
+    args = (tuple(scope.items()), tuple(filters.items()), sort_by, ascending, status, collectibility,
+            str(refresher.watermark))
+    with perf.span('load_loan_index'):
+        index = load_loan_index(*args)
+    page = st.number_input(f"Halaman (dari {index.pages():,})", min_value=1, max_value=index.pages(), value=1,
+                           key=f"{key}_page_{hash(args)}")
+    with perf.span('load_loan_page'):
+        loans_page = load_loan_page(*args, page - 1)
+    loans_page = loans_page.assign(
+        disbursed_amount=formatting.scaled(loans_page['disbursed_amount'], 'Jt'),
+        outstanding_balance=formatting.scaled(loans_page['outstanding_balance'], 'Jt'),
+    )
+    with perf.span('st.dataframe'):
+        st.dataframe(
+            loans_page,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "loan_id": st.column_config.NumberColumn("ID Kredit", format="%d"),
+                "name": "Debitur",
+                "borrower_id": st.column_config.NumberColumn("ID Debitur", format="%d"),
+                "region": "Region",
+                "bank": "Bank",
+                "loan_type": "Jenis Kredit",
+                "disbursement_date": st.column_config.DateColumn("Tanggal Pencairan"),
+                "disbursed_amount": formatting.rupiah("Plafon", 'Jt', 1),
+                "outstanding_balance": formatting.rupiah("Outstanding", 'Jt', 1),
+                "collectibility_category": formatting.count("Kol"),
+                "status": "Status"
+            }
+        )
+    first = (page - 1) * drilldown.PAGE_SIZE
+    st.caption(f"Menampilkan {min(first + 1, len(index)):,}–{min(first + drilldown.PAGE_SIZE, len(index)):,} "
+               f"dari {len(index):,} kredit")
+
+def section(name):
+    """Run a dashboard section as a fragment: its own widgets rerun only that section."""
+    def decorate(render):
+        @st.fragment
+        @functools.wraps(render)
+        def run(*args):
+            tracing = perf.ENABLED or st.session_state.get('perf_panel', False)
+            with perf.fragment(name, tracing, session=st.session_state.get('session_tag')):
+                render(*args)
+        return run
+    return decorate
 
 # Header
 st.title("📊 Dashboard Monitoring Pembiayaan Petani Tebu KUR")
@@ -95,693 +326,1076 @@ col1, col2, col3, col4, col5 = st.columns(5)
 with col1:
     selected_month = st.date_input("Periode", datetime.now())
 with col2:
-    selected_region = st.selectbox("Region", ["Semua Region"] + list(regional_data['Region']))
+    selected_region = st.selectbox("Region", ["Semua Region"] + list(cube.axes['region']))
 with col3:
     selected_loan_type = st.selectbox("Jenis Kredit", ["Semua", "KUR", "KUR Khusus"])
 with col4:
     selected_masa_tanam = st.selectbox("Masa Tanam", ["Semua", "Musim Tanam 1", "Musim Tanam 2"])
 with col5:
-    selected_bank = st.selectbox("Bank", ["Semua Bank", "BRI", "BNI", "Mandiri", "BTN"])
-
-# Refresh button
+    selected_bank = st.selectbox("Bank", ["Semua Bank"] + list(cube.axes['bank']))
+
+# Every section is sliced from the cube with the same filters; changing one reruns the whole page
+filters = {
+    'until': selected_month,
+    'region': None if selected_region == "Semua Region" else selected_region,
+    'loan_type': None if selected_loan_type == "Semua" else selected_loan_type,
+    'masa_tanam': None if selected_masa_tanam == "Semua" else selected_masa_tanam,
+    'bank': None if selected_bank == "Semua Bank" else selected_bank,
+}
+warmer.record(filters)
+# Refresh button: merge only rows newer than the watermark into the cube
 if st.button("🔄 Refresh Data", type="primary"):
-    st.cache_data.clear()
-    st.rerun()
+    with perf.span('refresher.refresh'):
+        result = refresher.refresh()
+    st.toast(f"Data diperbarui: {result.loans:,} kredit, {result.payments:,} pembayaran "
+             f"dan {result.harvests:,} panen baru")
+
+with perf.span('cube.portfolio'):
+    portfolio_data = cube.portfolio(**filters)
+with perf.span('cube.regional'):
+    regional_data = cube.regional(**filters)
+if portfolio_data.empty:
+    first_month = pd.Timestamp(cube.axes['month'][0]) if len(cube.axes['month']) else None
+    st.warning(f"Belum ada data sampai {selected_month:%d %B %Y}"
+               + (f"; data dimulai {first_month:%B %Y}." if first_month is not None else "."))
+    perf.mark(None)
+    perf.end_run()
+    st.stop()
+
+def period_view(filters, name, live):
+    """A closed month's `name` aggregate from its snapshot (built on the spot if missing); the open month from live()."""
+    snapshot = snapshots.get(filters['until'])
+    return getattr(snapshot, name)(**filters) if snapshot is not None else live()
+
+def period_kpi(filters, portfolio_data, regional_data):
+    """Headline figures of the selected month and of the month before (None for the first data month)."""
+    def month_kpi(row, month):
+        snapshot = snapshots.get(month)
+        if snapshot is not None:
+            return snapshot.kpi(**filters)  # as of the month end, debtors included
+        # The open month: its debtors are those with a loan active now, as in the regional table
+        return {
+            'outstanding': row['KUR_Outstanding'] + row['KUR_Khusus_Outstanding'],
+            'disbursed': row['KUR_Disbursed'] + row['KUR_Khusus_Disbursed'],
+            'npl_rate': row['NPL_Rate'],
+            'collection_rate': row['Collection_Rate'],
+            'debtors': (regional_data if month == months.iloc[-1]
+                        else cube.regional(**{**filters, 'until': month}))['Jumlah_Debitur'].sum(),
+        }
+
+    # The last two months shown, which may end before the selected date when no data reaches it
+    months = portfolio_data['Bulan']
+    current = month_kpi(portfolio_data.iloc[-1], months.iloc[-1])
+    if len(months) < 2:
+        return current, None
+    return current, month_kpi(portfolio_data.iloc[-2], months.iloc[-2])
+
+# Figures are cached across sessions per data version, filters and source (a month's snapshot, or live)
+figure_cache = get_figure_cache()
+period_snapshot = snapshots.get(filters['until'])
+figure_key = (cube.version_for(**filters), tuple(filters.items()),
+              str(period_snapshot.period) if period_snapshot is not None else 'live')
 
 st.divider()
 
 # ===== SECTION 1: KEY PERFORMANCE INDICATORS =====
-st.markdown('<div class="section-header">📈 Indikator Kinerja Utama (KPI)</div>', unsafe_allow_html=True)
-
-current_month_data = portfolio_data.iloc[-1]
-prev_month_data = portfolio_data.iloc[-2]
-
-col1, col2, col3, col4, col5, col6 = st.columns(6)
-
-with col1:
-    total_outstanding = current_month_data['KUR_Outstanding'] + current_month_data['KUR_Khusus_Outstanding']
-    st.metric(
-        "Total Kredit Berjalan",
-        f"Rp {total_outstanding/1e9:.2f} M",
-        f"{((total_outstanding - (prev_month_data['KUR_Outstanding'] + prev_month_data['KUR_Khusus_Outstanding']))/1e9):.2f} M"
-    )
-
-with col2:
-    total_disbursed = current_month_data['KUR_Disbursed'] + current_month_data['KUR_Khusus_Disbursed']
-    st.metric(
-        "Total Kredit Selesai",
-        f"Rp {total_disbursed/1e9:.2f} M",
-        f"{((total_disbursed - (prev_month_data['KUR_Disbursed'] + prev_month_data['KUR_Khusus_Disbursed']))/1e9):.2f} M"
-    )
-
-with col3:
-    target_kredit = 15000000000000  # 15 Trillion target
-    achievement = (total_outstanding / target_kredit) * 100
-    st.metric(
-        "Pencapaian Target",
-        f"{achievement:.1f}%",
-        f"{(achievement - 85):.1f}%"
-    )
-
-with col4:
-    npl_rate = current_month_data['NPL_Rate']
-    npl_delta = npl_rate - prev_month_data['NPL_Rate']
-    st.metric(
-        "NPL Rate",
-        f"{npl_rate:.2f}%",
-        f"{npl_delta:.2f}%",
-        delta_color="inverse"
-    )
-
-with col5:
-    collection_rate = current_month_data['Collection_Rate']
-    collection_delta = collection_rate - prev_month_data['Collection_Rate']
-    st.metric(
-        "Collection Rate",
-        f"{collection_rate:.1f}%",
-        f"{collection_delta:.1f}%"
-    )
-
-with col6:
-    total_debitur = regional_data['Jumlah_Debitur'].sum()
-    st.metric(
-        "Jumlah Debitur Aktif",
-        f"{total_debitur:,}",
-        "+127"
-    )
-
-# Additional KPIs
-col1, col2, col3, col4, col5, col6 = st.columns(6)
-
-with col1:
-    avg_loan = total_outstanding / total_debitur
-    st.metric(
-        "Rata² Kredit/Petani",
-        f"Rp {avg_loan/1e6:.1f} Jt"
-    )
-
-with col2:
-    total_lahan = regional_data['Luas_Lahan_Ha'].sum()
-    st.metric(
-        "Total Lahan (Ha)",
-        f"{total_lahan:,}"
-    )
-
-with col3:
-    restructured_rate = 2.3
-    st.metric(
-        "Restrukturisasi",
-        f"{restructured_rate:.1f}%"
-    )
-
-with col4:
-    utilization_rate = 87.5
-    st.metric(
-        "Tingkat Utilisasi",
-        f"{utilization_rate:.1f}%"
-    )
-
-with col5:
-    coverage_ratio = 145
-    st.metric(
-        "Collateral Coverage",
-        f"{coverage_ratio}%"
-    )
-
-with col6:
-    subsidy_amount = 12500000000
-    st.metric(
-        "Subsidi Bunga",
-        f"Rp {subsidy_amount/1e9:.1f} M"
-    )
-
-st.divider()
+@section('KPI')
+def kpi_section(filters, portfolio_data, regional_data):
+    st.markdown('<div class="section-header">📈 Indikator Kinerja Utama (KPI)</div>', unsafe_allow_html=True)
+
+    with perf.span('period_kpi'):
+        current, previous = period_kpi(filters, portfolio_data, regional_data)
+
+    def delta(name, text):
+        # No delta for the first data month, or for a figure the previous month does not have
+        if previous is None or previous[name] is None:
+            return None
+        return text(current[name] - previous[name])
+
+    col1, col2, col3, col4, col5, col6 = st.columns(6)
+
+    with col1:
+        total_outstanding = current['outstanding']
+        st.metric(
+            "Total Kredit Berjalan",
+            f"Rp {total_outstanding/1e9:.2f} M",
+            delta('outstanding', lambda d: f"{d/1e9:.2f} M")
+        )
+
+    with col2:
+        total_disbursed = current['disbursed']
+        st.metric(
+            "Total Kredit Selesai",
+            f"Rp {total_disbursed/1e9:.2f} M",
+            delta('disbursed', lambda d: f"{d/1e9:.2f} M")
+        )
+
+    with col3:
+        target_kredit = 15000000000000  # 15 Trillion target
+        achievement = (total_outstanding / target_kredit) * 100
+        st.metric(
+            "Pencapaian Target",
+            f"{achievement:.1f}%",
+            f"{(achievement - 85):.1f}%"
+        )
+
+    with col4:
+        npl_rate = current['npl_rate']
+        st.metric(
+            "NPL Rate",
+            f"{npl_rate:.2f}%",
+            delta('npl_rate', lambda d: f"{d:.2f}%"),
+            delta_color="inverse"
+        )
+
+    with col5:
+        collection_rate = current['collection_rate']
+        st.metric(
+            "Collection Rate",
+            f"{collection_rate:.1f}%",
+            delta('collection_rate', lambda d: f"{d:.1f}%")
+        )
+
+    with col6:
+        total_debitur = current['debtors']
+        st.metric(
+            "Jumlah Debitur Aktif",
+            f"{total_debitur:,}",
+            delta('debtors', lambda d: f"{d:+,}")
+        )
+
+    # Additional KPIs
+    col1, col2, col3, col4, col5, col6 = st.columns(6)
+
+    with col1:
+        avg_loan = total_outstanding / total_debitur
+        st.metric(
+            "Rata² Kredit/Petani",
+            f"Rp {avg_loan/1e6:.1f} Jt"
+        )
+
+    with col2:
+        total_lahan = regional_data['Luas_Lahan_Ha'].sum()
+        st.metric(
+            "Total Lahan (Ha)",
+            f"{total_lahan:,}"
+        )
+
+    with col3:
+        restructured_rate = 2.3
+        st.metric(
+            "Restrukturisasi",
+            f"{restructured_rate:.1f}%"
+        )
+
+    with col4:
+        utilization_rate = 87.5
+        st.metric(
+            "Tingkat Utilisasi",
+            f"{utilization_rate:.1f}%"
+        )
+
+    with col5:
+        coverage_ratio = 145
+        st.metric(
+            "Collateral Coverage",
+            f"{coverage_ratio}%"
+        )
+
+    with col6:
+        subsidy_amount = 12500000000
+        st.metric(
+            "Subsidi Bunga",
+            f"Rp {subsidy_amount/1e9:.1f} M"
+        )
+
+    st.divider()
+
+kpi_section(filters, portfolio_data, regional_data)
 
 # ===== SECTION 2: PORTFOLIO ANALYSIS =====
-st.markdown('<div class="section-header">💼 Analisis Portfolio Kredit</div>', unsafe_allow_html=True)
-
-col1, col2 = st.columns(2)
-
-with col1:
-    # Comparison Chart: KUR vs KUR Khusus
-    fig_comparison = go.Figure()
-    
-    fig_comparison.add_trace(go.Bar(
-        name='KUR',
-        x=portfolio_data['Bulan'],
-        y=portfolio_data['KUR_Outstanding']/1e9,
-        marker_color='#1f77b4'
-    ))
-    
-    fig_comparison.add_trace(go.Bar(
-        name='KUR Khusus',
-        x=portfolio_data['Bulan'],
-        y=portfolio_data['KUR_Khusus_Outstanding']/1e9,
-        marker_color='#ff7f0e'
-    ))
-    
-    fig_comparison.update_layout(
-        title='Grafik Perbandingan KUR vs KUR Khusus (Outstanding)',
-        xaxis_title='Bulan',
-        yaxis_title='Nilai Kredit (Miliar Rp)',
-        barmode='group',
-        height=400,
-        hovermode='x unified'
-    )
-    
-    st.plotly_chart(fig_comparison, use_container_width=True)
-
-with col2:
-    # Portfolio Trend
-    fig_trend = go.Figure()
-    
-    portfolio_data['Total_Outstanding'] = (portfolio_data['KUR_Outstanding'] + 
-                                           portfolio_data['KUR_Khusus_Outstanding'])/1e9
-    
-    fig_trend.add_trace(go.Scatter(
-        x=portfolio_data['Bulan'],
-        y=portfolio_data['Total_Outstanding'],
-        mode='lines+markers',
-        name='Total Outstanding',
-        line=dict(color='#2ca02c', width=3),
-        fill='tonexty'
-    ))
-    
-    # Add target line
-    fig_trend.add_hline(y=15000, line_dash="dash", line_color="red", 
-                        annotation_text="Target 2025: Rp 15 T")
-    
-    fig_trend.update_layout(
-        title='Grafik Portfolio Kredit Tahunan',
-        xaxis_title='Bulan',
-        yaxis_title='Total Outstanding (Miliar Rp)',
-        height=400,
-        hovermode='x unified'
-    )
-    
-    st.plotly_chart(fig_trend, use_container_width=True)
-
-# Quarterly Performance
-col1, col2 = st.columns(2)
-
-with col1:
-    # Disbursement by Quarter
-    portfolio_data['Quarter'] = portfolio_data['Bulan'].dt.to_period('Q').astype(str)
-    quarterly_data = portfolio_data.groupby('Quarter').agg({
-        'KUR_Disbursed': 'sum',
-        'KUR_Khusus_Disbursed': 'sum'
-    }).reset_index()
-    
-    fig_quarterly = go.Figure()
-    fig_quarterly.add_trace(go.Bar(
-        name='KUR',
-        x=quarterly_data['Quarter'],
-        y=quarterly_data['KUR_Disbursed']/1e9,
-        marker_color='#1f77b4'
-    ))
-    fig_quarterly.add_trace(go.Bar(
-        name='KUR Khusus',
-        x=quarterly_data['Quarter'],
-        y=quarterly_data['KUR_Khusus_Disbursed']/1e9,
-        marker_color='#ff7f0e'
-    ))
-    
-    fig_quarterly.update_layout(
-        title='Penyaluran Kredit per Kuartal',
-        xaxis_title='Kuartal',
-        yaxis_title='Nilai Penyaluran (Miliar Rp)',
-        barmode='stack',
-        height=350
-    )
-    
-    st.plotly_chart(fig_quarterly, use_container_width=True)
-
-with col2:
-    # NPL Trend
-    fig_npl = go.Figure()
-    
-    fig_npl.add_trace(go.Scatter(
-        x=portfolio_data['Bulan'],
-        y=portfolio_data['NPL_Rate'],
-        mode='lines+markers',
-        name='NPL Rate',
-        line=dict(color='#d62728', width=2),
-        marker=dict(size=6)
-    ))
-    
-    # Add threshold lines
-    fig_npl.add_hline(y=5, line_dash="dash", line_color="orange", 
-                      annotation_text="Threshold: 5%", annotation_position="right")
-    fig_npl.add_hline(y=3, line_dash="dot", line_color="green", 
-                      annotation_text="Target: <3%", annotation_position="right")
-    
-    fig_npl.update_layout(
-        title='Trend Non-Performing Loan (NPL)',
-        xaxis_title='Bulan',
-        yaxis_title='NPL Rate (%)',
-        height=350,
-        yaxis_range=[0, 7]
-    )
-    
-    st.plotly_chart(fig_npl, use_container_width=True)
-
-st.divider()
+@section('Portfolio')
+def portfolio_section(portfolio_data, figure_key):
+    st.markdown('<div class="section-header">💼 Analisis Portfolio Kredit</div>', unsafe_allow_html=True)
+
+    # Trend charts are downsampled to the chart width; zooming in re-reads every point
+    zoom = zoom_range(portfolio_data, 'zoom_portfolio')
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        perf.step('fig_comparison')
+        fig_comparison = figure_cache.get(figure_key, 'fig_comparison')
+        if fig_comparison is None:
+            # Comparison Chart: KUR vs KUR Khusus
+            fig_comparison = go.Figure()
+
+            fig_comparison.add_trace(go.Bar(
+                name='KUR',
+                x=portfolio_data['Bulan'],
+                y=portfolio_data['KUR_Outstanding']/1e9,
+                marker_color='#1f77b4'
+            ))
+
+            fig_comparison.add_trace(go.Bar(
+                name='KUR Khusus',
+                x=portfolio_data['Bulan'],
+                y=portfolio_data['KUR_Khusus_Outstanding']/1e9,
+                marker_color='#ff7f0e'
+            ))
+
+            fig_comparison.update_layout(
+                title='Grafik Perbandingan KUR vs KUR Khusus (Outstanding)',
+                xaxis_title='Bulan',
+                yaxis_title='Nilai Kredit (Miliar Rp)',
+                barmode='group',
+                height=400,
+                hovermode='x unified'
+            )
+            fig_comparison = figure_cache.put(figure_key, 'fig_comparison', fig_comparison)
+
+        with perf.span('st.plotly_chart'):
+            st.plotly_chart(fig_comparison, use_container_width=True)
+
+    with col2:
+        perf.step('fig_trend')
+        fig_trend = figure_cache.get(figure_key, ('fig_trend', zoom))
+        if fig_trend is None:
+            # Portfolio Trend
+            fig_trend = go.Figure()
+
+            portfolio_data['Total_Outstanding'] = (portfolio_data['KUR_Outstanding'] + 
+                                                   portfolio_data['KUR_Khusus_Outstanding'])/1e9
+            trend_data = downsample.window(portfolio_data, 'Bulan', 'Total_Outstanding', *zoom,
+                                           width=TREND_CHART_WIDTH)
+
+            fig_trend.add_trace(go.Scatter(
+                x=trend_data['Bulan'],
+                y=trend_data['Total_Outstanding'],
+                mode='lines+markers',
+                name='Total Outstanding',
+                line=dict(color='#2ca02c', width=3),
+                fill='tonexty'
+            ))
+
+            # Add target line
+            fig_trend.add_hline(y=15000, line_dash="dash", line_color="red", 
+                                annotation_text="Target 2025: Rp 15 T")
+
+            fig_trend.update_layout(
+                title='Grafik Portfolio Kredit Tahunan',
+                xaxis_title='Bulan',
+                yaxis_title='Total Outstanding (Miliar Rp)',
+                height=400,
+                hovermode='x unified'
+            )
+            fig_trend = figure_cache.put(figure_key, ('fig_trend', zoom), fig_trend)
+
+        with perf.span('st.plotly_chart'):
+            st.plotly_chart(fig_trend, use_container_width=True)
+
+    # Quarterly Performance
+    col1, col2 = st.columns(2)
+
+    with col1:
+        perf.step('fig_quarterly')
+        fig_quarterly = figure_cache.get(figure_key, 'fig_quarterly')
+        if fig_quarterly is None:
+            # Disbursement by Quarter
+            portfolio_data['Quarter'] = portfolio_data['Bulan'].dt.to_period('Q').astype(str)
+            quarterly_data = portfolio_data.groupby('Quarter').agg({
+                'KUR_Disbursed': 'sum',
+                'KUR_Khusus_Disbursed': 'sum'
+            }).reset_index()
+
+            fig_quarterly = go.Figure()
+            fig_quarterly.add_trace(go.Bar(
+                name='KUR',
+                x=quarterly_data['Quarter'],
+                y=quarterly_data['KUR_Disbursed']/1e9,
+                marker_color='#1f77b4'
+            ))
+            fig_quarterly.add_trace(go.Bar(
+                name='KUR Khusus',
+                x=quarterly_data['Quarter'],
+                y=quarterly_data['KUR_Khusus_Disbursed']/1e9,
+                marker_color='#ff7f0e'
+            ))
+
+            fig_quarterly.update_layout(
+                title='Penyaluran Kredit per Kuartal',
+                xaxis_title='Kuartal',
+                yaxis_title='Nilai Penyaluran (Miliar Rp)',
+                barmode='stack',
+                height=350
+            )
+            fig_quarterly = figure_cache.put(figure_key, 'fig_quarterly', fig_quarterly)
+
+        with perf.span('st.plotly_chart'):
+            st.plotly_chart(fig_quarterly, use_container_width=True)
+
+    with col2:
+        perf.step('fig_npl')
+        fig_npl = figure_cache.get(figure_key, ('fig_npl', zoom))
+        if fig_npl is None:
+            # NPL Trend
+            fig_npl = go.Figure()
+            npl_data = downsample.window(portfolio_data, 'Bulan', 'NPL_Rate', *zoom,
+                                         width=TREND_CHART_WIDTH)
+
+            fig_npl.add_trace(go.Scatter(
+                x=npl_data['Bulan'],
+                y=npl_data['NPL_Rate'],
+                mode='lines+markers',
+                name='NPL Rate',
+                line=dict(color='#d62728', width=2),
+                marker=dict(size=6)
+            ))
+
+            # Add threshold lines
+            fig_npl.add_hline(y=5, line_dash="dash", line_color="orange", 
+                              annotation_text="Threshold: 5%", annotation_position="right")
+            fig_npl.add_hline(y=3, line_dash="dot", line_color="green", 
+                              annotation_text="Target: <3%", annotation_position="right")
+
+            fig_npl.update_layout(
+                title='Trend Non-Performing Loan (NPL)',
+                xaxis_title='Bulan',
+                yaxis_title='NPL Rate (%)',
+                height=350,
+                yaxis_range=[0, 7]
+            )
+            fig_npl = figure_cache.put(figure_key, ('fig_npl', zoom), fig_npl)
+
+        with perf.span('st.plotly_chart'):
+            st.plotly_chart(fig_npl, use_container_width=True)
+
+    st.divider()
+
+portfolio_section(portfolio_data, figure_key)
 
 # ===== SECTION 3: REGIONAL PERFORMANCE =====
-st.markdown('<div class="section-header">🗺️ Kinerja Regional</div>', unsafe_allow_html=True)
-
-col1, col2 = st.columns([2, 1])
-
-with col1:
-    # Regional distribution map (bar chart)
-    fig_regional = px.bar(
-        regional_data.sort_values('Total_Kredit', ascending=True),
-        y='Region',
-        x='Total_Kredit',
-        color='NPL_Rate',
-        orientation='h',
-        title='Distribusi Kredit dan NPL per Region',
-        labels={'Total_Kredit': 'Total Kredit (Rp)', 'NPL_Rate': 'NPL Rate (%)'},
-        color_continuous_scale='RdYlGn_r',
-        height=400
-    )
-    
-    fig_regional.update_traces(
-        text=regional_data.sort_values('Total_Kredit', ascending=True)['Total_Kredit'].apply(
-            lambda x: f'Rp {x/1e9:.1f} M'
-        ),
-        textposition='outside'
+@section('Regional')
+def regional_section(filters, regional_data, figure_key):
+    st.markdown('<div class="section-header">🗺️ Kinerja Regional</div>', unsafe_allow_html=True)
+
+    col1, col2 = st.columns([2, 1])
+
+    with col1:
+        perf.step('fig_regional')
+        fig_regional = figure_cache.get(figure_key, 'fig_regional')
+        if fig_regional is None:
+            # Regional distribution map (bar chart)
+            fig_regional = px.bar(
+                regional_data.sort_values('Total_Kredit', ascending=True),
+                y='Region',
+                x='Total_Kredit',
+                color='NPL_Rate',
+                orientation='h',
+                title='Distribusi Kredit dan NPL per Region',
+                labels={'Total_Kredit': 'Total Kredit (Rp)', 'NPL_Rate': 'NPL Rate (%)'},
+                color_continuous_scale='RdYlGn_r',
+                height=400
+            )
+
+            fig_regional.update_traces(
+                **formatting.rupiah_labels(regional_data.sort_values('Total_Kredit', ascending=True)['Total_Kredit']),
+                textposition='outside'
+            )
+            fig_regional = figure_cache.put(figure_key, 'fig_regional', fig_regional)
+
+        with perf.span('st.plotly_chart'):
+            st.plotly_chart(fig_regional, use_container_width=True)
+
+    with col2:
+        perf.step('top_regions')
+        st.markdown("#### 📊 Top 3 Region")
+
+        top_regions = regional_data.nlargest(3, 'Total_Kredit')
+
+        for idx, row in top_regions.iterrows():
+            npl_class = "alert-good" if row['NPL_Rate'] < 3 else "alert-medium" if row['NPL_Rate'] < 5 else "alert-high"
+
+            st.markdown(f"""
+            <div class="metric-card {npl_class}">
+                <h4>{row['Region']}</h4>
+                <p><strong>Total Kredit:</strong> Rp {row['Total_Kredit']/1e9:.2f} M</p>
+                <p><strong>Debitur:</strong> {row['Jumlah_Debitur']:,} petani</p>
+                <p><strong>NPL Rate:</strong> {row['NPL_Rate']:.2f}%</p>
+                <p><strong>Luas Lahan:</strong> {row['Luas_Lahan_Ha']:,} Ha</p>
+            </div>
+            <br>
+            """, unsafe_allow_html=True)
+
+    # Regional detailed table
+    st.markdown("#### 📋 Detail Kinerja per Region")
+    perf.step('regional_table')
+    regional_display = regional_data.assign(
+        Total_Kredit=formatting.scaled(regional_data['Total_Kredit'], 'M'),
+        Rata_Kredit_per_Petani=formatting.scaled(regional_data['Rata_Kredit_per_Petani'], 'Jt'),
     )
-    
-    st.plotly_chart(fig_regional, use_container_width=True)
-
-with col2:
-    st.markdown("#### 📊 Top 3 Region")
-    
-    top_regions = regional_data.nlargest(3, 'Total_Kredit')
-    
-    for idx, row in top_regions.iterrows():
-        npl_class = "alert-good" if row['NPL_Rate'] < 3 else "alert-medium" if row['NPL_Rate'] < 5 else "alert-high"
-        
-        st.markdown(f"""
-        <div class="metric-card {npl_class}">
-            <h4>{row['Region']}</h4>
-            <p><strong>Total Kredit:</strong> Rp {row['Total_Kredit']/1e9:.2f} M</p>
-            <p><strong>Debitur:</strong> {row['Jumlah_Debitur']:,} petani</p>
-            <p><strong>NPL Rate:</strong> {row['NPL_Rate']:.2f}%</p>
-            <p><strong>Luas Lahan:</strong> {row['Luas_Lahan_Ha']:,} Ha</p>
-        </div>
-        <br>
-        """, unsafe_allow_html=True)
-
-# Regional detailed table
-st.markdown("#### 📋 Detail Kinerja per Region")
-regional_display = regional_data.copy()
-regional_display['Total_Kredit'] = regional_display['Total_Kredit'].apply(lambda x: f"Rp {x/1e9:.2f} M")
-regional_display['Rata_Kredit_per_Petani'] = regional_display['Rata_Kredit_per_Petani'].apply(lambda x: f"Rp {x/1e6:.1f} Jt")
-regional_display['NPL_Rate'] = regional_display['NPL_Rate'].apply(lambda x: f"{x:.2f}%")
-regional_display['Luas_Lahan_Ha'] = regional_display['Luas_Lahan_Ha'].apply(lambda x: f"{x:,} Ha")
-
-st.dataframe(
-    regional_display,
-    use_container_width=True,
-    hide_index=True,
-    column_config={
-        "Region": "Region",
-        "Total_Kredit": "Total Kredit",
-        "Jumlah_Debitur": "Jumlah Debitur",
-        "NPL_Rate": "NPL Rate",
-        "Luas_Lahan_Ha": "Luas Lahan",
-        "Rata_Kredit_per_Petani": "Rata² Kredit/Petani"
-    }
-)
 
-st.divider()
+    with perf.span('st.dataframe'):
+        selected = st.dataframe(
+            regional_display,
+            use_container_width=True,
+            hide_index=True,
+            on_select="rerun",
+            selection_mode="single-row",
+            column_config={
+                "Region": "Region",
+                "Total_Kredit": formatting.rupiah("Total Kredit", 'M'),
+                "Jumlah_Debitur": formatting.count("Jumlah Debitur"),
+                "NPL_Rate": formatting.percent("NPL Rate"),
+                "Luas_Lahan_Ha": formatting.hectare("Luas Lahan"),
+                "Rata_Kredit_per_Petani": formatting.rupiah("Rata² Kredit/Petani", 'Jt', 1)
+            }
+        )
+
+    # Selecting a region opens its loans, paged from the store
+    if selected.selection.rows:
+        region = regional_data['Region'].iloc[selected.selection.rows[0]]
+        perf.step('region_drilldown')
+        loan_drilldown(f"Kredit di {region}", {'region': region}, filters, key='drill_region')
+
+    st.divider()
+
+regional_section(filters, regional_data, figure_key)
 
 # ===== SECTION 4: RISK ANALYSIS =====
-st.markdown('<div class="section-header">⚠️ Analisis Risiko & Collection</div>', unsafe_allow_html=True)
-
-col1, col2 = st.columns(2)
-
-with col1:
-    # Aging analysis
-    fig_aging = go.Figure()
-    
-    fig_aging.add_trace(go.Bar(
-        name='KUR',
-        x=aging_data['Kategori'],
-        y=aging_data['KUR']/1e9,
-        marker_color='#1f77b4'
-    ))
-    
-    fig_aging.add_trace(go.Bar(
-        name='KUR Khusus',
-        x=aging_data['Kategori'],
-        y=aging_data['KUR_Khusus']/1e9,
-        marker_color='#ff7f0e'
-    ))
-    
-    fig_aging.update_layout(
-        title='Aging Analysis - Kualitas Kredit',
-        xaxis_title='Kategori Kolektibilitas',
-        yaxis_title='Nilai Kredit (Miliar Rp)',
-        barmode='group',
-        height=400
-    )
-    
-    st.plotly_chart(fig_aging, use_container_width=True)
-
-with col2:
-    # Collection rate trend
-    fig_collection = go.Figure()
-    
-    fig_collection.add_trace(go.Scatter(
-        x=portfolio_data['Bulan'],
-        y=portfolio_data['Collection_Rate'],
-        mode='lines+markers',
-        name='Collection Rate',
-        line=dict(color='#2ca02c', width=3),
-        fill='tonexty',
-        marker=dict(size=6)
-    ))
-    
-    fig_collection.add_hline(y=90, line_dash="dash", line_color="orange", 
-                             annotation_text="Minimum Target: 90%")
-    
-    fig_collection.update_layout(
-        title='Trend Collection Rate',
-        xaxis_title='Bulan',
-        yaxis_title='Collection Rate (%)',
-        height=400,
-        yaxis_range=[80, 100]
-    )
-    
-    st.plotly_chart(fig_collection, use_container_width=True)
-
-# Risk indicators
-col1, col2, col3, col4 = st.columns(4)
-
-with col1:
-    st.markdown("""
-    <div class="metric-card alert-good">
-        <h4>✅ Kredit Lancar</h4>
-        <h2>85.2%</h2>
-        <p>Rp 1,370 M</p>
-    </div>
-    """, unsafe_allow_html=True)
-
-with col2:
-    st.markdown("""
-    <div class="metric-card alert-medium">
-        <h4>⚠️ Dalam Perhatian Khusus</h4>
-        <h2>6.8%</h2>
-        <p>Rp 110 M</p>
-    </div>
-    """, unsafe_allow_html=True)
-
-with col3:
-    st.markdown("""
-    <div class="metric-card alert-medium">
-        <h4>⚠️ Kurang Lancar</h4>
-        <h2>4.5%</h2>
-        <p>Rp 73 M</p>
-    </div>
-    """, unsafe_allow_html=True)
-
-with col4:
-    st.markdown("""
-    <div class="metric-card alert-high">
-        <h4>🚨 Macet</h4>
-        <h2>3.5%</h2>
-        <p>Rp 57 M</p>
-    </div>
-    """, unsafe_allow_html=True)
-
-st.divider()
+# Risk indicators (collectibility as of the selected period)
+RISK_CARDS = [
+    ("alert-good", "✅", "Kredit Lancar", [1]),
+    ("alert-medium", "⚠️", "Dalam Perhatian Khusus", [2]),
+    ("alert-medium", "⚠️", "Kurang Lancar & Diragukan", [3, 4]),
+    ("alert-high", "🚨", "Macet", [5]),
+]
+
+def risk_summary(collectibility_data):
+    """(card class, icon, title, share %, outstanding) per risk card."""
+    cards = []
+    for card_class, icon, title, categories in RISK_CARDS:
+        rows = collectibility_data[collectibility_data['Kolektibilitas'].isin(categories)]
+        cards.append((card_class, icon, title, rows['Persentase'].sum(), rows['Outstanding'].sum()))
+    return cards
+
+@section('Risk')
+def risk_section(filters, portfolio_data, figure_key):
+    st.markdown('<div class="section-header">⚠️ Analisis Risiko & Collection</div>', unsafe_allow_html=True)
+
+    with perf.span('aging.aging'):
+        aging_data = period_view(filters, 'aging', lambda: aging_engine.aging(**filters))
+    with perf.span('aging.collectibility'):
+        collectibility_data = period_view(filters, 'collectibility', lambda: aging_engine.collectibility(**filters))
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        perf.step('fig_aging')
+        fig_aging = figure_cache.get(figure_key, 'fig_aging')
+        if fig_aging is None:
+            # Aging analysis
+            fig_aging = go.Figure()
+
+            fig_aging.add_trace(go.Bar(
+                name='KUR',
+                x=aging_data['Kategori'],
+                y=aging_data['KUR']/1e9,
+                marker_color='#1f77b4'
+            ))
+
+            fig_aging.add_trace(go.Bar(
+                name='KUR Khusus',
+                x=aging_data['Kategori'],
+                y=aging_data['KUR_Khusus']/1e9,
+                marker_color='#ff7f0e'
+            ))
+
+            fig_aging.update_layout(
+                title='Aging Analysis - Kualitas Kredit',
+                xaxis_title='Kategori Kolektibilitas',
+                yaxis_title='Nilai Kredit (Miliar Rp)',
+                barmode='group',
+                height=400
+            )
+            fig_aging = figure_cache.put(figure_key, 'fig_aging', fig_aging)
+
+        with perf.span('st.plotly_chart'):
+            st.plotly_chart(fig_aging, use_container_width=True)
+
+    with col2:
+        perf.step('fig_collection')
+        zoom = zoom_range(portfolio_data, 'zoom_risk')
+        fig_collection = figure_cache.get(figure_key, ('fig_collection', zoom))
+        if fig_collection is None:
+            # Collection rate trend
+            fig_collection = go.Figure()
+            collection_data = downsample.window(portfolio_data, 'Bulan', 'Collection_Rate', *zoom,
+                                                width=TREND_CHART_WIDTH)
+
+            fig_collection.add_trace(go.Scatter(
+                x=collection_data['Bulan'],
+                y=collection_data['Collection_Rate'],
+                mode='lines+markers',
+                name='Collection Rate',
+                line=dict(color='#2ca02c', width=3),
+                fill='tonexty',
+                marker=dict(size=6)
+            ))
+
+            fig_collection.add_hline(y=90, line_dash="dash", line_color="orange", 
+                                     annotation_text="Minimum Target: 90%")
+
+            fig_collection.update_layout(
+                title='Trend Collection Rate',
+                xaxis_title='Bulan',
+                yaxis_title='Collection Rate (%)',
+                height=400,
+                yaxis_range=[80, 100]
+            )
+            fig_collection = figure_cache.put(figure_key, ('fig_collection', zoom), fig_collection)
+
+        with perf.span('st.plotly_chart'):
+            st.plotly_chart(fig_collection, use_container_width=True)
+
+    perf.step('risk_cards')
+    for col, (card_class, icon, title, share, outstanding) in zip(st.columns(4), risk_summary(collectibility_data)):
+        with col:
+            st.markdown(f"""
+            <div class="metric-card {card_class}">
+                <h4>{icon} {title}</h4>
+                <h2>{share:.1f}%</h2>
+                <p>Rp {outstanding/1e9:,.0f} M</p>
+            </div>
+            """, unsafe_allow_html=True)
+
+    st.divider()
+
+risk_section(filters, portfolio_data, figure_key)
 
 # ===== SECTION 5: FARMER SEGMENTATION =====
-st.markdown('<div class="section-header">👥 Segmentasi Debitur</div>', unsafe_allow_html=True)
-
-col1, col2 = st.columns(2)
-
-with col1:
-    # Farmer segmentation pie chart
-    fig_segment = px.pie(
-        segment_data,
-        values='Jumlah',
-        names='Segmen',
-        title='Distribusi Debitur per Segmen',
-        color_discrete_sequence=px.colors.qualitative.Set3,
-        height=400
-    )
-    
-    fig_segment.update_traces(textposition='inside', textinfo='percent+label')
-    
-    st.plotly_chart(fig_segment, use_container_width=True)
-
-with col2:
-    # NPL by segment
-    fig_segment_npl = px.bar(
-        segment_data.sort_values('NPL_Rate'),
-        x='Segmen',
-        y='NPL_Rate',
-        title='NPL Rate per Segmen Debitur',
-        color='NPL_Rate',
-        color_continuous_scale='RdYlGn_r',
-        height=400
+@section('Segmentation')
+def segmentation_section(filters, figure_key):
+    st.markdown('<div class="section-header">👥 Segmentasi Debitur</div>', unsafe_allow_html=True)
+    if not st.toggle("Tampilkan", key="open_segmentation"):
+        return
+
+    with perf.span('load_segment_data'):
+        segment_data = period_view(filters, 'segment_frame', lambda: load_segment_data(tuple(filters.items())))
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        perf.step('fig_segment')
+        fig_segment = figure_cache.get(figure_key, 'fig_segment')
+        if fig_segment is None:
+            # Farmer segmentation pie chart
+            fig_segment = px.pie(
+                segment_data,
+                values='Jumlah',
+                names='Segmen',
+                title='Distribusi Debitur per Segmen',
+                color_discrete_sequence=px.colors.qualitative.Set3,
+                height=400
+            )
+
+            fig_segment.update_traces(textposition='inside', textinfo='percent+label')
+            fig_segment = figure_cache.put(figure_key, 'fig_segment', fig_segment)
+
+        with perf.span('st.plotly_chart'):
+            st.plotly_chart(fig_segment, use_container_width=True)
+
+    with col2:
+        perf.step('fig_segment_npl')
+        fig_segment_npl = figure_cache.get(figure_key, 'fig_segment_npl')
+        if fig_segment_npl is None:
+            # NPL by segment
+            fig_segment_npl = px.bar(
+                segment_data.sort_values('NPL_Rate'),
+                x='Segmen',
+                y='NPL_Rate',
+                title='NPL Rate per Segmen Debitur',
+                color='NPL_Rate',
+                color_continuous_scale='RdYlGn_r',
+                height=400
+            )
+
+            fig_segment_npl.update_traces(**formatting.percent_labels(segment_data.sort_values('NPL_Rate')['NPL_Rate']))
+            fig_segment_npl.add_hline(y=3, line_dash="dash", line_color="green", annotation_text="Target NPL: 3%")
+            fig_segment_npl = figure_cache.put(figure_key, 'fig_segment_npl', fig_segment_npl)
+
+        with perf.span('st.plotly_chart'):
+            st.plotly_chart(fig_segment_npl, use_container_width=True)
+
+    # Segmentation details
+    st.markdown("#### 📋 Detail Segmentasi Debitur")
+
+    perf.step('segment_table')
+    segment_display = segment_data.assign(
+        Total_Kredit=formatting.scaled(segment_data['Total_Kredit'], 'M'),
+        Rata_Kredit=formatting.scaled(segment_data['Total_Kredit'] / segment_data['Jumlah'], 'Jt'),
     )
-    
-    fig_segment_npl.update_traces(text=segment_data.sort_values('NPL_Rate')['NPL_Rate'].apply(lambda x: f'{x:.1f}%'))
-    fig_segment_npl.add_hline(y=3, line_dash="dash", line_color="green", annotation_text="Target NPL: 3%")
-    
-    st.plotly_chart(fig_segment_npl, use_container_width=True)
-
-# Segmentation details
-st.markdown("#### 📋 Detail Segmentasi Debitur")
-
-segment_display = segment_data.copy()
-segment_display['Total_Kredit'] = segment_display['Total_Kredit'].apply(lambda x: f"Rp {x/1e9:.2f} M")
-segment_display['NPL_Rate'] = segment_display['NPL_Rate'].apply(lambda x: f"{x:.2f}%")
-segment_display['Rata_Kredit'] = segment_data.apply(lambda x: f"Rp {(x['Total_Kredit']/x['Jumlah'])/1e6:.1f} Jt", axis=1)
-
-st.dataframe(
-    segment_display,
-    use_container_width=True,
-    hide_index=True,
-    column_config={
-        "Segmen": "Segmen Debitur",
-        "Jumlah": "Jumlah Debitur",
-        "Total_Kredit": "Total Kredit",
-        "NPL_Rate": "NPL Rate",
-        "Rata_Kredit": "Rata² Kredit"
-    }
-)
 
-st.divider()
+    with perf.span('st.dataframe'):
+        selected = st.dataframe(
+            segment_display,
+            use_container_width=True,
+            hide_index=True,
+            on_select="rerun",
+            selection_mode="single-row",
+            column_config={
+                "Segmen": "Segmen Debitur",
+                "Jumlah": formatting.count("Jumlah Debitur"),
+                "Total_Kredit": formatting.rupiah("Total Kredit", 'M'),
+                "NPL_Rate": formatting.percent("NPL Rate"),
+                "Rata_Kredit": formatting.rupiah("Rata² Kredit", 'Jt', 1)
+            }
+        )
+
+    # Selecting a segment opens its loans, paged from the store
+    if selected.selection.rows:
+        segment = segment_data['Segmen'].iloc[selected.selection.rows[0]]
+        perf.step('segment_drilldown')
+        loan_drilldown(f"Kredit segmen {segment}", {'segment': segment}, filters, key='drill_segment')
+
+    st.divider()
+
+segmentation_section(filters, figure_key)
 
 # ===== SECTION 6: SEASONAL & AGRICULTURAL INSIGHTS =====
-st.markdown('<div class="section-header">🌾 Analisis Musim Tanam & Produktivitas</div>', unsafe_allow_html=True)
+# Harvest cycle alignment: the twelve months up to the period, from harvests and payments
+harvest_calendar = refresher.targets['harvest']
+
+def load_harvest_data(filters):
+    with perf.span('harvest.alignment'):
+        return harvest_calendar.alignment(**filters)
+
+# Productivity vs loan performance, in the band edges typed in this section (default: BAND_EDGES)
+bands_engine = refresher.targets['bands']
+DEFAULT_BANDS = ", ".join(f"{edge:g}" for edge in productivity_bands.BAND_EDGES)
+
+def band_edges():
+    try:
+        return productivity_bands.parse_edges(st.session_state.get('productivity_bands', DEFAULT_BANDS))
+    except ValueError:
+        return productivity_bands.BAND_EDGES
+
+def load_productivity_data(filters):
+    with perf.span('bands.frame'):
+        return bands_engine.frame(band_edges(), **filters)
+
+@section('Seasonal')
+def seasonal_section(filters):
+    st.markdown('<div class="section-header">🌾 Analisis Musim Tanam & Produktivitas</div>', unsafe_allow_html=True)
+    if not st.toggle("Tampilkan", key="open_seasonal"):
+        return
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        perf.step('fig_harvest')
+        harvest_key = (harvest_calendar.version, tuple(filters.items()))
+        fig_harvest = figure_cache.get(harvest_key, 'fig_harvest')
+        if fig_harvest is None:
+            harvest_data = load_harvest_data(filters)
+            fig_harvest = go.Figure()
+
+            fig_harvest.add_trace(go.Scatter(
+                x=harvest_data['Bulan'],
+                y=harvest_data['Panen_Expected'],
+                mode='lines+markers',
+                name='Perkiraan Panen (%)',
+                line=dict(color='#2ca02c', width=2)
+            ))
+
+            fig_harvest.add_trace(go.Scatter(
+                x=harvest_data['Bulan'],
+                y=harvest_data['Pembayaran_Aktual'],
+                mode='lines+markers',
+                name='Pembayaran Aktual (%)',
+                line=dict(color='#1f77b4', width=2)
+            ))
+
+            fig_harvest.update_layout(
+                title='Alignment Musim Panen vs Pembayaran Kredit',
+                xaxis_title='Bulan',
+                yaxis_title='Persentase dari Total Tahunan (%)',
+                height=400,
+                hovermode='x unified'
+            )
+            fig_harvest = figure_cache.put(harvest_key, 'fig_harvest', fig_harvest)
+
+        with perf.span('st.plotly_chart'):
+            st.plotly_chart(fig_harvest, use_container_width=True)
+
+    with col2:
+        perf.step('fig_productivity')
+        bands = st.text_input("Batas band produktivitas (ton/ha)", DEFAULT_BANDS, key='productivity_bands')
+        try:
+            productivity_bands.parse_edges(bands)
+        except ValueError as e:
+            st.warning(f"{e}; memakai {DEFAULT_BANDS}")
+        productivity_data = load_productivity_data(filters)
+        productivity_key = (bands_engine.version, band_edges(), tuple(filters.items()))
+        fig_productivity = figure_cache.get(productivity_key, 'fig_productivity')
+        if fig_productivity is None:
+            fig_productivity = go.Figure()
+
+            fig_productivity.add_trace(go.Bar(
+                name='Jumlah Petani',
+                x=productivity_data['Produktivitas'],
+                y=productivity_data['Jumlah_Petani'],
+                marker_color='#2ca02c',
+                yaxis='y',
+                offsetgroup=1
+            ))
+
+            fig_productivity.add_trace(go.Scatter(
+                name='NPL Rate',
+                x=productivity_data['Produktivitas'],
+                y=productivity_data['NPL_Rate'],
+                marker_color='#d62728',
+                yaxis='y2',
+                mode='lines+markers',
+                line=dict(width=3)
+            ))
+
+            fig_productivity.update_layout(
+                title='Produktivitas Lahan vs Kinerja Kredit',
+                xaxis_title='Tingkat Produktivitas',
+                yaxis=dict(title='Jumlah Petani', side='left'),
+                yaxis2=dict(title='NPL Rate (%)', side='right', overlaying='y'),
+                height=400,
+                hovermode='x unified'
+            )
+            fig_productivity = figure_cache.put(productivity_key, 'fig_productivity', fig_productivity)
+
+        with perf.span('st.plotly_chart'):
+            st.plotly_chart(fig_productivity, use_container_width=True)
+
+    st.divider()
+
+seasonal_section(filters)
 
-col1, col2 = st.columns(2)
+# ===== SECTION 7: EARLY WARNING SYSTEM =====
+def load_alert_data(filters):
+    return period_view(filters, 'alert_summary', lambda: ews_engine.summary(**filters))
 
-with col1:
-    # Harvest cycle alignment
-    harvest_data = pd.DataFrame({
-        'Bulan': ['Jan', 'Feb', 'Mar', 'Apr', 'Mei', 'Jun', 'Jul', 'Agt', 'Sep', 'Okt', 'Nov', 'Des'],
-        'Panen_Expected': [15, 18, 25, 30, 20, 15, 10, 12, 20, 28, 32, 25],
-        'Pembayaran_Aktual': [14, 17, 24, 28, 19, 14, 9, 11, 19, 26, 30, 23]
-    })
-    
-    fig_harvest = go.Figure()
-    
-    fig_harvest.add_trace(go.Scatter(
-        x=harvest_data['Bulan'],
-        y=harvest_data['Panen_Expected'],
-        mode='lines+markers',
-        name='Perkiraan Panen (%)',
-        line=dict(color='#2ca02c', width=2)
-    ))
-    
-    fig_harvest.add_trace(go.Scatter(
-        x=harvest_data['Bulan'],
-        y=harvest_data['Pembayaran_Aktual'],
-        mode='lines+markers',
-        name='Pembayaran Aktual (%)',
-        line=dict(color='#1f77b4', width=2)
-    ))
-    
-    fig_harvest.update_layout(
-        title='Alignment Musim Panen vs Pembayaran Kredit',
-        xaxis_title='Bulan',
-        yaxis_title='Persentase dari Total Tahunan (%)',
-        height=400,
-        hovermode='x unified'
-    )
-    
-    st.plotly_chart(fig_harvest, use_container_width=True)
+@section('EWS')
+def ews_section(filters):
+    st.markdown('<div class="section-header">🚨 Early Warning System</div>', unsafe_allow_html=True)
+    if not st.toggle("Tampilkan", key="open_ews"):
+        return
 
-with col2:
-    # Productivity vs loan performance
-    productivity_data = pd.DataFrame({
-        'Produktivitas': ['<60 ton/ha', '60-80 ton/ha', '80-100 ton/ha', '>100 ton/ha'],
-        'Jumlah_Petani': [850, 1920, 1680, 550],
-        'NPL_Rate': [5.2, 2.8, 1.9, 1.2],
-        'Avg_Loan': [45, 62, 78, 95]
-    })
-    
-    fig_productivity = go.Figure()
-    
-    fig_productivity.add_trace(go.Bar(
-        name='Jumlah Petani',
-        x=productivity_data['Produktivitas'],
-        y=productivity_data['Jumlah_Petani'],
-        marker_color='#2ca02c',
-        yaxis='y',
-        offsetgroup=1
-    ))
-    
-    fig_productivity.add_trace(go.Scatter(
-        name='NPL Rate',
-        x=productivity_data['Produktivitas'],
-        y=productivity_data['NPL_Rate'],
-        marker_color='#d62728',
-        yaxis='y2',
-        mode='lines+markers',
-        line=dict(width=3)
-    ))
-    
-    fig_productivity.update_layout(
-        title='Produktivitas Lahan vs Kinerja Kredit',
-        xaxis_title='Tingkat Produktivitas',
-        yaxis=dict(title='Jumlah Petani', side='left'),
-        yaxis2=dict(title='NPL Rate (%)', side='right', overlaying='y'),
-        height=400,
-        hovermode='x unified'
-    )
-    
-    st.plotly_chart(fig_productivity, use_container_width=True)
+    with perf.span('load_alert_data'):
+        alert_data = load_alert_data(filters)
+    alert_data = alert_data.assign(**{'Potensi Dampak': formatting.scaled(alert_data['Potensi Dampak'])})
 
-st.divider()
+    col1, col2, col3 = st.columns(3)
 
-# ===== SECTION 7: EARLY WARNING SYSTEM =====
-st.markdown('<div class="section-header">🚨 Early Warning System</div>', unsafe_allow_html=True)
+    with col1:
+        late = alert_data.loc['late_30']
+        st.markdown(f"""
+        <div class="metric-card {'alert-high' if late['Jumlah Debitur'] else 'alert-good'}">
+            <h4>🚨 Tunggakan 30+ Hari</h4>
+            <h3>{'TINGGI' if late['Jumlah Debitur'] else 'AMAN'}</h3>
+            <p><strong>{late['Jumlah Debitur']:,} debitur</strong> menunggak 30 hari atau lebih</p>
+            <p>Potensi dampak: Rp {late['Potensi Dampak']:,.1f} M</p>
+            <p style="margin-top: 10px;"><small>⚠️ Perlu collection intensif</small></p>
+        </div>
+        """, unsafe_allow_html=True)
 
-col1, col2, col3 = st.columns(3)
+    with col2:
+        price, change = ews_engine.market_price(**filters)
+        price_class = ("alert-high" if -change >= ews.THRESHOLDS['price_fluctuation']
+                       else "alert-medium" if change < 0 else "alert-good")
+        price_level = {"alert-high": "TINGGI", "alert-medium": "SEDANG", "alert-good": "RENDAH"}[price_class]
+        st.markdown(f"""
+        <div class="metric-card {price_class}">
+            <h4>📉 Risiko Harga</h4>
+            <h3>{price_level}</h3>
+            <p><strong>Harga tebu:</strong> {'-' if np.isnan(price) else f'Rp {price:,.0f}/kg'}</p>
+            <p>{'Turun' if change < 0 else 'Naik'} {abs(change):.1f}% dari bulan lalu</p>
+            <p style="margin-top: 10px;"><small>⚠️ Monitoring pembayaran</small></p>
+        </div>
+        """, unsafe_allow_html=True)
 
-with col1:
-    st.markdown("""
-    <div class="metric-card alert-high">
-        <h4>🌧️ Risiko Cuaca</h4>
-        <h3>TINGGI</h3>
-        <p><strong>345 debitur</strong> di area rawan banjir</p>
-        <p>Potensi dampak: Rp 28 M</p>
-        <p style="margin-top: 10px;"><small>⚠️ Perlu monitoring intensif</small></p>
-    </div>
-    """, unsafe_allow_html=True)
+    with col3:
+        maturity = alert_data.loc['maturity']
+        st.markdown(f"""
+        <div class="metric-card alert-medium">
+            <h4>⏰ Jatuh Tempo</h4>
+            <h3>PERHATIAN</h3>
+            <p><strong>{maturity['Jumlah Debitur']:,} debitur</strong> jatuh tempo {ews.THRESHOLDS['payment_due_days']} hari</p>
+            <p>Total: Rp {maturity['Potensi Dampak']:,.1f} M</p>
+            <p style="margin-top: 10px;"><small>📞 Lakukan reminder call</small></p>
+        </div>
+        """, unsafe_allow_html=True)
 
-with col2:
-    st.markdown("""
-    <div class="metric-card alert-medium">
-        <h4>📉 Risiko Harga</h4>
-        <h3>SEDANG</h3>
-        <p><strong>Harga tebu:</strong> Rp 680/kg</p>
-        <p>Turun 8.5% dari bulan lalu</p>
-        <p style="margin-top: 10px;"><small>⚠️ Monitoring pembayaran</small></p>
-    </div>
-    """, unsafe_allow_html=True)
+    # Alert details
+    st.markdown("#### 📋 Detail Alert Risiko")
 
-with col3:
-    st.markdown("""
-    <div class="metric-card alert-medium">
-        <h4>⏰ Jatuh Tempo</h4>
-        <h3>PERHATIAN</h3>
-        <p><strong>682 debitur</strong> jatuh tempo 30 hari</p>
-        <p>Total: Rp 54.6 M</p>
-        <p style="margin-top: 10px;"><small>📞 Lakukan reminder call</small></p>
-    </div>
-    """, unsafe_allow_html=True)
-
-# Alert details
-st.markdown("#### 📋 Detail Alert Risiko")
-
-alert_data = pd.DataFrame({
-    'Prioritas': ['🔴 Tinggi', '🔴 Tinggi', '🟡 Sedang', '🟡 Sedang', '🟢 Rendah'],
-    'Jenis Risiko': ['NPL > 5% di Jawa Timur', 'Delay pembayaran 30+ hari', 
-                     'Produktivitas menurun 15%', 'Harga tebu turun 8.5%', 
-                     'Keterlambatan 1-15 hari'],
-    'Jumlah Debitur': [156, 234, 445, 'Area-based', 387],
-    'Potensi Dampak': ['Rp 18.5 M', 'Rp 23.4 M', 'Rp 38.2 M', 'Rp 15.6 M', 'Rp 12.8 M'],
-    'Tindakan': ['Site visit & restrukturisasi', 'Collection intensif', 
-                 'Pendampingan teknis', 'Monitor harga pasar', 'Reminder call']
-})
+    perf.step('alert_table')
+    with perf.span('st.dataframe'):
+        st.dataframe(alert_data, use_container_width=True, hide_index=True, column_config={
+            "Jumlah Debitur": formatting.count("Jumlah Debitur"),
+            "Potensi Dampak": formatting.rupiah("Potensi Dampak"),
+        })
+        st.caption(f"Evaluasi per {ews_engine.day}; diperbarui otomatis setiap {ews.EWS_INTERVAL // 60} menit")
 
-st.dataframe(alert_data, use_container_width=True, hide_index=True)
+    st.divider()
 
-st.divider()
+ews_section(filters)
 
 # ===== SECTION 8: COMPLIANCE & REPORTING =====
-st.markdown('<div class="section-header">📊 Compliance & Reporting BI</div>', unsafe_allow_html=True)
+compliance_data = pd.DataFrame({
+    'Indikator': ['PSR Compliance', 'SLIK Integration', 'GCG Score', 'Audit Finding'],
+    'Nilai': ['98.5%', '100%', '92/100', '3 Item'],
+    'Keterangan': ['Laporan lengkap dan tepat waktu', 'Data tersinkronisasi',
+                   'Good Corporate Governance', 'Dalam proses perbaikan']
+})
 
-col1, col2, col3, col4 = st.columns(4)
+@section('Compliance')
+def compliance_section():
+    st.markdown('<div class="section-header">📊 Compliance & Reporting BI</div>', unsafe_allow_html=True)
+    if not st.toggle("Tampilkan", key="open_compliance"):
+        return
 
-with col1:
-    st.markdown("""
-    <div class="metric-card alert-good">
-        <h4>✅ PSR Compliance</h4>
-        <h2>98.5%</h2>
-        <p>Laporan lengkap dan tepat waktu</p>
-    </div>
-    """, unsafe_allow_html=True)
-
-with col2:
-    st.markdown("""
-    <div class="metric-card alert-good">
-        <h4>✅ SLIK Integration</h4>
-        <h2>100%</h2>
-        <p>Data tersinkronisasi</p>
-    </div>
-    """, unsafe_allow_html=True)
+    col1, col2, col3, col4 = st.columns(4)
 
-with col3:
-    st.markdown("""
-    <div class="metric-card alert-good">
-        <h4>✅ GCG Score</h4>
-        <h2>92/100</h2>
-        <p>Good Corporate Governance</p>
-    </div>
-    """, unsafe_allow_html=True)
+    with col1:
+        st.markdown("""
+        <div class="metric-card alert-good">
+            <h4>✅ PSR Compliance</h4>
+            <h2>98.5%</h2>
+            <p>Laporan lengkap dan tepat waktu</p>
+        </div>
+        """, unsafe_allow_html=True)
 
-with col4:
-    st.markdown("""
-    <div class="metric-card alert-medium">
-        <h4>⚠️ Audit Finding</h4>
-        <h2>3 Item</h2>
-        <p>Dalam proses perbaikan</p>
-    </div>
-    """, unsafe_allow_html=True)
+    with col2:
+        st.markdown("""
+        <div class="metric-card alert-good">
+            <h4>✅ SLIK Integration</h4>
+            <h2>100%</h2>
+            <p>Data tersinkronisasi</p>
+        </div>
+        """, unsafe_allow_html=True)
 
-st.divider()
+    with col3:
+        st.markdown("""
+        <div class="metric-card alert-good">
+            <h4>✅ GCG Score</h4>
+            <h2>92/100</h2>
+            <p>Good Corporate Governance</p>
+        </div>
+        """, unsafe_allow_html=True)
 
-# ===== FOOTER & EXPORT =====
-st.markdown('<div class="section-header">📥 Export & Actions</div>', unsafe_allow_html=True)
+    with col4:
+        st.markdown("""
+        <div class="metric-card alert-medium">
+            <h4>⚠️ Audit Finding</h4>
+            <h2>3 Item</h2>
+            <p>Dalam proses perbaikan</p>
+        </div>
+        """, unsafe_allow_html=True)
 
-col1, col2, col3, col4 = st.columns(4)
+    st.divider()
 
-with col1:
-    if st.button("📊 Export Excel Report", use_container_width=True):
-        st.success("✅ Report exported successfully!")
+compliance_section()
 
-with col2:
-    if st.button("📄 Generate PDF Summary", use_container_width=True):
-        st.success("✅ PDF generated successfully!")
+# ===== FOOTER & EXPORT =====
+def kpi_summary(filters, portfolio_data, regional_data):
+    """Headline indicators of the selected period, one row each."""
+    current, previous = period_kpi(filters, portfolio_data, regional_data)
+    kpi_data = pd.DataFrame({
+        'Indikator': ['Periode', 'Total Kredit Berjalan (Rp)', 'Total Kredit Selesai (Rp)', 'NPL Rate (%)',
+                      'NPL Rate Bulan Lalu (%)', 'Collection Rate (%)', 'Jumlah Debitur',
+                      'Rata² Kredit/Petani (Rp)', 'Total Lahan (Ha)'],
+        'Nilai': [portfolio_data['Bulan'].iloc[-1].strftime('%Y-%m'), current['outstanding'], current['disbursed'],
+                  current['npl_rate'], previous['npl_rate'] if previous is not None else None,
+                  current['collection_rate'], current['debtors'],
+                  current['outstanding'] / current['debtors'], regional_data['Luas_Lahan_Ha'].sum()]
+    })
+    return kpi_data
+
+def export_sheets(filters, portfolio_data, regional_data):
+    """Every section's table for the current filters, one workbook sheet each."""
+    return {
+        'KPI': kpi_summary(filters, portfolio_data, regional_data),
+        'Portfolio': portfolio_data,
+        'Regional': regional_data,
+        'Aging': period_view(filters, 'aging', lambda: aging_engine.aging(**filters)),
+        'Kolektibilitas': period_view(filters, 'collectibility', lambda: aging_engine.collectibility(**filters)),
+        'Segmentasi': period_view(filters, 'segment_frame', lambda: load_segment_data(tuple(filters.items()))),
+        'Musim Panen': load_harvest_data(filters),
+        'Produktivitas': load_productivity_data(filters),
+        'Early Warning': load_alert_data(filters),
+        'Compliance': compliance_data,
+    }
 
-with col3:
-    if st.button("📧 Email to Management", use_container_width=True):
-        st.success("✅ Email sent successfully!")
+def export_status(polling):
+    """Progress of this session's export, then its download; polls while the export runs."""
+    job = st.session_state['export_job']
+    if job.running:
+        st.progress(job.progress, text=f"{job.message}: {job.rows_written:,} / {job.total_rows:,} baris")
+        if st.button("Batalkan", key='export_cancel', use_container_width=True):
+            job.cancel()
+            st.rerun()
+    elif polling:
+        st.rerun()  # finished since the last poll: rerun the page once to stop polling
+    elif job.done:
+        st.download_button(
+            "⬇️ Unduh Excel",
+            data=job.read,  # read only when clicked
+            file_name=job.file_name,
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click='ignore',
+            use_container_width=True
+        )
+        st.caption(f"Selesai dalam {job.elapsed:,.0f} detik")
+    elif job.error:
+        st.error(f"Export gagal: {job.error}")
+
+def report_key(filters):
+    """Board packs are monthly: any day of the same month, with the same filters and data, is one report."""
+    period = pd.Timestamp(filters['until']).strftime('%Y-%m')
+    return period, tuple((k, v) for k, v in filters.items() if k != 'until'), cube.version_for(**filters)
+
+def report_context(filters, portfolio_data, regional_data):
+    """Values and small frames the PDF worker renders; read from the aggregates in this session."""
+    kpi = kpi_summary(filters, portfolio_data, regional_data)
+    return {
+        'title': "Dashboard Monitoring Pembiayaan Petani Tebu KUR",
+        'period': portfolio_data['Bulan'].iloc[-1].strftime('%B %Y'),
+        'scope': ", ".join(v for k, v in filters.items() if k != 'until' and v) or "Semua Region, Bank & Jenis Kredit",
+        'kpi': [[name, f"{value:,.2f}" if isinstance(value, float) else f"{value:,}" if isinstance(value, (int, np.integer))
+                 else value] for name, value in zip(kpi['Indikator'], kpi['Nilai'])],
+        'risk': [(card_class, title, share, outstanding)
+                 for card_class, _, title, share, outstanding
+                 in risk_summary(period_view(filters, 'collectibility', lambda: aging_engine.collectibility(**filters)))],
+        'portfolio': portfolio_data,
+        'regional': regional_data,
+        'aging': period_view(filters, 'aging', lambda: aging_engine.aging(**filters)),
+    }
 
-with col4:
-    if st.button("🔔 Set Alert Rules", use_container_width=True):
-        st.info("Alert rules configuration opened!")
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def report_status(polling):
+    """This session's PDF: queued or rendering, then its download; polls until it is ready."""
+    future = get_report_queue().get(st.session_state['report_key'])
+    if future is None:
+        return
+    if not future.done():
+        st.progress(0.5, text="Menyusun PDF...")
+    elif polling:
+        st.rerun()  # finished since the last poll: rerun the page once to stop polling
+    elif future.exception() is not None:
+        st.error(f"PDF gagal: {future.exception()}")
+    else:
+        st.download_button(
+            "⬇️ Unduh PDF",
+            data=functools.partial(read_file, future.result()),  # read only when clicked
+            file_name=f"ringkasan_kur_{st.session_state['report_key'][0]}.pdf",
+            mime="application/pdf",
+            on_click='ignore',
+            use_container_width=True
+        )
+
+def digest_status(polling):
+    """Outcome of this session's digest send; polls until the digest thread has finished it."""
+    future = st.session_state['digest_send']
+    if not future.done():
+        st.progress(0.5, text="Mengirim email...")
+    elif polling:
+        st.rerun()  # finished since the last poll: rerun the page once to stop polling
+    elif future.exception() is not None:
+        st.error(f"Email gagal: {future.exception()}")
+    else:
+        result = future.result()
+        st.success(f"✅ {result.sent:,} email terkirim ({result.period}, {result.seconds:.1f} detik)")
+        if result.failed:
+            st.warning(f"{len(result.failed):,} penerima gagal: {', '.join(result.failed[:5])}")
+
+@st.dialog("🔔 Alert Rules", width="large")
+def alert_rules_dialog():
+    """Editor for the user-defined alert rules; saved rules show up in the early-warning table."""
+    rulebook = ews_engine.rules
+    st.caption("Kondisi per kredit, mis. `late_days > 30 and region == 'Lampung' and outstanding_balance > 50e6`. "
+               "Variabel: " + ", ".join(f"`{name}` ({meaning})" for name, meaning in alert_rules.VARIABLES.items()))
+    if rulebook.errors:
+        st.warning("Rule berikut dinonaktifkan sampai diperbaiki:")
+        for message in rulebook.errors:
+            st.error(message)
+    rules = pd.DataFrame(rulebook.rules, columns=alert_rules.AlertRule._fields)
+    edited = st.data_editor(rules, num_rows="dynamic", use_container_width=True, hide_index=True, column_config={
+        "name": st.column_config.TextColumn("Nama", required=True),
+        "expression": st.column_config.TextColumn("Kondisi", required=True, width="large"),
+        "priority": st.column_config.SelectboxColumn("Prioritas", options=alert_rules.PRIORITIES,
+                                                     default=alert_rules.PRIORITIES[1], required=True),
+        "action": st.column_config.TextColumn("Tindakan"),
+        "enabled": st.column_config.CheckboxColumn("Aktif", default=True),
+    }, key='alert_rules_editor')
+    if st.button("Simpan", type="primary"):
+        edited = edited.dropna(subset=['name', 'expression'])
+        rules = [alert_rules.AlertRule(r.name, r.expression, r.priority, r.action or '', bool(r.enabled))
+                 for r in edited.fillna({'action': '', 'enabled': True}).itertuples(index=False)]
+        try:
+            rulebook.save(rules, ews_engine.vocabulary())
+        except alert_rules.RuleError as e:
+            for message in str(e).splitlines():
+                st.error(message)
+        else:
+            st.rerun()
+
+@section('Export')
+def export_section(filters, portfolio_data, regional_data):
+    st.markdown('<div class="section-header">📥 Export & Actions</div>', unsafe_allow_html=True)
+
+    col1, col2, col3, col4 = st.columns(4)
+
+    with col1:
+        job = st.session_state.get('export_job')
+        running = job is not None and job.running
+        if st.button("📊 Export Excel Report", use_container_width=True, disabled=running):
+            export.purge_exports()
+            with perf.span('export_sheets'):
+                sheets = export_sheets(filters, portfolio_data, regional_data)
+            loans = (get_store().root, loan_filter(**filters)) if st.session_state.get('export_loans') else ()
+            st.session_state['export_job'] = job = export.ExportJob(sheets, *loans).start()
+            running = True
+        st.checkbox("Sertakan daftar kredit", key='export_loans', disabled=running,
+                    help="Seluruh kredit sesuai filter, dibagi per sheet setiap 1.048.575 baris")
+        if job is not None:
+            st.fragment(export_status, run_every=1.0 if running else None)(running)
+
+    with col2:
+        if st.button("📄 Generate PDF Summary", use_container_width=True):
+            st.session_state['report_key'] = key = report_key(filters)
+            with perf.span('report.submit'):
+                get_report_queue().submit(key, lambda: report_context(filters, portfolio_data, regional_data))
+        if 'report_key' in st.session_state:
+            future = get_report_queue().get(st.session_state['report_key'])
+            pending = future is not None and not future.done()
+            st.fragment(report_status, run_every=1.0 if pending else None)(pending)
+
+    with col3:
+        if st.button("📧 Email to Management", use_container_width=True):
+            scheduler = get_digest_scheduler()
+            if scheduler.recipients:
+                st.session_state['digest_send'] = scheduler.send_async(filters['until'])
+            else:
+                st.warning(f"Belum ada penerima: isi {scheduler.recipients_file}")
+        if 'digest_send' in st.session_state:
+            pending = not st.session_state['digest_send'].done()
+            st.fragment(digest_status, run_every=1.0 if pending else None)(pending)
+
+    with col4:
+        if st.button("🔔 Set Alert Rules", use_container_width=True):
+            alert_rules_dialog()
+
+export_section(filters, portfolio_data, regional_data)
 
 # Footer
 st.markdown("---")
@@ -792,3 +1406,7 @@ st.markdown("""
     <p style='font-size: 0.9em;'>Compliance: Bank Indonesia, OJK, & Internal Audit Standards</p>
 </div>
 """.format(datetime.now().strftime("%d %B %Y, %H:%M WIB")), unsafe_allow_html=True)
+perf.mark(None)
+perf_trace = perf.end_run()
+if show_perf and perf_trace is not None:
+    render_perf_panel(perf_trace)
@@ -0,0 +1,218 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+import perf
+from data_store import DataStore
+from synthetic import generate_loan_book, generate_to_store
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(HERE, 'app.py')
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+SCENARIOS = ['cold_start', 'warm_rerun', 'open_sections', 'filter_change', 'refresh']
+SECTIONS = ['Data', 'KPI', 'Portfolio', 'Regional', 'Risk', 'Segmentation', 'Seasonal', 'EWS', 'Compliance',
+            'Export']
+# Loans ingested before the Refresh click get ids in their own range, so reruns overwrite them
+INCREMENT_ID = 10**9
+INCREMENT_LOANS = 2000
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10  # high-water mark only
+
+
+class RssSampler:
+    """Peak resident set size over a block, sampled from a background thread."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_mb = self.end_mb = 0.0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, _rss_mb())
+
+    def __enter__(self):
+        self.peak_mb = _rss_mb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.end_mb = _rss_mb()
+        self.peak_mb = max(self.peak_mb, self.end_mb)
+
+
+def ingest_increment(store):
+    """Write a batch of new loans/payments stamped now, for the Refresh click to pick up."""
+    book = generate_loan_book(INCREMENT_LOANS, seed=7, first_loan_id=INCREMENT_ID, first_borrower_id=INCREMENT_ID)
+    now = pd.Timestamp.now().floor('s')
+    book['loans']['updated_at'] = now
+    book['payments']['created_at'] = now
+    for name in ('borrowers', 'loans', 'payments'):
+        store.write(name, book[name], part='bench')
+
+
+def run_scenarios(store_dir, trace_alloc=True, timeout=3600):
+    """Drive app.py through the benchmark scenarios in this process; one fresh process per dataset."""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP, default_timeout=timeout)
+    results = {}
+
+    def measure(name, step):
+        with RssSampler() as rss, perf.record(trace_alloc) as recorder:
+            started = time.perf_counter()
+            step()
+            wall = time.perf_counter() - started
+        if at.exception:
+            raise RuntimeError(f'{name}: app raised {at.exception[0].value}')
+        sections = recorder.sections
+        results[name] = {
+            'wall_s': round(wall, 4),
+            'peak_rss_mb': round(rss.peak_mb, 1),
+            'rss_mb': round(rss.end_mb, 1),
+            'sections': {s: {k: round(v, 4) for k, v in sections[s].items()} for s in SECTIONS if s in sections},
+        }
+        if trace_alloc:
+            results[name]['alloc_peak_mb'] = round(max(s.get('alloc_peak_mb', 0.0) for s in sections.values()), 1)
+        print(f'  {name:<14} {wall:8.2f}s  peak RSS {rss.peak_mb:8.1f} MB', file=sys.stderr)
+
+    measure('cold_start', at.run)
+    measure('warm_rerun', at.run)
+    # Sections below the fold are built only once opened; open them all for the remaining scenarios
+    for toggle in at.toggle:
+        if toggle.label == 'Tampilkan':
+            toggle.set_value(True)
+    measure('open_sections', at.run)
+    region = next(box for box in at.selectbox if box.label == 'Region')
+    measure('filter_change', lambda: region.set_value(region.options[1]).run())
+    ingest_increment(DataStore(store_dir))
+    button = next(b for b in at.button if 'Refresh' in b.label)
+    measure('refresh', lambda: button.click().run())
+    return results
+
+
+def prepare_store(data_dir, label, n_loans, workers):
+    store = DataStore(os.path.join(data_dir, label))
+    if not store.exists():
+        print(f'Generating {n_loans:,} loans into {store.root} ...', file=sys.stderr)
+        generate_to_store(store, n_loans, workers=workers)
+    return store
+
+
+def bench_size(store, trace_alloc, timeout):
+    """Run the scenarios for one store in a child process, so caches and RSS start cold."""
+    env = dict(os.environ, KUR_STORE_DIR=store.root, KUR_REFRESH_INTERVAL='0')
+    with tempfile.TemporaryDirectory() as scratch:
+        path = os.path.join(scratch, 'result.json')
+        command = [sys.executable, __file__, '--child', store.root, '--out', path, '--timeout', str(timeout)]
+        if not trace_alloc:
+            command.append('--no-alloc')
+        subprocess.run(command, env=env, check=True)
+        with open(path) as result:
+            return json.load(result)
+
+
+def compare(current, baseline, tolerance, min_seconds=0.05):
+    """Print wall-time/RSS ratios against a baseline run; return the regressions found."""
+    regressions = []
+    for size, scenarios in current['results'].items():
+        for scenario, now in scenarios.items():
+            before = baseline.get('results', {}).get(size, {}).get(scenario)
+            if before is None:
+                continue
+            checks = [(f'{scenario}', 'wall_s', now['wall_s'], before['wall_s']),
+                      (f'{scenario}', 'peak_rss_mb', now['peak_rss_mb'], before['peak_rss_mb'])]
+            for section, stats in now['sections'].items():
+                old = before['sections'].get(section)
+                if old is not None:
+                    checks.append((f'{scenario}/{section}', 'wall_s', stats['wall_s'], old['wall_s']))
+            for name, metric, new_value, old_value in checks:
+                if metric == 'wall_s' and max(new_value, old_value) < min_seconds:
+                    continue
+                ratio = new_value / old_value if old_value else float('inf')
+                flag = ratio > 1 + tolerance
+                if flag:
+                    regressions.append((size, name, metric, old_value, new_value))
+                print(f'{"!!" if flag else "  "} {size:<4} {name:<28} {metric:<12} {old_value:10.3f} -> '
+                      f'{new_value:10.3f}  ({ratio:5.2f}x)')
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless render benchmark for the dashboard (app.py).')
+    parser.add_argument('--sizes', nargs='+', default=list(SIZES), choices=list(SIZES), help='dataset sizes')
+    parser.add_argument('--data-dir', default=os.path.join(HERE, 'data', 'bench'),
+                        help='where the per-size synthetic stores are kept (generated once)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='generator worker processes')
+    parser.add_argument('--out', default=os.path.join(HERE, 'bench_results'), help='results directory')
+    parser.add_argument('--compare', help='baseline results JSON; exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown before flagging')
+    parser.add_argument('--no-alloc', action='store_true', help='skip tracemalloc (faster, no allocation stats)')
+    parser.add_argument('--timeout', type=float, default=3600, help='per-rerun timeout in seconds')
+    parser.add_argument('--child', metavar='STORE', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        results = run_scenarios(args.child, trace_alloc=not args.no_alloc, timeout=args.timeout)
+        with open(args.out, 'w') as out:
+            json.dump(results, out)
+        return
+
+    run = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'alloc_traced': not args.no_alloc,
+        'results': {},
+    }
+    for label in args.sizes:
+        store = prepare_store(args.data_dir, label, SIZES[label], args.workers)
+        print(f'[{label}] {store.root}', file=sys.stderr)
+        run['results'][label] = bench_size(store, not args.no_alloc, args.timeout)
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, 'w') as out:
+        json.dump(run, out, indent=2)
+    print(f'Results written to {path}', file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(run, json.load(baseline), args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} regression(s) beyond {args.tolerance:.0%}', file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
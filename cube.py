@@ -0,0 +1,329 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from aggregates import AGING_EDGES, AGING_LABELS, TYPE_COLUMNS
+
+DIMENSIONS = ['month', 'region', 'bank', 'loan_type', 'masa_tanam']
+MASA_TANAM = ['Musim Tanam 1', 'Musim Tanam 2']
+N_BUCKETS = len(AGING_LABELS)
+
+# Additive measures; loan measures are keyed by disbursement month, payment measures by payment month
+MEASURES = (
+    ['disbursed', 'loans', 'repaid', 'debtors', 'land_ha']
+    + [f'paid_{b}' for b in range(N_BUCKETS)]
+    + [f'principal_{b}' for b in range(N_BUCKETS)]
+    + [f'outstanding_kol{c}' for c in range(1, 6)]
+)
+M = {name: i for i, name in enumerate(MEASURES)}
+
+# Inputs the cube reads, and the per-loan state it keeps for incremental merges
+LOAN_COLUMNS = ['loan_id', 'borrower_id', 'loan_type', 'disbursement_date', 'disbursed_amount',
+                'outstanding_balance', 'region', 'bank', 'status', 'collectibility_category']
+PAYMENT_COLUMNS = ['loan_id', 'payment_date', 'payment_amount', 'principal_amount', 'late_days']
+STATE_COLUMNS = {
+    'borrower_id': np.int32, 'month': np.int16, 'region': np.int16, 'bank': np.int16,
+    'loan_type': np.int8, 'masa_tanam': np.int8, 'disbursed_amount': np.int64,
+    'outstanding_balance': np.int64, 'collectibility_category': np.int8, 'active': bool,
+    'disbursement_date': 'datetime64[ns]', 'counted': bool, 'land': float,
+}
+
+# One merge's cube: replaced as a whole, so a reader never pairs one merge's axes with another's cells
+CubeState = namedtuple('CubeState', ['axes', 'data', 'cell_version', 'state'])
+
+
+def masa_tanam_of(dates):
+    """Planting season from the disbursement month (Jan-Jun = MT1, Jul-Des = MT2)."""
+    return np.where(dates.dt.month <= 6, MASA_TANAM[0], MASA_TANAM[1])
+
+
+def _ratio(num, den, scale=100.0):
+    return np.divide(num * scale, den, out=np.zeros_like(num, dtype=float), where=den != 0)
+
+
+class OlapCube:
+    """Dense month x region x bank x loan_type x masa_tanam cube of additive measures.
+
+    Besides the cube itself it keeps a compact per-loan state (cell coordinates,
+    balance, collectibility, debtor attribution) so that deltas can be merged in: a
+    changed loan first retracts its old contribution and then adds the new one.
+    A merge builds the next axes, cells and state on the side and publishes them as
+    one CubeState (`book`); a reader that takes `book` once sees a single merge.
+    """
+
+    def __init__(self, axes):
+        self.book = CubeState(axes, np.zeros(_shape(axes) + (len(MEASURES),)),
+                              np.zeros(_shape(axes), dtype=np.int64), pd.DataFrame(
+                                  {col: pd.Series(dtype=dtype) for col, dtype in STATE_COLUMNS.items()},
+                                  index=pd.Index([], dtype=np.int64, name='loan_id')))
+        self.version = 0
+        self.land = pd.Series(dtype=float)
+
+    @property
+    def axes(self):
+        return self.book.axes
+
+    @property
+    def data(self):
+        return self.book.data
+
+    @property
+    def cell_version(self):
+        return self.book.cell_version
+
+    @property
+    def state(self):
+        return self.book.state
+
+    @property
+    def shape(self):
+        return _shape(self.axes)
+
+    @staticmethod
+    def _selector(dim, value, axes):
+        if value is None:
+            return slice(None)
+        labels = axes[dim]
+        if dim == 'month':
+            # Periode: everything up to and including the selected month (nothing before the data starts)
+            stop = np.searchsorted(labels, np.datetime64(value, 'M'), side='right')
+            return slice(0, stop)
+        hits = np.flatnonzero(labels == value)
+        return hits if len(hits) else np.array([], dtype=np.int64)
+
+    def _view(self, array, axes, until=None, region=None, bank=None, loan_type=None, masa_tanam=None):
+        values = dict(month=until, region=region, bank=bank, loan_type=loan_type, masa_tanam=masa_tanam)
+        for axis, dim in enumerate(DIMENSIONS):
+            array = array[(slice(None),) * axis + (self._selector(dim, values[dim], axes),)]
+        return array
+
+    def rollup(self, keep=(), book=None, **filters):
+        """Sum the measures over every dimension not in `keep`, after slicing by the filters."""
+        book = self.book if book is None else book
+        view = self._view(book.data, book.axes, **filters)
+        drop = tuple(axis for axis, dim in enumerate(DIMENSIONS) if dim not in keep)
+        return view.sum(axis=drop)
+
+    def version_for(self, **filters):
+        """Version of the slice: only changes when a merge touched one of its cells."""
+        book = self.book
+        view = self._view(book.cell_version, book.axes, **filters)
+        return int(view.max()) if view.size else 0
+
+    def labels(self, dim, value=None, book=None):
+        axes = (self.book if book is None else book).axes
+        return axes[dim][self._selector(dim, value, axes)]
+
+    def months(self, until=None):
+        return self.labels('month', until)
+
+    def portfolio(self, **filters):
+        """Monthly frame shaped like the original portfolio_data."""
+        book = self.book
+        cells = self.rollup(('month', 'loan_type'), book, **filters)
+        frame = pd.DataFrame({'Bulan': self.labels('month', filters.get('until'), book).astype('datetime64[ns]')})
+        types = self.labels('loan_type', filters.get('loan_type'), book)
+        for loan_type, col in TYPE_COLUMNS.items():
+            hits = np.flatnonzero(types == loan_type)
+            by_type = cells[:, hits].sum(axis=1) if len(hits) else np.zeros((len(frame), len(MEASURES)))
+            frame[f'{col}_Disbursed'] = by_type[:, M['disbursed']]
+            frame[f'{col}_Outstanding'] = np.cumsum(by_type[:, M['disbursed']] - by_type[:, M['repaid']])
+        total = cells.sum(axis=1)
+        principal = total[:, M['principal_0']:M['principal_0'] + N_BUCKETS]
+        paid = total[:, M['paid_0']:M['paid_0'] + N_BUCKETS]
+        frame['NPL_Rate'] = _ratio(principal[:, -1], principal.sum(axis=1))
+        frame['Collection_Rate'] = _ratio(paid[:, :2].sum(axis=1), paid.sum(axis=1))
+        return frame
+
+    def regional(self, **filters):
+        book = self.book
+        cells = self.rollup(('region',), book, **filters)
+        kol = cells[:, M['outstanding_kol1']:M['outstanding_kol1'] + 5]
+        debtors = cells[:, M['debtors']]
+        frame = pd.DataFrame({
+            'Region': self.labels('region', filters.get('region'), book),
+            'Total_Kredit': cells[:, M['disbursed']],
+            'Jumlah_Debitur': debtors.astype(np.int64),
+            'NPL_Rate': _ratio(kol[:, 2:].sum(axis=1), kol.sum(axis=1)),
+            'Luas_Lahan_Ha': np.round(cells[:, M['land_ha']]).astype(np.int64),
+            'Rata_Kredit_per_Petani': _ratio(cells[:, M['disbursed']], debtors, scale=1.0),
+        })
+        return frame[frame['Total_Kredit'] > 0].reset_index(drop=True)
+
+    # -- merging -------------------------------------------------------------
+
+    @staticmethod
+    def _grow(book, dim, labels):
+        """The book with an axis extended by unseen labels, existing cells moved to their new position."""
+        old = book.axes[dim]
+        if dim == 'month':
+            new = np.arange(min(old.min(initial=labels.min()), labels.min()),
+                            max(old.max(initial=labels.max()), labels.max()) + 1)
+        else:
+            new = np.asarray(sorted(set(old) | set(labels)))
+        if len(new) == len(old):
+            return book
+        axis = DIMENSIONS.index(dim)
+        position = pd.Index(new).get_indexer(old)
+        axes = {**book.axes, dim: new}
+        data = np.zeros(_shape(axes) + (len(MEASURES),))
+        data[(slice(None),) * axis + (position,)] = book.data
+        cell_version = np.zeros(_shape(axes), dtype=np.int64)
+        cell_version[(slice(None),) * axis + (position,)] = book.cell_version
+        # A new frame, not an in-place update: a pinned (axes, state) pair keeps its own codes
+        return CubeState(axes, data, cell_version, book.state.assign(**{dim: position[book.state[dim].to_numpy()]}))
+
+    @staticmethod
+    def _cells(frame, shape):
+        return np.ravel_multi_index(tuple(frame[d].to_numpy() for d in DIMENSIONS), shape)
+
+    def _loan_measures(self, rows):
+        """Per-loan contribution of the loan-keyed measures, as an (n, measures) matrix."""
+        values = np.zeros((len(rows), len(MEASURES)))
+        outstanding = rows['outstanding_balance'].to_numpy()
+        values[:, M['disbursed']] = rows['disbursed_amount'].to_numpy()
+        values[:, M['loans']] = 1
+        columns = np.arange(len(rows))
+        values[columns, M['outstanding_kol1'] + rows['collectibility_category'].to_numpy() - 1] = outstanding
+        counted = rows['counted'].to_numpy()
+        values[:, M['debtors']] = counted
+        values[:, M['land_ha']] = np.where(counted, rows['land'].to_numpy(), 0)
+        return values
+
+    def merge(self, loans=None, payments=None, borrowers=None, productivity=None):
+        """Fold new or changed loans and new payments into the cube; returns the touched months."""
+        loans = loans if loans is not None else pd.DataFrame(columns=list(LOAN_COLUMNS))
+        payments = payments if payments is not None else pd.DataFrame(columns=list(PAYMENT_COLUMNS))
+        book = self.book
+        # Payments for loans the cube has never seen cannot be placed; they arrive with their loan
+        payments = payments[payments['loan_id'].isin(book.state.index) | payments['loan_id'].isin(loans['loan_id'])]
+        if borrowers is not None and len(borrowers):
+            fresh = borrowers.set_index('borrower_id')['land_area_ha']
+            self.land = fresh.combine_first(self.land) if len(self.land) else fresh
+
+        # Coordinates of incoming loans; axes grow when a month, region or bank is new
+        if len(loans):
+            disb_month = loans['disbursement_date'].to_numpy().astype('datetime64[M]')
+            for dim, labels in (('month', disb_month), ('region', loans['region'].unique()),
+                                ('bank', loans['bank'].unique())):
+                book = self._grow(book, dim, np.asarray(labels))
+        if len(payments):
+            book = self._grow(book, 'month', payments['payment_date'].to_numpy().astype('datetime64[M]'))
+        axes, shape = book.axes, _shape(book.axes)
+
+        # Copy-on-write, so concurrent readers keep a consistent cube until the swap below
+        data = book.data.reshape(-1, len(MEASURES)).copy()
+        state = book.state.copy()
+
+        touched_ids = pd.Index(loans['loan_id']).unique()
+        known = touched_ids[touched_ids.isin(state.index)]
+        touched_borrowers = pd.Index(state.loc[known, 'borrower_id']).union(pd.Index(loans['borrower_id']))
+        owner_rows = state.index[state['borrower_id'].isin(touched_borrowers).to_numpy()]
+        before = state.loc[known.union(owner_rows)]
+        np.subtract.at(data, self._cells(before, shape), self._loan_measures(before))
+
+        if len(loans):
+            incoming = pd.DataFrame({
+                'borrower_id': loans['borrower_id'].to_numpy(),
+                'month': (disb_month - axes['month'][0]).astype(np.int64),
+                'region': _codes(loans['region'], axes['region']),
+                'bank': _codes(loans['bank'], axes['bank']),
+                'loan_type': _codes(loans['loan_type'], axes['loan_type']),
+                'masa_tanam': _codes(masa_tanam_of(loans['disbursement_date']), axes['masa_tanam']),
+                'disbursed_amount': loans['disbursed_amount'].to_numpy(),
+                'outstanding_balance': loans['outstanding_balance'].to_numpy(),
+                'collectibility_category': loans['collectibility_category'].to_numpy(),
+                'active': loans['status'].to_numpy() != 'Closed',
+                'disbursement_date': loans['disbursement_date'].to_numpy(),
+            }, index=pd.Index(loans['loan_id'].to_numpy(), name='loan_id'))
+            incoming['counted'], incoming['land'] = False, 0.0
+            incoming = incoming[list(STATE_COLUMNS)].astype(STATE_COLUMNS)
+            state = pd.concat([state.drop(known.intersection(incoming.index)), incoming]) if len(state) else incoming
+
+        if len(payments):
+            # Payment-keyed measures are purely additive
+            pay_loans = state.loc[payments['loan_id'].to_numpy()]
+            pay_cells = np.ravel_multi_index(
+                ((payments['payment_date'].to_numpy().astype('datetime64[M]') - axes['month'][0])
+                 .astype(np.int64),) + tuple(pay_loans[d].to_numpy() for d in DIMENSIONS[1:]),
+                shape,
+            )
+            bucket = np.digitize(payments['late_days'].to_numpy(), AGING_EDGES)
+            values = np.zeros((len(payments), len(MEASURES)))
+            rows = np.arange(len(payments))
+            values[:, M['repaid']] = payments['principal_amount'].to_numpy()
+            values[rows, M['paid_0'] + bucket] = payments['payment_amount'].to_numpy()
+            values[rows, M['principal_0'] + bucket] = payments['principal_amount'].to_numpy()
+            np.add.at(data, pay_cells, values)
+
+        # Re-attribute each touched borrower to their most recent active loan
+        owned = state.index[state['borrower_id'].isin(touched_borrowers).to_numpy()]
+        owned_rows = state.loc[owned]
+        state.loc[owned, 'counted'] = False
+        latest_active = (owned_rows[owned_rows['active'].astype(bool)].sort_values(['disbursement_date', 'loan_id'])
+                         .drop_duplicates('borrower_id', keep='last'))
+        state.loc[latest_active.index, 'counted'] = True
+        state['land'] = self.land.reindex(state['borrower_id']).fillna(0).to_numpy()
+
+        after = state.loc[owned.union(touched_ids)]
+        after_cells = self._cells(after, shape)
+        np.add.at(data, after_cells, self._loan_measures(after))
+
+        # Only cells whose measures actually moved get a new version
+        self.version += 1
+        cell_version = book.cell_version.copy().reshape(-1)
+        candidates = np.unique(np.concatenate([self._cells(before, shape), after_cells,
+                                               pay_cells if len(payments) else np.array([], dtype=np.int64)]))
+        previous = book.data.reshape(-1, len(MEASURES))
+        changed = candidates[~np.isclose(data[candidates], previous[candidates]).all(axis=1)]
+        cell_version[changed] = self.version
+        touched_months = np.unique(np.unravel_index(changed, shape)[0])
+
+        self.book = CubeState(axes, data.reshape(shape + (len(MEASURES),)), cell_version.reshape(shape),
+                              state.astype(STATE_COLUMNS))
+        return axes['month'][touched_months.astype(np.int64)]
+
+
+def loan_frame(axes, state, until=None, region=None, bank=None, loan_type=None, masa_tanam=None):
+    """The loans of a cube state matching the header filters, with the columns aggregates.segment_frame reads.
+
+    `axes` and `state` must come from the same merge (see IncrementalRefresher.pinned):
+    the state's dimension columns are codes into those axes.
+    """
+    keep = np.ones(len(state), dtype=bool)
+    if until is not None:
+        keep &= state['month'].to_numpy() < np.searchsorted(axes['month'], np.datetime64(until, 'M'), side='right')
+    for dim, value in (('region', region), ('bank', bank), ('loan_type', loan_type), ('masa_tanam', masa_tanam)):
+        if value is not None:
+            keep &= state[dim].to_numpy() == _codes([value], axes[dim])[0]
+    loans = state[keep]
+    return pd.DataFrame({
+        'borrower_id': loans['borrower_id'].to_numpy(),
+        'disbursed_amount': loans['disbursed_amount'].to_numpy(),
+        'outstanding_balance': loans['outstanding_balance'].to_numpy(),
+        'status': pd.Categorical.from_codes(loans['active'].to_numpy(np.int8), ['Closed', 'Active']),
+        'collectibility_category': loans['collectibility_category'].to_numpy(),
+    })
+
+
+def _shape(axes):
+    return tuple(len(axes[d]) for d in DIMENSIONS)
+
+
+def _codes(values, labels):
+    return pd.Index(labels).get_indexer(values)
+
+
+def build_cube(loans, payments, borrowers):
+    """Aggregate the whole loan book into a fresh OlapCube."""
+    axes = {
+        'month': np.array([], dtype='datetime64[M]'),
+        'region': np.array([], dtype=object),
+        'bank': np.array([], dtype=object),
+        'loan_type': np.asarray(list(TYPE_COLUMNS)),
+        'masa_tanam': np.asarray(MASA_TANAM),
+    }
+    cube = OlapCube(axes)
+    cube.merge(loans, payments, borrowers)
+    return cube
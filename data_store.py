@@ -0,0 +1,183 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+
+import schema
+
+# Columnar store location (override with KUR_STORE_DIR)
+STORE_DIR = os.getenv('KUR_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'store'))
+
+# Hive-style partition keys per table, and the date column each month key is taken from
+PARTITIONS = {
+    'loans': ['month', 'region'],
+    'payments': ['month'],
+    'borrowers': ['region'],
+    'productivity': ['month'],
+    'alerts': ['region'],
+}
+MONTH_SOURCE = {
+    'loans': 'disbursement_date',
+    'payments': 'payment_date',
+    'productivity': 'harvest_date',
+}
+# Source tables; derived tables such as `alerts` are (re)built from them
+TABLES = ['loans', 'payments', 'borrowers', 'productivity']
+
+
+def month_key(dates):
+    """'YYYY-MM' partition key per date, formatted once per distinct month."""
+    months, inverse = np.unique(dates.to_numpy().astype('datetime64[M]'), return_inverse=True)
+    return months.astype(str)[inverse]
+
+
+class DataStore:
+    """Partitioned Parquet store for the loans/payments/borrowers/productivity tables."""
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        # Memory-mapped file access: column buffers are paged in, not copied into the heap
+        self.filesystem = pafs.LocalFileSystem(use_mmap=True)
+        # Rows and MB of the latest whole-table load of each table: the frames the aggregates are built from
+        self.memory = {}
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def exists(self, name=None):
+        names = [name] if name else TABLES
+        return all(os.path.isdir(self.path(n)) and os.listdir(self.path(n)) for n in names)
+
+    def write(self, name, df, part='0'):
+        """Write a frame into the table's partitions, replacing only partitions it touches."""
+        df = df.copy()
+        if name in MONTH_SOURCE:
+            df['month'] = month_key(df[MONTH_SOURCE[name]])
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        keys = PARTITIONS[name]
+        ds.write_dataset(
+            table,
+            self.path(name),
+            format='parquet',
+            partitioning=ds.partitioning(pa.schema([table.schema.field(k) for k in keys]), flavor='hive'),
+            basename_template=f'part-{part}-{{i}}.parquet',
+            existing_data_behavior='overwrite_or_ignore',
+        )
+
+    def upsert(self, name, df, key):
+        """Insert or replace rows by key, rewriting only the partitions the rows fall into or move out of."""
+        df = df.copy()
+        if name in MONTH_SOURCE:
+            df['month'] = month_key(df[MONTH_SOURCE[name]])
+        keys = PARTITIONS[name]
+        emptied = []
+        if self.exists(name):
+            # Where the keys are now: a row whose partition columns changed (a loan moved to another
+            # region, a corrected date) must leave its old partition too, or the key is stored twice
+            holders = self.scan(name, columns=keys, filter=ds.field(key).isin(df[key].tolist())).to_pandas()
+            touched = pd.concat([df[keys], holders[keys]], ignore_index=True).drop_duplicates()
+            expression = None
+            for k in keys:
+                term = ds.field(k).isin(touched[k].unique().tolist())
+                expression = term if expression is None else expression & term
+            existing = self.scan(name, filter=expression).to_pandas()
+            existing = existing.merge(touched, on=keys)  # exact partition combinations only
+            existing = existing[~existing[key].isin(df[key])]
+            df = pd.concat([existing[df.columns], df], ignore_index=True)
+            # Partitions left without rows get no new file, so their old files are removed here
+            left = touched.merge(df[keys].drop_duplicates(), on=keys, how='left', indicator=True)
+            gone = set(left.loc[left['_merge'] == 'left_only', keys].itertuples(index=False, name=None))
+            emptied = [fragment.path for fragment in self.dataset(name).get_fragments(filter=expression)
+                       if tuple(ds.get_partition_keys(fragment.partition_expression)[k] for k in keys) in gone]
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        ds.write_dataset(
+            table,
+            self.path(name),
+            format='parquet',
+            partitioning=ds.partitioning(pa.schema([table.schema.field(k) for k in keys]), flavor='hive'),
+            basename_template='part-0-{i}.parquet',
+            existing_data_behavior='delete_matching',
+        )
+        for path in emptied:
+            os.remove(path)
+            try:
+                os.removedirs(os.path.dirname(path))
+            except OSError:  # the directory still holds other partitions
+                pass
+
+    def replace(self, name, df, touched):
+        """Replace the touched partitions with df's rows; those df has no rows for are left empty."""
+        keys = PARTITIONS[name]
+        if self.exists(name):
+            expression = None
+            for k in keys:
+                term = ds.field(k).isin(touched[k].unique().tolist())
+                expression = term if expression is None else expression & term
+            for fragment in self.dataset(name).get_fragments(filter=expression):
+                os.remove(fragment.path)
+        if len(df):
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            ds.write_dataset(
+                table,
+                self.path(name),
+                format='parquet',
+                partitioning=ds.partitioning(pa.schema([table.schema.field(k) for k in keys]), flavor='hive'),
+                basename_template='part-0-{i}.parquet',
+                existing_data_behavior='overwrite_or_ignore',
+            )
+
+    def dataset(self, name):
+        return ds.dataset(self.path(name), format='parquet', partitioning='hive', filesystem=self.filesystem)
+
+    def scan(self, name, columns=None, filter=None):
+        """Arrow table for a projection/predicate over the table's partitions."""
+        return self.dataset(name).to_table(columns=columns, filter=filter)
+
+    def load(self, name, columns=None, filter=None):
+        """Frame for a projection/predicate, in the canonical compact schema (see schema.py)."""
+        table = self.scan(name, columns=columns, filter=filter)
+        if columns is None and 'month' in table.column_names:
+            table = table.drop_columns(['month'])
+        frame = schema.to_frame(table)
+        if filter is None:
+            self.memory[name] = (len(frame), float(schema.memory_mb(frame)))
+        return frame
+
+    def load_all(self):
+        return {name: self.load(name) for name in TABLES}
+
+
+def loan_filter(until=None, region=None, bank=None, loan_type=None, masa_tanam=None):
+    """Predicate over the loans table for the dashboard's header filters."""
+    terms = []
+    if until is not None:
+        terms.append(ds.field('month') <= pd.Timestamp(until).strftime('%Y-%m'))
+    if region is not None:
+        terms.append(ds.field('region') == region)
+    if bank is not None:
+        terms.append(ds.field('bank') == bank)
+    if loan_type is not None:
+        terms.append(ds.field('loan_type') == loan_type)
+    if masa_tanam is not None:
+        first_half = pc.month(ds.field('disbursement_date')) <= 6
+        terms.append(first_half if masa_tanam.endswith('1') else ~first_half)
+    if not terms:
+        return None
+    expression = terms[0]
+    for term in terms[1:]:
+        expression = expression & term
+    return expression
+
+
+def open_store(root=STORE_DIR, sample_loans=20000):
+    """Open the store, seeding it with a synthetic loan book on first use."""
+    store = DataStore(root)
+    if not store.exists():
+        from synthetic import generate_to_store
+
+        generate_to_store(store, sample_loans)
+    return store
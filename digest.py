@@ -0,0 +1,344 @@
+import argparse
+import html
+import json
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.message import EmailMessage
+
+import pandas as pd
+
+# SMTP settings, named as in the .env example of SETUP_GUIDE.md
+SMTP_SERVER = os.getenv('SMTP_SERVER', 'localhost')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '25'))
+SENDER_EMAIL = os.getenv('SENDER_EMAIL', 'kur-dashboard@localhost')
+SENDER_PASSWORD = os.getenv('SENDER_PASSWORD', '')
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', '0') == '1'
+
+# Recipients: JSON list of {"email", "name", "region", "bank"}; region/bank null for the whole book
+RECIPIENTS_FILE = os.getenv('KUR_DIGEST_RECIPIENTS', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                  'data', 'digest_recipients.json'))
+# Day of the month from which the previous month's digest is due
+DIGEST_DAY = int(os.getenv('KUR_DIGEST_DAY', '1'))
+# Seconds between scheduler checks
+CHECK_INTERVAL = 3600
+# Open SMTP connections, and messages sent over one connection before it is handed back
+SMTP_CONNECTIONS = 2
+BATCH_SIZE = 50
+
+Recipient = namedtuple('Recipient', ['email', 'name', 'region', 'bank'])
+DigestResult = namedtuple('DigestResult', ['period', 'sent', 'failed', 'seconds'])
+
+logger = logging.getLogger('kur.digest')
+
+
+def load_recipients(path=RECIPIENTS_FILE):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [Recipient(r['email'], r.get('name', r['email']), r.get('region'), r.get('bank'))
+                for r in json.load(f)]
+
+
+def _formatted(alerts):
+    if 'Potensi Dampak' not in alerts:
+        return alerts
+    return alerts.assign(**{'Potensi Dampak': alerts['Potensi Dampak'].map(lambda v: f"Rp {v / 1e9:,.1f} M")})
+
+
+class Snapshot:
+    """KPIs and the early-warning table per recipient scope, taken once for a period.
+
+    Every recipient with the same (region, bank) scope shares one KPI row and one
+    alert table, so the cost of a digest run is one cube slice and one alert
+    summary per distinct scope, not per recipient. `alerts(until, region, bank)`
+    returns the scope's alert table as of `until`, the period's last day.
+    """
+
+    def __init__(self, cube, period, scopes, alerts):
+        self.period = pd.Timestamp(period).to_period('M')
+        self.version = cube.version
+        until = self.period.to_timestamp(how='end').normalize()
+        self.kpis = {scope: self._kpis(cube, *scope) for scope in set(scopes)}
+        self.alerts = {scope: _formatted(alerts(until, *scope)) for scope in set(scopes)}
+
+    def _kpis(self, cube, region, bank):
+        until = self.period.to_timestamp()
+        portfolio = cube.portfolio(until=until, region=region, bank=bank)
+        regional = cube.regional(until=until, region=region, bank=bank)
+        current = portfolio.iloc[-1]
+        previous = portfolio.iloc[-2] if len(portfolio) > 1 else current
+        outstanding = current['KUR_Outstanding'] + current['KUR_Khusus_Outstanding']
+        return {
+            'outstanding': outstanding,
+            'outstanding_change': outstanding - previous['KUR_Outstanding'] - previous['KUR_Khusus_Outstanding'],
+            'disbursed': current['KUR_Disbursed'] + current['KUR_Khusus_Disbursed'],
+            'npl_rate': current['NPL_Rate'],
+            'npl_change': current['NPL_Rate'] - previous['NPL_Rate'],
+            'collection_rate': current['Collection_Rate'],
+            'debtors': int(regional['Jumlah_Debitur'].sum()),
+        }
+
+
+def render_digest(recipient, snapshot, sender=SENDER_EMAIL):
+    """The personalized digest for one recipient, from the precomputed snapshot."""
+    kpi = snapshot.kpis[(recipient.region, recipient.bank)]
+    alerts = snapshot.alerts[(recipient.region, recipient.bank)]
+    scope = " / ".join(s for s in (recipient.region, recipient.bank) if s) or "Seluruh portofolio"
+    period = snapshot.period.strftime('%B %Y')
+    lines = [
+        ("Total Kredit Berjalan", f"Rp {kpi['outstanding'] / 1e9:,.2f} M ({kpi['outstanding_change'] / 1e9:+,.2f} M)"),
+        ("Penyaluran Bulan Ini", f"Rp {kpi['disbursed'] / 1e9:,.2f} M"),
+        ("NPL Rate", f"{kpi['npl_rate']:.2f}% ({kpi['npl_change']:+.2f}%)"),
+        ("Collection Rate", f"{kpi['collection_rate']:.1f}%"),
+        ("Jumlah Debitur", f"{kpi['debtors']:,}"),
+    ]
+    text = "\n".join([f"Yth. {recipient.name},", "", f"Ringkasan KUR Petani Tebu {period} - {scope}:", ""]
+                     + [f"- {label}: {value}" for label, value in lines])
+    rows = "".join(f"<tr><td>{label}</td><td><b>{value}</b></td></tr>" for label, value in lines)
+    body = (f"<p>Yth. {html.escape(recipient.name)},</p>"
+            f"<p>Ringkasan KUR Petani Tebu <b>{period}</b> - {html.escape(scope)}:</p><table>{rows}</table>")
+    if len(alerts):
+        text += "\n\nEarly Warning:\n" + alerts.to_string(index=False)
+        body += f"<h4>Early Warning</h4>{alerts.to_html(index=False, border=0)}"
+
+    message = EmailMessage()
+    message['Subject'] = f"Ringkasan KUR {period} - {scope}"
+    message['From'] = sender
+    message['To'] = recipient.email
+    message.set_content(text)
+    message.add_alternative(body, subtype='html')
+    return message
+
+
+class SmtpPool:
+    """At most `size` SMTP connections, reused across batches instead of one login per message."""
+
+    def __init__(self, host=SMTP_SERVER, port=SMTP_PORT, user=SENDER_EMAIL, password=SENDER_PASSWORD,
+                 starttls=SMTP_STARTTLS, size=SMTP_CONNECTIONS, timeout=30):
+        self.host, self.port, self.user, self.password = host, port, user, password
+        self.starttls = starttls
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.password:
+            smtp.login(self.user, self.password)
+        return smtp
+
+    @staticmethod
+    def _alive(smtp):
+        try:
+            return smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            try:
+                smtp = self._idle.get_nowait()
+                if not self._alive(smtp):
+                    smtp = self._connect()
+            except queue.Empty:
+                smtp = self._connect()
+            healthy = False
+            try:
+                yield smtp
+                healthy = True
+            finally:
+                if healthy:
+                    self._idle.put(smtp)
+                else:
+                    smtp.close()
+
+    def close(self):
+        while not self._idle.empty():
+            smtp = self._idle.get_nowait()
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                smtp.close()
+
+
+def _send_batch(pool, snapshot, batch):
+    """Send one batch over a pooled connection; reconnect once if the server drops it."""
+    pending, sent, failed = list(batch), 0, []
+    for attempt in range(2):
+        try:
+            with pool.connection() as smtp:
+                while pending:
+                    recipient = pending[0]
+                    try:
+                        smtp.send_message(render_digest(recipient, snapshot, pool.user))
+                        sent += 1
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError):
+                        failed.append(recipient.email)
+                    pending.pop(0)
+            break
+        except (smtplib.SMTPException, OSError):
+            if attempt:
+                failed.extend(r.email for r in pending)
+    return sent, failed
+
+
+def send_digests(snapshot, recipients, pool, batch_size=BATCH_SIZE):
+    """Send every recipient's digest in batches, one batch per pooled connection at a time."""
+    started = time.monotonic()
+    batches = [recipients[i:i + batch_size] for i in range(0, len(recipients), batch_size)]
+    with ThreadPoolExecutor(pool.size) as executor:
+        results = list(executor.map(lambda batch: _send_batch(pool, snapshot, batch), batches))
+    return DigestResult(str(snapshot.period), sum(sent for sent, _ in results),
+                        [email for _, failed in results for email in failed], time.monotonic() - started)
+
+
+class DigestScheduler:
+    """Sends the management digest once per closed month, and on demand, off the script thread.
+
+    The snapshot of a period is taken once per data version and shared by all
+    recipients; periods the schedule has sent are recorded next to the recipients
+    file so a restart does not send them again. An on-demand send is not recorded,
+    so sending the open month early leaves its month-end digest due. Before a scheduled send, the period is
+    claimed with a file created exclusively there, so of several replicas sharing
+    the folder only one sends it.
+    """
+
+    def __init__(self, cube, alerts, recipients_file=RECIPIENTS_FILE, pool=None):
+        self.cube = cube
+        self.alerts = alerts
+        self.recipients_file = recipients_file
+        self.state_file = os.path.join(os.path.dirname(recipients_file), 'digest_sent.json')
+        self.pool = pool or SmtpPool()
+        self.last_result = None
+        self._snapshots = {}
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='kur-digest')
+        self._stop = threading.Event()
+
+    @property
+    def recipients(self):
+        return load_recipients(self.recipients_file)
+
+    def sent_periods(self):
+        if not os.path.exists(self.state_file):
+            return []
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def snapshot(self, period, recipients):
+        key = (pd.Timestamp(period).to_period('M'), self.cube.version)
+        if key not in self._snapshots:
+            self._snapshots = {key: Snapshot(self.cube, period, [(r.region, r.bank) for r in recipients],
+                                             self.alerts)}
+        return self._snapshots[key]
+
+    def send(self, period, scheduled=False):
+        recipients = self.recipients
+        result = send_digests(self.snapshot(period, recipients), recipients, self.pool)
+        if scheduled and result.sent:
+            periods = sorted(set(self.sent_periods()) | {result.period})
+            tmp_path = f"{self.state_file}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(periods, f)
+            os.replace(tmp_path, self.state_file)
+        self.last_result = result
+        return result
+
+    def send_async(self, period, scheduled=False):
+        """Queue a send; concurrent requests run one after another on the digest thread."""
+        return self._executor.submit(self.send, period, scheduled)
+
+    def due_period(self, today=None):
+        """The cube's last closed month, once its digest is due and if it has not been sent yet.
+
+        A month is closed once the data reaches the next month; its digest is due
+        from day DIGEST_DAY of the month after it.
+        """
+        months = self.cube.months()
+        if len(months) < 2:
+            return None
+        period = pd.Period(str(months[-1]), 'M') - 1
+        today = pd.Timestamp(today or pd.Timestamp.now())
+        due = (period + 1).to_timestamp() + pd.Timedelta(days=DIGEST_DAY - 1)
+        if today < due or str(period) in self.sent_periods() or not self.recipients:
+            return None
+        return period
+
+    def _claim_path(self, period):
+        return os.path.join(os.path.dirname(self.state_file), f"digest_{period}.claim")
+
+    def claim(self, period):
+        """Claim a period's scheduled send; False if another process (or an earlier run) has it."""
+        try:
+            fd = os.open(self._claim_path(period), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(f"{os.getpid()} {pd.Timestamp.now().isoformat()}\n")
+        return True
+
+    def release(self, period):
+        """Give a claimed period back, so a later check sends it after all."""
+        try:
+            os.remove(self._claim_path(period))
+        except FileNotFoundError:
+            pass
+
+    def start(self, interval=CHECK_INTERVAL):
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    period = self.due_period()
+                    if period is None or not self.claim(period):
+                        continue
+                    try:
+                        result = self.send_async(period.to_timestamp(), scheduled=True).result()
+                    except Exception:
+                        self.release(period)
+                        raise
+                    if not result.sent:
+                        self.release(period)
+                except Exception:
+                    logger.exception("Digest check failed; retrying in %s s", interval)
+
+        threading.Thread(target=loop, name='kur-digest-scheduler', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.pool.close()
+
+
+def main():
+    from data_store import open_store
+    from refresh import build_refresher
+
+    parser = argparse.ArgumentParser(description='Send the management email digest for one month.')
+    parser.add_argument('--period', required=True, help='month to report, YYYY-MM')
+    parser.add_argument('--recipients', default=RECIPIENTS_FILE, help='recipients JSON file')
+    args = parser.parse_args()
+
+    refresher = build_refresher(open_store())
+    ews = refresher.targets['ews']
+
+    def alerts(until, region, bank):
+        return ews.summary(until, region=region, bank=bank)
+
+    scheduler = DigestScheduler(refresher.cube, alerts, args.recipients)
+    result = scheduler.send(args.period)
+    scheduler.stop()
+    print(f"{result.period}: {result.sent} terkirim, {len(result.failed)} gagal, {result.seconds:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+# Points worth sending per horizontal pixel of a chart; more cannot be told apart on screen
+POINTS_PER_PIXEL = 1.0
+
+
+def target_points(width, points_per_pixel=POINTS_PER_PIXEL):
+    """Points to keep for a chart `width` pixels wide (at least 3: first, last and one between)."""
+    return max(int(width * points_per_pixel), 3)
+
+
+def lttb(x, y, n_out):
+    """Indices of the Largest-Triangle-Three-Buckets subset of (x, y), first and last kept.
+
+    x must be ascending. Each middle bucket keeps the point spanning the largest
+    triangle with the point kept from the previous bucket and the mean of the
+    next one, which preserves peaks and troughs that plain striding drops.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Bucket edges over the n - 2 middle points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    csum_x = np.concatenate([[0.0], np.cumsum(x)])
+    csum_y = np.concatenate([[0.0], np.cumsum(y)])
+    next_start = edges[1:]
+    next_end = np.append(edges[2:], n)
+    count = np.maximum(next_end - next_start, 1)
+    mean_x = (csum_x[next_end] - csum_x[next_start]) / count
+    mean_y = (csum_y[next_end] - csum_y[next_start]) / count
+
+    picked = np.empty(n_out, dtype=np.int64)
+    picked[0], picked[-1] = 0, n - 1
+    a = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - mean_x[b]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (mean_y[b] - ay))
+        a = lo + int(np.argmax(area))
+        picked[b + 1] = a
+    return picked
+
+
+def window(frame, x, y, start=None, end=None, width=None, points_per_pixel=POINTS_PER_PIXEL):
+    """Rows of a time series inside [start, end], LTTB-reduced on column y to fit a chart `width` pixels wide.
+
+    Narrowing the window re-reads full resolution from the frame, so zooming in
+    shows every point once the range fits the chart. Without a width, every row
+    in the window is kept.
+    """
+    keep = np.ones(len(frame), dtype=bool)
+    if start is not None:
+        keep &= (frame[x] >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        keep &= (frame[x] <= pd.Timestamp(end)).to_numpy()
+    frame = frame[keep]
+    max_points = target_points(width, points_per_pixel) if width is not None else len(frame)
+    if len(frame) <= max_points:
+        return frame
+    values = frame[x].to_numpy()
+    if np.issubdtype(values.dtype, np.datetime64):
+        values = values.astype('datetime64[ns]').astype(np.int64)
+    return frame.iloc[lttb(values, frame[y].to_numpy(), max_points)]
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from data_store import loan_filter
+
+PAGE_SIZE = 50
+LOAN_COLUMNS = ['loan_id', 'borrower_id', 'region', 'bank', 'loan_type', 'disbursement_date',
+                'disbursed_amount', 'outstanding_balance', 'collectibility_category', 'status']
+SORT_COLUMNS = ['outstanding_balance', 'disbursed_amount', 'disbursement_date', 'collectibility_category',
+                'loan_id']
+# Borrower predicates for the segments of aggregates.SEGMENTS
+SEGMENT_FILTERS = {
+    'Petani Individu': ds.field('farmer_group').is_null(),
+    'Kelompok Tani': ds.field('farmer_group').is_valid(),
+    'Pemula (<2 tahun)': ds.field('experience_years') < 2,
+    'Berpengalaman (>2 tahun)': ds.field('experience_years') >= 2,
+}
+
+
+class LoanIndex:
+    """Loan ids matching a drill-down, in display order, plus the partition keys of each.
+
+    Only the sort column, the id and the partition keys are read to build it; pages
+    are then fetched from the store by id, pruned to the partitions they fall in, so
+    no more than one page of full rows is ever materialized. The index is an Arrow
+    table (ids, dictionary-encoded month and region), so it can be kept in the
+    shared cache and read back memory-mapped without a copy.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.loan_ids = table['loan_id'].to_numpy()
+        self.months = table['month']
+        self.regions = table['region']
+
+    def __len__(self):
+        return len(self.loan_ids)
+
+    def pages(self, page_size=PAGE_SIZE):
+        return max(1, -(-len(self) // page_size))
+
+
+def scope_filter(store, filters, region=None, segment=None, status=None, collectibility=None):
+    """Predicate over the loans table: the header filters narrowed to a region or segment."""
+    terms = [loan_filter(**{**filters, 'region': region or filters.get('region')})]
+    if segment is not None:
+        borrower_ids = store.scan('borrowers', columns=['borrower_id'], filter=SEGMENT_FILTERS[segment])
+        terms.append(ds.field('borrower_id').isin(borrower_ids['borrower_id']))
+    if status:
+        terms.append(ds.field('status').isin(list(status)))
+    if collectibility:
+        terms.append(ds.field('collectibility_category').isin(list(collectibility)))
+    terms = [t for t in terms if t is not None]
+    expression = terms[0] if terms else None
+    for term in terms[1:]:
+        expression = expression & term
+    return expression
+
+
+def build_index(store, expression, sort_by='outstanding_balance', ascending=False):
+    """Sort the matching loans by one column (ties by loan_id) without loading the rest of the row.
+
+    Returns the LoanIndex table: wrap it in LoanIndex to page through it.
+    """
+    columns = list(dict.fromkeys([sort_by, 'loan_id', 'month', 'region']))
+    table = store.scan('loans', columns=columns, filter=expression)
+    loan_ids = table['loan_id'].to_numpy()
+    values = table[sort_by].to_numpy()
+    if np.issubdtype(values.dtype, np.datetime64):
+        values = values.view(np.int64)
+    order = np.lexsort((loan_ids, values if ascending else -values.astype(np.float64)))
+    order = pa.array(order)
+    return pa.table({
+        'loan_id': loan_ids[order],
+        'month': pc.dictionary_encode(table['month'].take(order)).combine_chunks(),
+        'region': pc.dictionary_encode(table['region'].take(order)).combine_chunks(),
+    })
+
+
+def fetch_page(store, index, page, page_size=PAGE_SIZE):
+    """One page of loan rows, with the borrower name, in index order."""
+    window = slice(page * page_size, (page + 1) * page_size)
+    page_ids = index.loan_ids[window]
+    if not len(page_ids):
+        return pd.DataFrame(columns=['loan_id', 'name'] + LOAN_COLUMNS[1:])
+    expression = (ds.field('month').isin(pc.unique(index.months[window]).dictionary_decode().to_pylist())
+                  & ds.field('region').isin(pc.unique(index.regions[window]).dictionary_decode().to_pylist())
+                  & ds.field('loan_id').isin(page_ids))
+    rows = store.load('loans', columns=LOAN_COLUMNS, filter=expression)
+    rows = rows.set_index('loan_id').reindex(page_ids).reset_index()
+    borrowers = store.load('borrowers', columns=['borrower_id', 'name'],
+                           filter=ds.field('borrower_id').isin(rows['borrower_id'].unique()))
+    rows = rows.merge(borrowers, on='borrower_id', how='left')
+    return rows[['loan_id', 'name'] + LOAN_COLUMNS[1:]]
@@ -0,0 +1,398 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+import alert_rules
+import schema
+from aging import _days
+
+Rule = namedtuple('Rule', ['name', 'priority', 'label', 'action'])
+RunResult = namedtuple('RunResult', ['as_of', 'evaluated', 'regions', 'seconds'])
+
+logger = logging.getLogger('kur.ews')
+
+# Thresholds, named as ALERT_THRESHOLDS in SETUP_GUIDE.md where they exist there
+THRESHOLDS = {
+    'late_days_high': 30,
+    'late_days_low': 15,
+    'payment_due_days': 30,
+    'npl_rate_high': 5.0,
+    'productivity_drop': 15.0,
+    'price_fluctuation': 10.0,
+}
+# Warning rules, most urgent first; a loan's fired rules are kept as one bit per rule
+RULES = [
+    Rule('late_30', '🔴 Tinggi', 'Delay pembayaran 30+ hari', 'Collection intensif'),
+    Rule('regional_npl', '🔴 Tinggi', 'NPL region > 5%', 'Site visit & restrukturisasi'),
+    Rule('productivity_drop', '🟡 Sedang', 'Produktivitas menurun ≥15%', 'Pendampingan teknis'),
+    Rule('price_drop', '🟡 Sedang', 'Harga jual tebu turun ≥10%', 'Monitor harga pasar'),
+    Rule('maturity', '🟡 Sedang', 'Jatuh tempo ≤30 hari', 'Reminder call'),
+    Rule('late_1', '🟢 Rendah', 'Keterlambatan 1-15 hari', 'Reminder call'),
+]
+RULE_BITS = {rule.name: np.uint8(1 << i) for i, rule in enumerate(RULES)}
+
+LOAN_COLUMNS = ['loan_id', 'borrower_id', 'region', 'bank', 'maturity_date']
+PRODUCTIVITY_COLUMNS = ['borrower_id', 'harvest_date', 'productivity_ton_per_ha', 'market_price_per_kg',
+                        'created_at']
+ALERT_COLUMNS = ['loan_id', 'borrower_id', 'region', 'bank', 'rule', 'priority', 'outstanding',
+                 'days_past_due', 'as_of', 'evaluated_at']
+# Seconds between background EWS runs
+EWS_INTERVAL = 300
+# Cached results: user-rule masks for this many as-of days, summaries for this many filter views
+RULE_MASK_DAYS = 2
+SUMMARIES = 256
+
+
+def rule_masks(features, thresholds=THRESHOLDS):
+    """One boolean mask per rule over whatever loans the feature arrays hold."""
+    live, dpd = features['live'], features['days_past_due']
+    t = thresholds
+    return {
+        'late_30': live & (dpd >= t['late_days_high']),
+        'regional_npl': live & (features['regional_npl'] > t['npl_rate_high']),
+        'productivity_drop': live & (features['productivity_drop'] >= t['productivity_drop']),
+        'price_drop': live & (features['price_drop'] >= t['price_fluctuation']),
+        'maturity': live & (features['days_to_maturity'] >= 0)
+                    & (features['days_to_maturity'] <= t['payment_due_days']),
+        'late_1': live & (dpd >= 1) & (dpd <= t['late_days_low']),
+    }
+
+
+def rule_vocabulary(aging_engine):
+    """Labels of the categorical rule variables, in the aging engine's code order."""
+    return {dim: [str(label) for label in aging_engine.labels[dim]] for dim in alert_rules.CATEGORIES}
+
+
+def _remember(cache, key, value, size):
+    """Keep a result in an LRU dict whose keys end with the rule revision, dropping other revisions."""
+    for stale in [k for k in cache if k[-1] != key[-1]]:
+        del cache[stale]
+    cache[key] = value
+    while len(cache) > size:
+        cache.popitem(last=False)
+
+
+def _last_two_harvests(frame):
+    """Latest and previous harvest per borrower, indexed by borrower_id."""
+    frame = frame.sort_values(['borrower_id', 'harvest_date'], kind='stable')
+    borrower = frame['borrower_id'].to_numpy()
+    last = np.flatnonzero(np.append(borrower[1:] != borrower[:-1], True))
+    prev = np.maximum(last - 1, 0)
+    has_prev = (last > 0) & (borrower[prev] == borrower[last])
+    columns = {'harvest_date': 'date', 'productivity_ton_per_ha': 'productivity',
+               'market_price_per_kg': 'price'}
+    result = {}
+    for column, name in columns.items():
+        values = frame[column].to_numpy()
+        missing = np.datetime64('NaT') if column == 'harvest_date' else np.nan
+        result[name] = values[last]
+        result[f'prev_{name}'] = np.where(has_prev, values[prev], missing)
+    for name in ('productivity', 'price'):
+        result[f'{name}_drop'] = np.nan_to_num(
+            100 * (result[f'prev_{name}'] - result[name]) / result[f'prev_{name}'], nan=0.0)
+    return pd.DataFrame(result, index=pd.Index(borrower[last], name='borrower_id'))
+
+
+def _price_sums(frame):
+    """Sum and count of cane prices per harvest month and borrower."""
+    month = frame['harvest_date'].dt.to_period('M').rename('month')
+    return frame.groupby([month, frame['borrower_id']])['market_price_per_kg'].agg(['sum', 'count'])
+
+
+class EarlyWarningEngine:
+    """Evaluates the warning rules over every loan as boolean masks and keeps the alerts table.
+
+    Loan state (days past due, balance) comes from the AgingEngine, harvest history
+    per borrower from the productivity table. Fired rules are held as a bitmask per
+    loan. After a merge only the changed loans, plus the loans of a region whose NPL
+    crossed the threshold, are re-evaluated, and only their regions' partitions of
+    the `alerts` table are rewritten. A new as-of date re-evaluates the whole book,
+    since maturity and arrears move with the calendar.
+    """
+
+    def __init__(self, loans, productivity, aging_engine, store=None, rules=None):
+        self.aging = aging_engine
+        self.store = store
+        self.rules = rules
+        self._lock = threading.RLock()
+        self._set_loans(loans[LOAN_COLUMNS])
+        self.harvests = _last_two_harvests(productivity)
+        self._price = _price_sums(productivity)
+        self.day = None
+        self.fired = np.zeros(len(self.loan_ids), dtype=np.uint8)
+        self._state = None
+        self._position = None
+        self._summaries = OrderedDict()
+        self._rule_masks = OrderedDict()
+        self._pending = np.array([], dtype=np.int64)
+        self._regional_flag = np.array([], dtype=bool)
+        self._dirty = np.array([], dtype=np.int64)
+        self.last_run = None
+
+    def _set_loans(self, loans):
+        loans = loans.sort_values('loan_id', kind='stable').reset_index(drop=True)
+        self._frame = loans
+        self.loan_ids = loans['loan_id'].to_numpy(np.int64)
+        self.borrower_ids = loans['borrower_id'].to_numpy(np.int64)
+        # Dense borrower codes: distinct debtors per rule are a bincount, not a sort
+        self.borrower_codes, borrowers = pd.factorize(self.borrower_ids)
+        self.n_borrowers = len(borrowers)
+        self.matures_on = _days(loans['maturity_date'])
+        self.region_codes, self.regions = pd.factorize(loans['region'], sort=True)
+        self.bank_codes, self.banks = pd.factorize(loans['bank'], sort=True)
+
+    # -- merging -------------------------------------------------------------
+
+    def merge(self, loans=None, payments=None, borrowers=None, productivity=None):
+        """Take changed loans, new payments and new harvests; re-evaluation waits for the next run."""
+        with self._lock:
+            changed = []
+            if loans is not None and len(loans):
+                old_ids, old_fired = self.loan_ids, self.fired
+                kept = self._frame[~self._frame['loan_id'].isin(loans['loan_id'])]
+                self._set_loans(schema.concat([kept, loans[LOAN_COLUMNS]], ignore_index=True))
+                self.fired = np.zeros(len(self.loan_ids), dtype=np.uint8)
+                self.fired[np.searchsorted(self.loan_ids, old_ids)] = old_fired
+                changed.append(loans['loan_id'].to_numpy(np.int64))
+            if payments is not None and len(payments):
+                changed.append(payments['loan_id'].to_numpy(np.int64))
+            if productivity is not None and len(productivity):
+                changed.append(self.loan_ids[np.isin(self.borrower_ids, self._merge_harvests(productivity))])
+            if changed:
+                self._pending = np.union1d(self._pending, np.concatenate(changed))
+                # Every cached mask and summary predates the new data
+                self._summaries.clear()
+                self._rule_masks.clear()
+
+    def _merge_harvests(self, harvests):
+        touched = harvests['borrower_id'].unique()
+        known = self.harvests.loc[self.harvests.index.intersection(touched)]
+        previous = pd.DataFrame({
+            'borrower_id': np.concatenate([known.index, known.index]),
+            'harvest_date': np.concatenate([known['date'], known['prev_date']]),
+            'productivity_ton_per_ha': np.concatenate([known['productivity'], known['prev_productivity']]),
+            'market_price_per_kg': np.concatenate([known['price'], known['prev_price']]),
+        }).dropna(subset=['harvest_date'])
+        updated = _last_two_harvests(pd.concat([previous, harvests[previous.columns]], ignore_index=True))
+        self.harvests = pd.concat([self.harvests.drop(updated.index, errors='ignore'), updated]).sort_index()
+        self._price = self._price.add(_price_sums(harvests), fill_value=0).sort_index()
+        return touched
+
+    # -- evaluation ----------------------------------------------------------
+
+    def _regional_npl(self, state, position):
+        """NPL rate per region code (collectibility 3-5 share of outstanding), over the whole book."""
+        outstanding = state['outstanding'][position]
+        npl = np.where(state['collectibility'][position] >= 3, outstanding, 0.0)
+        total = np.bincount(self.region_codes, weights=outstanding, minlength=len(self.regions))
+        npl = np.bincount(self.region_codes, weights=npl, minlength=len(self.regions))
+        return np.divide(100 * npl, total, out=np.zeros_like(total), where=total > 0)
+
+    def _fire(self, rows, day, state, position, regional_npl):
+        """Fired-rule bits of the given loans as of a day."""
+        position = position[rows]
+        drops = self.harvests[['productivity_drop', 'price_drop']].reindex(self.borrower_ids[rows]).fillna(0.0)
+        features = {
+            'live': state['live'][position],
+            'days_past_due': state['days_past_due'][position],
+            'days_to_maturity': self.matures_on[rows] - _days(day)[()],
+            'regional_npl': regional_npl[self.region_codes[rows]],
+            'productivity_drop': drops['productivity_drop'].to_numpy(),
+            'price_drop': drops['price_drop'].to_numpy(),
+        }
+        fired = np.zeros(len(rows), dtype=np.uint8)
+        for name, mask in rule_masks(features).items():
+            fired |= np.where(mask, RULE_BITS[name], np.uint8(0))
+        return fired
+
+    def evaluate(self, as_of):
+        """Bring the fired-rule bits up to date as of a date; returns the number of loans re-evaluated."""
+        with self._lock:
+            day = np.datetime64(as_of, 'D')
+            if day == self.day and not len(self._pending):
+                return 0
+            state = self.aging.evaluate(day)
+            position = self._positions(state)
+            regional_npl = self._regional_npl(state, position)
+            regional_flag = regional_npl > THRESHOLDS['npl_rate_high']
+            if day != self.day or len(self._regional_flag) != len(regional_flag):
+                rows = np.arange(len(self.loan_ids))
+            else:
+                flipped = np.flatnonzero(regional_flag != self._regional_flag)
+                rows = np.union1d(np.searchsorted(self.loan_ids, self._pending),
+                                  np.flatnonzero(np.isin(self.region_codes, flipped)))
+            self.fired[rows] = self._fire(rows, day, state, position, regional_npl)
+            self.day, self._state, self._position, self._regional_flag = day, state, position, regional_flag
+            self._dirty = np.union1d(self._dirty, self.region_codes[rows])
+            self._pending = np.array([], dtype=np.int64)
+            self._summaries.clear()
+            self._rule_masks.clear()
+            return len(rows)
+
+    def run(self, as_of=None):
+        """Evaluate as of a date (default: the newest data) and rewrite the changed alert partitions."""
+        with self._lock:
+            started = time.monotonic()
+            evaluated = self.evaluate(as_of or self.aging.last_date)
+            touched, self._dirty = self._dirty, np.array([], dtype=np.int64)
+            if self.store is not None and len(touched):
+                alerts = self.alerts(np.isin(self.region_codes, touched))
+                self.store.replace('alerts', alerts, pd.DataFrame({'region': self.regions[touched]}))
+            self.last_run = RunResult(str(self.day), evaluated, len(touched), time.monotonic() - started)
+            return self.last_run
+
+    def alerts(self, keep=None):
+        """One row per loan and fired rule, shaped like the `alerts` table."""
+        keep = np.ones(len(self.loan_ids), dtype=bool) if keep is None else keep
+        frames = []
+        for rule in RULES:
+            rows = np.flatnonzero(keep & ((self.fired & RULE_BITS[rule.name]) != 0))
+            frames.append(pd.DataFrame({
+                'loan_id': self.loan_ids[rows],
+                'borrower_id': self.borrower_ids[rows],
+                'region': self.regions[self.region_codes[rows]],
+                'bank': self.banks[self.bank_codes[rows]],
+                'rule': rule.name,
+                'priority': rule.priority,
+                'outstanding': self._state['outstanding'][self._position[rows]],
+                'days_past_due': self._state['days_past_due'][self._position[rows]],
+            }))
+        frame = pd.concat(frames, ignore_index=True)
+        frame['as_of'] = pd.Timestamp(self.day)
+        frame['evaluated_at'] = pd.Timestamp.now()
+        return frame[ALERT_COLUMNS]
+
+    def vocabulary(self):
+        """Labels of the categorical rule variables, in code order."""
+        return rule_vocabulary(self.aging)
+
+    def _positions(self, state):
+        """Row of each of this engine's loans in an aging state, taken from the state's own loan order."""
+        return np.searchsorted(state['loan_ids'], self.loan_ids)
+
+    def _variables(self, day, state, position):
+        """Every loan's rule inputs as of a day, each gathered only if a rule uses it."""
+
+        def drop(column):
+            return lambda: self.harvests[column].reindex(self.borrower_ids).fillna(0.0).to_numpy()
+
+        getters = {
+            'late_days': lambda: state['days_past_due'][position],
+            'outstanding_balance': lambda: state['outstanding'][position],
+            'disbursed_amount': lambda: state['disbursed'][position],
+            'collectibility': lambda: state['collectibility'][position],
+            'days_to_maturity': lambda: self.matures_on - _days(day)[()],
+            'regional_npl': lambda: self._regional_npl(state, position)[self.region_codes],
+            'productivity_drop': drop('productivity_drop'),
+            'price_drop': drop('price_drop'),
+        }
+        for dim in alert_rules.CATEGORIES:
+            getters[dim] = lambda dim=dim: state['codes'][dim][position]
+        return alert_rules.Variables(getters, len(self.loan_ids))
+
+    # -- reading -------------------------------------------------------------
+
+    def mask(self, region=None, bank=None, loan_type=None, masa_tanam=None):
+        """Loans matching the dashboard filters, in this engine's loan order."""
+        with self._lock:
+            self.evaluate(self.aging.last_date)
+            keep = self.aging.mask(region=region, bank=bank, loan_type=loan_type, masa_tanam=masa_tanam,
+                                   state=self._state)
+            return keep[self._position]
+
+    def hits(self, as_of):
+        """(aging state, loan rows in it, rules, {rule name: mask}) for every loan as of a date, in this engine's loan order.
+
+        The newest date reads the live bits; an earlier date is evaluated on the
+        side, leaving the live bits and the `alerts` table as they are. User rules
+        follow the built-in ones, each evaluated once per day and rule revision.
+        """
+        with self._lock:
+            self.evaluate(self.aging.last_date)
+            day = np.datetime64(as_of, 'D')
+            if day == self.day:
+                state, position, fired = self._state, self._position, self.fired
+            else:
+                state = self.aging.evaluate(day)
+                position = self._positions(state)
+                fired = self._fire(np.arange(len(self.loan_ids)), day, state, position,
+                                   self._regional_npl(state, position))
+            masks = {rule.name: (fired & RULE_BITS[rule.name]) != 0 for rule in RULES}
+            rules = list(RULES)
+            if self.rules is not None:
+                revision = self.rules.revision
+                if (day, revision) in self._rule_masks:
+                    self._rule_masks.move_to_end((day, revision))
+                else:
+                    _remember(self._rule_masks, (day, revision),
+                              self.rules.evaluate(self._variables(day, state, position), self.vocabulary()), RULE_MASK_DAYS)
+                live = state['live'][position]
+                masks.update({f"custom:{name}": live & mask
+                              for name, mask in self._rule_masks[(day, revision)].items()})
+                rules += [Rule(f"custom:{r.name}", r.priority, r.name, r.action) for r in self.rules.rules]
+            return state, position, [rule for rule in rules if rule.name in masks], masks
+
+    def summary(self, until=None, **filters):
+        """Debtors and outstanding per rule for the filtered book, shaped like the alert table."""
+        with self._lock:
+            self.evaluate(self.aging.last_date)
+            day = np.datetime64(self.aging._as_of(until), 'D')
+            revision = self.rules.revision if self.rules is not None else None
+            key = (day, tuple(sorted(filters.items())), revision)
+            if key in self._summaries:
+                self._summaries.move_to_end(key)
+                return self._summaries[key]
+            state, position, rules, masks = self.hits(day)
+            keep = self.aging.mask(state=state, **filters)[position]
+            outstanding = state['outstanding'][position]
+            rows = []
+            for rule in rules:
+                hit = np.flatnonzero(keep & masks[rule.name])
+                rows.append({
+                    'Prioritas': rule.priority,
+                    'Jenis Risiko': rule.label,
+                    'Jumlah Debitur': np.count_nonzero(np.bincount(self.borrower_codes[hit],
+                                                                   minlength=self.n_borrowers)),
+                    'Potensi Dampak': outstanding[hit].sum(),
+                    'Tindakan': rule.action,
+                })
+            summary = pd.DataFrame(rows, index=pd.Index([rule.name for rule in rules], name='rule'))
+            _remember(self._summaries, key, summary, SUMMARIES)
+            return summary
+
+    def market_price(self, until=None, **filters):
+        """Average cane price of the filtered debtors' harvests in the latest month up to `until`,
+        and its change from the harvest month before; (nan, 0.0) when they have no harvests."""
+        with self._lock:
+            month = pd.Period(self.aging._as_of(until), 'M')
+            borrowers = np.unique(self.borrower_ids[self.mask(**filters)])
+            index = self._price.index
+            keep = (index.get_level_values('month') <= month) & index.get_level_values('borrower_id').isin(borrowers)
+            totals = self._price[keep].groupby(level='month').sum()
+        if not len(totals):
+            return np.nan, 0.0
+        price = totals['sum'] / totals['count']
+        latest = price.iloc[-1]
+        previous = price.iloc[-2] if len(price) > 1 else latest
+        return latest, 100 * (latest - previous) / previous
+
+    def start(self, refresher, interval=EWS_INTERVAL):
+        """Refresh the aggregates and run the rules every `interval` seconds on a daemon thread."""
+        def loop():
+            while True:
+                try:
+                    refresher.refresh()
+                    self.run()
+                except Exception:
+                    # Keep the thread alive: the next round retries with whatever data is there then
+                    logger.exception("EWS refresh failed; retrying in %s s", interval)
+                time.sleep(interval)
+
+        self.run()
+
+        threading.Thread(target=loop, name='kur-ews', daemon=True).start()
+        return self
@@ -0,0 +1,209 @@
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+
+import numpy as np
+import pyarrow as pa
+import xlsxwriter
+
+from data_store import DataStore
+
+# Where finished workbooks are written (override with KUR_EXPORT_DIR)
+EXPORT_DIR = os.getenv('KUR_EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'kur_exports'))
+# Workbooks older than this are deleted when a new export starts
+EXPORT_TTL = 24 * 3600
+
+# Rows per Excel sheet, less the header row; longer listings continue on the next sheet
+MAX_SHEET_ROWS = 1048575
+BATCH_ROWS = 65536
+
+# Loan listing columns with their header and number format
+LOAN_SHEET_COLUMNS = {
+    'loan_id': ('ID Kredit', '0'),
+    'borrower_id': ('ID Debitur', '0'),
+    'region': ('Region', None),
+    'bank': ('Bank', None),
+    'loan_type': ('Jenis Kredit', None),
+    'disbursement_date': ('Tanggal Pencairan', 'yyyy-mm-dd'),
+    'maturity_date': ('Jatuh Tempo', 'yyyy-mm-dd'),
+    'disbursed_amount': ('Plafon (Rp)', '#,##0'),
+    'outstanding_balance': ('Outstanding (Rp)', '#,##0'),
+    'interest_rate': ('Bunga (%)', '0.00'),
+    'collectibility_category': ('Kolektibilitas', '0'),
+    'status': ('Status', None),
+}
+EXCEL_EPOCH = np.datetime64('1899-12-30', 'ns')
+STAGES = ["Menyiapkan", "Menghitung kredit", "Menulis ringkasan", "Menulis daftar kredit", "Menyimpan"]
+
+
+def _excel_values(column):
+    """A record batch column as Python values xlsxwriter writes without per-cell conversion."""
+    if pa.types.is_timestamp(column.type):
+        serial = (column.to_numpy(zero_copy_only=False) - EXCEL_EPOCH) / np.timedelta64(1, 'D')
+        return [None if np.isnan(v) else v for v in serial.tolist()]
+    if pa.types.is_dictionary(column.type):
+        column = column.cast(pa.string())
+    return column.to_pylist()
+
+
+def write_workbook(path, sheets, store_root=None, loan_filter=None, progress=None):
+    """Write the section tables, then the optional loan listing, into one .xlsx file.
+
+    The workbook is in constant-memory mode: rows go to disk as they are written,
+    and loans are scanned from the store in record batches, so memory stays flat
+    however long the listing is. `progress(stage, rows_written, total_rows)` is
+    called as the export advances.
+    """
+    progress = progress or (lambda stage, written, total: None)
+    loans = DataStore(store_root).dataset('loans') if store_root else None
+    total = sum(len(frame) for frame in sheets.values())
+    if loans is not None:
+        progress(1, 0, total)
+        total += loans.count_rows(filter=loan_filter)
+
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True})
+    header = workbook.add_format({'bold': True, 'bg_color': '#1f77b4', 'font_color': 'white'})
+    formats = {}
+
+    def number_format(spec):
+        if spec and spec not in formats:
+            formats[spec] = workbook.add_format({'num_format': spec})
+        return formats.get(spec)
+
+    written = 0
+    progress(2, written, total)
+    for title, frame in sheets.items():
+        sheet = workbook.add_worksheet(title[:31])
+        sheet.write_row(0, 0, [str(c) for c in frame.columns], header)
+        for col, dtype in enumerate(frame.dtypes):
+            spec = 'yyyy-mm-dd' if dtype.kind == 'M' else '#,##0.00' if dtype.kind == 'f' else None
+            sheet.set_column(col, col, 18, number_format(spec))
+        values = frame.astype({c: object for c, d in frame.dtypes.items() if d.kind == 'M'})
+        for row, record in enumerate(values.itertuples(index=False), start=1):
+            sheet.write_row(row, 0, [None if v != v else v for v in record])
+        written += len(frame)
+        progress(2, written, total)
+
+    if loans is not None:
+        columns = list(LOAN_SHEET_COLUMNS)
+        sheet, row, number = None, MAX_SHEET_ROWS + 1, 0
+        for batch in loans.scanner(columns=columns, filter=loan_filter, batch_size=BATCH_ROWS).to_batches():
+            start = 0
+            while start < batch.num_rows:
+                if row > MAX_SHEET_ROWS:
+                    number += 1
+                    sheet, row = workbook.add_worksheet(f"Kredit {number}"), 1
+                    sheet.write_row(0, 0, [LOAN_SHEET_COLUMNS[c][0] for c in columns], header)
+                    for col, c in enumerate(columns):
+                        sheet.set_column(col, col, 16, number_format(LOAN_SHEET_COLUMNS[c][1]))
+                chunk = batch.slice(start, MAX_SHEET_ROWS + 1 - row)
+                for record in zip(*(_excel_values(chunk.column(c)) for c in columns)):
+                    sheet.write_row(row, 0, record)
+                    row += 1
+                start += chunk.num_rows
+                written += chunk.num_rows
+                progress(3, written, total)
+
+    progress(4, written, total)
+    workbook.close()
+
+
+def _export_process(path, sheets, store_root, loan_filter, stage, written, total, errors):
+    def progress(s, w, t):
+        stage.value, written.value, total.value = s, w, t
+
+    try:
+        write_workbook(path, sheets, store_root, loan_filter, progress)
+    except BaseException as e:
+        errors.put(f"{type(e).__name__}: {e}")
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+
+class ExportJob:
+    """One workbook export running in a background process.
+
+    Writing cells is pure Python, so a long loan listing runs in its own process
+    rather than a thread: it neither holds the server's GIL nor grows its heap.
+    The session polls `progress` and `message` and downloads `path` when `done`.
+    """
+
+    _context = multiprocessing.get_context('spawn')
+
+    def __init__(self, sheets, store_root=None, loan_filter=None, name='laporan_kur'):
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        self.file_name = f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.xlsx"
+        self.path = os.path.join(EXPORT_DIR, f"{uuid.uuid4().hex[:8]}_{self.file_name}")
+        self.started = time.monotonic()
+        self._stage = self._context.Value('i', 0, lock=False)
+        self._written = self._context.Value('q', 0, lock=False)
+        self._total = self._context.Value('q', 0, lock=False)
+        self._errors = self._context.SimpleQueue()
+        self._error = None
+        self._process = self._context.Process(
+            target=_export_process, name='kur-export', daemon=True,
+            args=(self.path, sheets, store_root, loan_filter, self._stage, self._written, self._total,
+                  self._errors),
+        )
+
+    def start(self):
+        self._process.start()
+        return self
+
+    def cancel(self):
+        self._process.terminate()
+        self._process.join()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._error = "Export dibatalkan"
+
+    @property
+    def running(self):
+        return self._process.is_alive()
+
+    @property
+    def error(self):
+        if self._error is None and not self.running and self._process.exitcode:
+            self._error = self._errors.get() if not self._errors.empty() else f"exit {self._process.exitcode}"
+        return self._error
+
+    @property
+    def done(self):
+        return not self.running and self.error is None and os.path.exists(self.path)
+
+    @property
+    def rows_written(self):
+        return self._written.value
+
+    @property
+    def total_rows(self):
+        return self._total.value
+
+    @property
+    def progress(self):
+        return min(1.0, self.rows_written / self.total_rows) if self.total_rows else 0.0
+
+    @property
+    def message(self):
+        return STAGES[self._stage.value]
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+
+def purge_exports(max_age=EXPORT_TTL):
+    """Delete finished workbooks older than max_age seconds."""
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    cutoff = time.time() - max_age
+    for entry in os.scandir(EXPORT_DIR):
+        if entry.name.endswith('.xlsx') and entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
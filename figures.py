@@ -0,0 +1,63 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import plotly.io as pio
+
+# Memory cap for the serialized figures kept by the process (override with KUR_FIGURE_CACHE_MB)
+FIGURE_CACHE_MB = float(os.getenv('KUR_FIGURE_CACHE_MB', '64'))
+
+
+class FigureCache:
+    """LRU of built Plotly figures keyed by (data key, figure id), capped in serialized bytes.
+
+    The data key is whatever identifies the figure's inputs, typically the data
+    version for the current filters plus the filter values, so a merged refresh
+    or a different filter simply misses. Figures are kept as the go.Figure that
+    was built: st.plotly_chart only calls to_dict() on a Figure, where a dict
+    would be validated into a new Figure on every rerun. Callers must not modify
+    a cached figure. Shared by all sessions; thread-safe.
+    """
+
+    def __init__(self, max_mb=FIGURE_CACHE_MB):
+        self.max_bytes = int(max_mb * 2**20)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._figures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, data_key, figure_id):
+        """The cached figure, or None if it has to be built."""
+        with self._lock:
+            entry = self._figures.get((data_key, figure_id))
+            if entry is None:
+                self.misses += 1
+                return None
+            self._figures.move_to_end((data_key, figure_id))
+            self.hits += 1
+        return entry[0]
+
+    def put(self, data_key, figure_id, figure):
+        """Keep a freshly built figure, sized by its serialized JSON, and return it."""
+        size = sys.getsizeof(pio.to_json(figure, validate=False))
+        with self._lock:
+            previous = self._figures.pop((data_key, figure_id), None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            if size <= self.max_bytes:
+                self._figures[(data_key, figure_id)] = (figure, size)
+                self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._figures.popitem(last=False)
+                self.bytes -= evicted
+        return figure
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._figures)
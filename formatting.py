@@ -0,0 +1,40 @@
+import streamlit as st
+
+# Rupiah display units: Triliun, Miliar, Juta
+UNITS = {'T': 1e12, 'M': 1e9, 'Jt': 1e6}
+
+
+def scaled(values, unit='M'):
+    """Whole column of Rupiah amounts in display units (vectorized; stays numeric)."""
+    return values / UNITS[unit]
+
+
+# Table columns: numbers stay numbers, so columns sort numerically and the browser formats them
+
+def rupiah(label, unit='M', decimals=2, **kwargs):
+    """Column config for a Rupiah column already scaled to `unit`."""
+    return st.column_config.NumberColumn(label, format=f"Rp %.{decimals}f {unit}", **kwargs)
+
+
+def percent(label, decimals=2, **kwargs):
+    return st.column_config.NumberColumn(label, format=f"%.{decimals}f%%", **kwargs)
+
+
+def hectare(label, **kwargs):
+    return st.column_config.NumberColumn(label, format="%d Ha", **kwargs)
+
+
+def count(label, **kwargs):
+    return st.column_config.NumberColumn(label, format="%d", **kwargs)
+
+
+# Chart labels: Plotly formats the scaled values client-side through a texttemplate
+
+def rupiah_labels(values, unit='M', decimals=1):
+    """update_traces() arguments labelling bars with Rupiah amounts."""
+    return {'text': scaled(values, unit), 'texttemplate': f"Rp %{{text:.{decimals}f}} {unit}"}
+
+
+def percent_labels(values, decimals=1):
+    """update_traces() arguments labelling bars with percentages."""
+    return {'text': values, 'texttemplate': f"%{{text:.{decimals}f}}%"}
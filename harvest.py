@@ -0,0 +1,122 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from cube import masa_tanam_of
+
+MONTH_LABELS = ['Jan', 'Feb', 'Mar', 'Apr', 'Mei', 'Jun', 'Jul', 'Agt', 'Sep', 'Okt', 'Nov', 'Des']
+# The dashboard filters a cell is labelled with
+CELL_DIMENSIONS = ['region', 'bank', 'loan_type', 'masa_tanam']
+
+LOAN_COLUMNS = ['loan_id', 'borrower_id', 'region', 'bank', 'loan_type', 'disbursement_date']
+PAYMENT_COLUMNS = ['loan_id', 'payment_date', 'payment_amount']
+PRODUCTIVITY_COLUMNS = ['borrower_id', 'harvest_date', 'harvest_amount_ton', 'created_at']
+
+
+class HarvestCalendar:
+    """Harvested tons and repaid Rupiah per calendar month and filter cell, for the seasonal chart.
+
+    Each payment falls in its loan's region x bank x loan_type x masa_tanam cell,
+    and each harvest in the cell of the borrower's most recent loan. Both are binned
+    into dense month x cell arrays with one bincount, so a merge adds its rows'
+    bins to the months they fall in and leaves every other month as it is. A view
+    for any filter is a sum over the matching cells of twelve months.
+    """
+
+    def __init__(self, loans, payments, productivity):
+        self.cells = pd.DataFrame({dim: pd.Series(dtype=object) for dim in CELL_DIMENSIONS})
+        # (months, cell labels, tons, paid): replaced as a whole, so a view never mixes two merges
+        self.arrays = (np.array([], dtype='datetime64[M]'), self.cells, np.zeros((0, 0)), np.zeros((0, 0)))
+        self.version = 0
+        self._loan_cell = pd.Series(dtype=np.int64)
+        self._borrower_cell = pd.Series(dtype=np.int64)
+        self._lock = threading.Lock()
+        self._merge(loans, payments, productivity)
+
+    def _cell_codes(self, frame):
+        """Cell of every row, appending cells not seen before."""
+        # Label combinations are few: match them once, then spread to the rows by integer key
+        codes, labels = zip(*(pd.factorize(frame[dim]) for dim in CELL_DIMENSIONS))
+        key = np.ravel_multi_index(codes, tuple(len(values) for values in labels))
+        combos, inverse = np.unique(key, return_inverse=True)
+        keys = pd.MultiIndex.from_arrays([np.asarray(values)[index] for values, index in
+                                          zip(labels, np.unravel_index(combos, tuple(map(len, labels))))],
+                                         names=CELL_DIMENSIONS)
+        cells = pd.MultiIndex.from_frame(self.cells).get_indexer(keys)
+        if (cells < 0).any():
+            self.cells = pd.concat([self.cells, keys[cells < 0].to_frame(index=False)], ignore_index=True)
+            cells = pd.MultiIndex.from_frame(self.cells).get_indexer(keys)
+        return cells[inverse]
+
+    def _merge(self, loans, payments, productivity):
+        if len(loans):
+            cells = self._cell_codes(pd.DataFrame({
+                'region': loans['region'].to_numpy(), 'bank': loans['bank'].to_numpy(),
+                'loan_type': loans['loan_type'].to_numpy(), 'masa_tanam': masa_tanam_of(loans['disbursement_date']),
+            }))
+            self._loan_cell = pd.Series(cells, index=loans['loan_id'].to_numpy()).combine_first(self._loan_cell)
+            latest = (pd.DataFrame({'borrower_id': loans['borrower_id'].to_numpy(), 'cell': cells,
+                                    'date': loans['disbursement_date'].to_numpy()})
+                      .sort_values('date', kind='stable').drop_duplicates('borrower_id', keep='last'))
+            self._borrower_cell = (pd.Series(latest['cell'].to_numpy(), index=latest['borrower_id'].to_numpy())
+                                   .combine_first(self._borrower_cell))
+        # Rows whose loan (or borrower's loan) is unknown cannot be placed in a cell
+        pay_cell = self._loan_cell.reindex(payments['loan_id'].to_numpy()).to_numpy()
+        harvest_cell = self._borrower_cell.reindex(productivity['borrower_id'].to_numpy()).to_numpy()
+        pay_rows, harvest_rows = ~np.isnan(pay_cell), ~np.isnan(harvest_cell)
+        rows = {
+            'tons': (productivity['harvest_date'].to_numpy()[harvest_rows].astype('datetime64[M]'),
+                     harvest_cell[harvest_rows].astype(np.int64),
+                     productivity['harvest_amount_ton'].to_numpy(np.float64)[harvest_rows]),
+            'paid': (payments['payment_date'].to_numpy()[pay_rows].astype('datetime64[M]'),
+                     pay_cell[pay_rows].astype(np.int64),
+                     payments['payment_amount'].to_numpy(np.float64)[pay_rows]),
+        }
+        dates = np.concatenate([rows['tons'][0], rows['paid'][0]])
+        if not len(dates):
+            return np.array([], dtype='datetime64[M]')
+
+        # Grow the month axis to the new dates and the cell axis to the new cells, then add each row's bin
+        months = self.arrays[0]
+        first = min(months.min(initial=dates.min()), dates.min())
+        axis = np.arange(first, max(months.max(initial=dates.max()), dates.max()) + 1)
+        offset = int((months[0] - first).astype(np.int64)) if len(months) else 0
+        shape = (len(axis), len(self.cells))
+        binned, touched = [], []
+        for name, old in (('tons', self.arrays[2]), ('paid', self.arrays[3])):
+            month_rows, cell_rows, weights = rows[name]
+            month = (month_rows - first).astype(np.int64)
+            values = np.bincount(month * shape[1] + cell_rows, weights=weights,
+                                 minlength=shape[0] * shape[1]).astype(np.float64, copy=False).reshape(shape)
+            values[offset:offset + old.shape[0], :old.shape[1]] += old
+            binned.append(values)
+            touched.append(month)
+        self.arrays = (axis, self.cells, *binned)
+        self.version += 1
+        return axis[np.unique(np.concatenate(touched))]
+
+    def merge(self, loans=None, payments=None, borrowers=None, productivity=None):
+        """Bin new loans' cells, new payments and new harvests; returns touched months."""
+        loans = loans if loans is not None else pd.DataFrame(columns=LOAN_COLUMNS)
+        payments = payments if payments is not None else pd.DataFrame(columns=PAYMENT_COLUMNS)
+        productivity = productivity if productivity is not None else pd.DataFrame(columns=PRODUCTIVITY_COLUMNS)
+        with self._lock:
+            return self._merge(loans, payments, productivity)
+
+    def alignment(self, until=None, region=None, bank=None, loan_type=None, masa_tanam=None):
+        """Share of the twelve months up to `until` harvested and repaid in each calendar month, Jan-Des."""
+        months, cells, tons, paid = self.arrays
+        keep = np.ones(len(cells), dtype=bool)
+        for dim, value in (('region', region), ('bank', bank), ('loan_type', loan_type), ('masa_tanam', masa_tanam)):
+            if value is not None:
+                keep &= cells[dim].to_numpy() == value
+        stop = np.searchsorted(months, np.datetime64(until, 'M'), side='right') if until is not None else len(months)
+        window = slice(max(stop - 12, 0), stop)
+        calendar = months[window].astype(np.int64) % 12
+        frame = pd.DataFrame({'Bulan': MONTH_LABELS, 'Panen_Expected': 0.0, 'Pembayaran_Aktual': 0.0})
+        for column, values in (('Panen_Expected', tons), ('Pembayaran_Aktual', paid)):
+            by_month = values[window][:, keep].sum(axis=1)
+            total = by_month.sum()
+            frame.loc[calendar, column] = 100 * by_month / total if total else 0.0
+        return frame
@@ -0,0 +1,201 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Trace every rerun and log it as a JSON line (set KUR_PERF=1); the sidebar toggle traces one session
+ENABLED = os.getenv('KUR_PERF', '').lower() in ('1', 'true', 'yes')
+
+logger = logging.getLogger('kur.perf')
+
+# Active benchmark recorder, if any; mark() only feeds it while set
+_recorder = None
+# Trace of the script run on this thread (Streamlit runs each session's script on its own thread)
+_local = threading.local()
+_DISABLED = nullcontext()
+
+
+class SectionRecorder:
+    """Wall time (and optionally Python/numpy allocations) per dashboard section.
+
+    The dashboard is one flat script, so sections are delimited by marks: each
+    mark closes the section opened by the previous one.
+    """
+
+    def __init__(self, trace_alloc=False):
+        self.trace_alloc = trace_alloc
+        self.sections = {}
+        self._open = None
+
+    def mark(self, name):
+        now = time.perf_counter()
+        if self._open is not None:
+            section, started, allocated = self._open
+            stats = self.sections.setdefault(section, {'wall_s': 0.0})
+            stats['wall_s'] += now - started
+            if self.trace_alloc:
+                current, peak = tracemalloc.get_traced_memory()
+                stats['alloc_peak_mb'] = max(stats.get('alloc_peak_mb', 0.0), (peak - allocated) / 2**20)
+                stats['alloc_net_mb'] = stats.get('alloc_net_mb', 0.0) + (current - allocated) / 2**20
+        self._open = None
+        if name is not None:
+            allocated = 0
+            if self.trace_alloc:
+                tracemalloc.reset_peak()
+                allocated = tracemalloc.get_traced_memory()[0]
+            self._open = (name, time.perf_counter(), allocated)
+
+
+class Trace:
+    """Nested timing spans of one script run, kept as a flat list in start order.
+
+    Three kinds of span fit the flat script: sections (mark) are top-level and
+    end where the next one starts, steps likewise run until the next step inside
+    their section, and span() blocks nest wherever they are opened.
+    """
+
+    def __init__(self, **context):
+        self.context = context
+        self.origin = time.perf_counter()
+        self.total = None
+        self.spans = []  # [name, depth, start_s, duration_s]
+        self._stack = []  # (index into spans, kind)
+
+    def _open(self, name, kind):
+        self.spans.append([name, len(self._stack), time.perf_counter() - self.origin, None])
+        self._stack.append((len(self.spans) - 1, kind))
+        return len(self._stack) - 1
+
+    def _close_to(self, depth):
+        elapsed = time.perf_counter() - self.origin
+        while len(self._stack) > depth:
+            record = self.spans[self._stack.pop()[0]]
+            record[3] = elapsed - record[2]
+
+    def mark(self, name):
+        self._close_to(0)
+        if name is not None:
+            self._open(name, 'section')
+
+    def step(self, name):
+        self._close_to(1 if self._stack and self._stack[0][1] == 'section' else 0)
+        self._open(name, 'step')
+
+    @contextmanager
+    def span(self, name):
+        depth = self._open(name, 'span')
+        try:
+            yield
+        finally:
+            self._close_to(depth)
+
+    def finish(self):
+        self._close_to(0)
+        self.total = time.perf_counter() - self.origin
+        return self
+
+    def records(self):
+        """One dict per span: its path, depth, start, duration and self time in ms."""
+        records, path = [], []
+        for name, depth, start, duration in self.spans:
+            del path[depth:]
+            path.append(name)
+            records.append({'name': name, 'path': '/'.join(path), 'depth': depth,
+                            'start_ms': 1000 * start, 'ms': 1000 * duration, 'self_ms': 1000 * duration})
+        parents = []
+        for record in records:
+            del parents[record['depth']:]
+            if parents:
+                parents[-1]['self_ms'] -= record['ms']
+            parents.append(record)
+        return records
+
+
+def _emit(trace):
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    logger.info(json.dumps({
+        'event': 'rerun',
+        'ts': round(time.time(), 3),
+        **trace.context,
+        'total_ms': round(1000 * trace.total, 2),
+        'spans': [{'path': r['path'], 'start_ms': round(r['start_ms'], 2), 'ms': round(r['ms'], 2)}
+                  for r in trace.records()],
+    }))
+
+
+def begin_run(enabled=ENABLED, **context):
+    """Start tracing this script run if enabled; the context is logged with it."""
+    _local.trace = Trace(**context) if enabled else None
+
+
+def end_run():
+    """Finish this run's trace, log it as one JSON line and return it (None when disabled)."""
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    if trace is None:
+        return None
+    _emit(trace.finish())
+    return trace
+
+
+def mark(name):
+    """Start timing the named section (None closes the last one)."""
+    if _recorder is not None:
+        _recorder.mark(name)
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.mark(name)
+
+
+def step(name):
+    """Start timing a step of the current section; it runs until the next step or section."""
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.step(name)
+
+
+def span(name):
+    """Context manager timing a nested block; a shared no-op when the run is not traced."""
+    trace = getattr(_local, 'trace', None)
+    return _DISABLED if trace is None else trace.span(name)
+
+
+@contextmanager
+def fragment(name, enabled=ENABLED, **context):
+    """Time a section; when it reruns on its own (no page trace running) it is traced as its own run."""
+    alone = enabled and getattr(_local, 'trace', None) is None
+    if alone:
+        begin_run(True, fragment=name, **context)
+    mark(name)
+    try:
+        yield
+    finally:
+        if alone:
+            end_run()
+
+
+@contextmanager
+def record(trace_alloc=False):
+    """Collect per-section stats for the script runs made inside the block."""
+    global _recorder
+    recorder = SectionRecorder(trace_alloc)
+    started_tracing = trace_alloc and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _recorder = recorder
+    try:
+        yield recorder
+    finally:
+        recorder.mark(None)
+        _recorder = None
+        if started_tracing:
+            tracemalloc.stop()
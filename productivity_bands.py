@@ -0,0 +1,140 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from aging import _days
+
+# Default band edges in ton/ha (override with KUR_PRODUCTIVITY_BANDS, e.g. "60,80,100")
+BAND_EDGES = tuple(float(edge) for edge in os.getenv('KUR_PRODUCTIVITY_BANDS', '60,80,100').split(','))
+# Results kept per (data version, bands, day, filters) before the cache starts over
+MAX_VIEWS = 256
+
+PRODUCTIVITY_COLUMNS = ['borrower_id', 'harvest_date', 'productivity_ton_per_ha']
+
+
+def parse_edges(text):
+    """Band edges from text such as "60, 80, 100"; raises ValueError unless they are ascending numbers."""
+    edges = tuple(float(part) for part in text.replace(';', ',').split(',') if part.strip())
+    if not edges or any(b <= a for a, b in zip(edges, edges[1:])):
+        raise ValueError("Batas band harus angka naik, mis. 60, 80, 100")
+    return edges
+
+
+def band_labels(edges):
+    def number(value):
+        return f"{value:g}"
+
+    return ([f"<{number(edges[0])} ton/ha"]
+            + [f"{number(a)}-{number(b)} ton/ha" for a, b in zip(edges, edges[1:])]
+            + [f">{number(edges[-1])} ton/ha"])
+
+
+class ProductivityBands:
+    """Borrowers and NPL per band of their latest harvest productivity, for the productivity chart.
+
+    The harvest history is held as flat arrays sorted by borrower, then harvest
+    date, so each borrower's harvests up to a day are a prefix of their run. Each
+    loan is joined once per data version and as-of day to its borrower's latest
+    productivity_ton_per_ha on or before that day, a searchsorted of integer keys.
+    Band codes are then a digitize per band configuration, and each view is a few
+    bincounts over the loans disbursed by the day that match the filters, cached
+    per bands, as-of day and filters.
+    """
+
+    def __init__(self, ews_engine, productivity):
+        self.ews = ews_engine
+        self.aging = ews_engine.aging
+        self.version = 0
+        self._history = self._harvest_arrays(productivity)
+        self._joined = {}
+        self._bands = {}
+        self._views = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _harvest_arrays(productivity):
+        """(borrower ids, harvest days, productivity), sorted by borrower, then harvest date."""
+        borrower = productivity['borrower_id'].to_numpy(np.int64)
+        day = _days(productivity['harvest_date'])
+        order = np.lexsort((day, borrower))
+        return borrower[order], day[order], productivity['productivity_ton_per_ha'].to_numpy(np.float64)[order]
+
+    def merge(self, loans=None, payments=None, borrowers=None, productivity=None):
+        """New loans, payments or harvests: the join is redone on the next view."""
+        with self._lock:
+            if productivity is not None and len(productivity):
+                fresh = self._harvest_arrays(productivity)
+                borrower, day, values = (np.concatenate(pair) for pair in zip(self._history, fresh))
+                order = np.lexsort((day, borrower))
+                self._history = borrower[order], day[order], values[order]
+            self.version += 1
+            self._joined, self._bands, self._views = {}, {}, {}
+
+    def _join(self, day):
+        """Productivity as of a day and dense borrower code per loan, borrower count and loan ids."""
+        if day not in self._joined:
+            borrower, harvested, values = self._history
+            # Harvests up to the day are a prefix of each borrower's run: take the run's last one
+            upto = harvested <= _days(np.datetime64(day, 'D'))[()]
+            continued = np.append((borrower[1:] == borrower[:-1]) & upto[1:], False)
+            last = np.flatnonzero(upto & ~continued)
+            keys = borrower[last]
+            engine = self.ews
+            slot = np.searchsorted(keys, engine.borrower_ids)
+            found = slot < len(keys)
+            found[found] = keys[slot[found]] == engine.borrower_ids[found]
+            productivity = np.full(len(slot), np.nan)
+            productivity[found] = values[last][slot[found]]
+            self._joined[day] = (productivity, engine.borrower_codes, engine.n_borrowers, engine.loan_ids)
+        return self._joined[day]
+
+    def _codes(self, edges, day):
+        """Band code per loan (-1 without a harvest by the day), as int8, once per band configuration."""
+        if (edges, day) not in self._bands:
+            productivity = self._join(day)[0]
+            codes = np.digitize(productivity, edges).astype(np.int8)
+            self._bands[(edges, day)] = np.where(np.isnan(productivity), np.int8(-1), codes)
+        return self._bands[(edges, day)]
+
+    def frame(self, edges=BAND_EDGES, until=None, **filters):
+        """Farmers, NPL rate and average loan per productivity band, shaped like productivity_data."""
+        edges = tuple(edges)
+        day = self.aging._as_of(until)
+        with self._lock:
+            key = (self.version, edges, day, tuple(sorted(filters.items())))
+            if key in self._views:
+                return self._views[key]
+            _, borrower_codes, n_borrowers, loan_ids = self._join(day)
+            codes = self._codes(edges, day)
+            n_bands = len(edges) + 1
+            state = self.aging.evaluate(day)
+            position = np.searchsorted(state['loan_ids'], loan_ids)
+            # Loans disbursed by the day, whose borrower had harvested by then
+            disbursed_by = state['disbursed_on'] <= _days(np.datetime64(day, 'D'))[()]
+            keep = (self.aging.mask(state=state, **filters) & disbursed_by)[position] & (codes >= 0)
+            bands = codes[keep].astype(np.int64)
+
+            # A borrower's latest harvest puts all their loans in one band: count each borrower once
+            band_of = np.full(n_borrowers, -1, dtype=np.int64)
+            band_of[borrower_codes[keep]] = bands
+            farmers = np.bincount(band_of[band_of >= 0], minlength=n_bands)
+
+            live = state['live'][position][keep]
+            outstanding = np.where(live, state['outstanding'][position][keep], 0.0)
+            npl = np.where(state['collectibility'][position][keep] >= 3, outstanding, 0.0)
+            total = np.bincount(bands, weights=outstanding, minlength=n_bands)
+            loans = np.bincount(bands, minlength=n_bands)
+            disbursed = np.bincount(bands, weights=state['disbursed'][position][keep], minlength=n_bands)
+            frame = pd.DataFrame({
+                'Produktivitas': band_labels(edges),
+                'Jumlah_Petani': farmers,
+                'NPL_Rate': np.divide(100 * np.bincount(bands, weights=npl, minlength=n_bands), total,
+                                      out=np.zeros(n_bands), where=total > 0),
+                'Avg_Loan': np.divide(disbursed, loans, out=np.zeros(n_bands), where=loans > 0),
+            })
+            if len(self._views) >= MAX_VIEWS:
+                self._joined, self._bands, self._views = {}, {}, {}
+            self._views[key] = frame
+            return frame
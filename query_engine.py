@@ -0,0 +1,97 @@
+import os
+import threading
+
+import pandas as pd
+
+from aggregates import SEGMENTS
+
+try:
+    import duckdb
+except ImportError:  # optional: without it, callers fall back to the pandas path
+    duckdb = None
+
+# Scan threads (override with KUR_DUCKDB_THREADS)
+DUCKDB_THREADS = int(os.getenv('KUR_DUCKDB_THREADS', str(os.cpu_count() or 1)))
+
+# Borrower predicate per segment of aggregates.SEGMENTS (segments overlap)
+SEGMENT_CONDITIONS = {
+    'Petani Individu': 'b.farmer_group IS NULL',
+    'Kelompok Tani': 'b.farmer_group IS NOT NULL',
+    'Pemula (<2 tahun)': 'b.experience_years < 2',
+    'Berpengalaman (>2 tahun)': 'b.experience_years >= 2',
+}
+
+
+def available():
+    return duckdb is not None
+
+
+class QueryEngine:
+    """Embedded DuckDB joining in-memory loan frames to the store's borrowers, for aggregations in SQL.
+
+    `borrowers` is a view over the store's Parquet files, so queries see new files
+    as they are written and read only the projected columns. DuckDB aggregates on
+    all scan threads and returns just the result rows. One connection is opened
+    per calling thread.
+    """
+
+    def __init__(self, store, threads=DUCKDB_THREADS):
+        self.store = store
+        self._db = duckdb.connect(config={'threads': threads})
+        files = os.path.join(store.path('borrowers'), '**', '*.parquet').replace("'", "''")
+        self._db.execute(f"CREATE VIEW borrowers AS "
+                         f"SELECT * FROM read_parquet('{files}', hive_partitioning = true)")
+        self._local = threading.local()
+
+    def _cursor(self):
+        if getattr(self._local, 'cursor', None) is None:
+            self._local.cursor = self._db.cursor()
+        return self._local.cursor
+
+    def query(self, sql, params=()):
+        return self._cursor().execute(sql, list(params)).df()
+
+    def segments(self, loans):
+        """Debtor count, credit and NPL per farmer segment; same frame as aggregates.segment_frame.
+
+        `loans` is an in-memory frame already filtered, e.g. cube.loan_frame of the
+        book as of a watermark. Loans are first summed per borrower, so each
+        (overlapping) segment is a filtered sum over borrowers rather than a
+        COUNT(DISTINCT) over loans.
+        """
+        cursor = self._cursor()
+        cursor.register('pinned_loans', loans)
+        try:
+            return self._segments('pinned_loans')
+        finally:
+            cursor.unregister('pinned_loans')
+
+    def _segments(self, source):
+        columns = []
+        for i, segment in enumerate(SEGMENTS):
+            condition = SEGMENT_CONDITIONS[segment]
+            columns += [
+                f"COUNT(*) FILTER (WHERE {condition}) AS jumlah_{i}",
+                f"COALESCE(SUM(d.disbursed) FILTER (WHERE {condition}), 0) AS kredit_{i}",
+                f"COALESCE(SUM(d.live) FILTER (WHERE {condition}), 0) AS live_{i}",
+                f"COALESCE(SUM(d.npl) FILTER (WHERE {condition}), 0) AS npl_{i}",
+            ]
+        row = self.query(f"""
+            WITH debtors AS (
+                SELECT l.borrower_id,
+                       SUM(l.disbursed_amount) AS disbursed,
+                       SUM(l.outstanding_balance) FILTER (WHERE l.status <> 'Closed') AS live,
+                       SUM(l.outstanding_balance) FILTER (WHERE l.status <> 'Closed'
+                                                          AND l.collectibility_category >= 3) AS npl
+                FROM {source} l
+                GROUP BY l.borrower_id
+            )
+            SELECT {', '.join(columns)}
+            FROM debtors d JOIN borrowers b ON b.borrower_id = d.borrower_id
+        """).iloc[0]
+        return pd.DataFrame([{
+            'Segmen': segment,
+            'Jumlah': int(row[f'jumlah_{i}']),
+            'Total_Kredit': float(row[f'kredit_{i}']),
+            'NPL_Rate': 100 * row[f'npl_{i}'] / row[f'live_{i}'] if row[f'live_{i}'] else 0.0,
+        } for i, segment in enumerate(SEGMENTS)])
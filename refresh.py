@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+import aging
+import alert_rules
+import cube
+import ews
+import harvest
+import productivity_bands
+import snapshots
+
+RefreshResult = namedtuple('RefreshResult', ['loans', 'payments', 'harvests', 'months', 'version', 'watermark'])
+# The cube's loan book (axes and per-loan state) together with the watermark it is merged up to
+Pinned = namedtuple('Pinned', ['watermark', 'axes', 'state'])
+
+# Minimum seconds between two refreshes that hit the store (override with KUR_REFRESH_INTERVAL)
+MIN_INTERVAL = float(os.getenv('KUR_REFRESH_INTERVAL', '30'))
+
+# Columns every merge target needs, plus the change-tracking timestamps
+LOAN_COLUMNS = list(dict.fromkeys(cube.LOAN_COLUMNS + aging.LOAN_COLUMNS + ews.LOAN_COLUMNS + harvest.LOAN_COLUMNS
+                                  + ['updated_at']))
+PAYMENT_COLUMNS = list(dict.fromkeys(cube.PAYMENT_COLUMNS + aging.PAYMENT_COLUMNS + harvest.PAYMENT_COLUMNS
+                                     + ['created_at']))
+PRODUCTIVITY_COLUMNS = list(dict.fromkeys(ews.PRODUCTIVITY_COLUMNS + harvest.PRODUCTIVITY_COLUMNS
+                                          + productivity_bands.PRODUCTIVITY_COLUMNS + ['created_at']))
+
+
+class IncrementalRefresher:
+    """Merges loans, payments and harvests newer than the watermark into the live aggregates.
+
+    `targets` maps a name to anything with a `merge(loans, payments, borrowers,
+    productivity)` method; the 'cube' target's version is the data version
+    reported to callers. Harvests alone reach every target but the cube, which
+    holds no harvest data.
+    Functions in `listeners` are called with the result of every refresh that
+    merged new rows, after the watermark has moved.
+    The watermark belongs to the in-memory aggregates it describes, so it is kept
+    next to them rather than in the (shared) store. Concurrent refresh clicks
+    coalesce: a caller that finds a refresh in flight waits for it and shares
+    its result. `pinned` is replaced in one assignment after every merge, so a
+    reader gets a loan book and the watermark naming it from the same merge.
+    With a `source` (a db_loader.DatabaseSync), every refresh first syncs the
+    database's changed rows into the store.
+    """
+
+    def __init__(self, store, targets, watermark, min_interval=MIN_INTERVAL, source=None):
+        self.store = store
+        self.source = source
+        self.targets = targets
+        self.cube = targets['cube']
+        self.watermark = watermark
+        self.min_interval = min_interval
+        self.last_result = RefreshResult(0, 0, 0, [], self.cube.version, watermark)
+        self.pinned = Pinned(watermark, self.cube.book.axes, self.cube.book.state)
+        self.listeners = []
+        self._last_run = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        if not self._lock.acquire(blocking=False):
+            with self._lock:
+                return self.last_result
+        try:
+            if time.monotonic() - self._last_run < self.min_interval:
+                return self.last_result
+            self.last_result = self._refresh()
+            self._last_run = time.monotonic()
+            if self.last_result.loans or self.last_result.payments or self.last_result.harvests:
+                for listener in self.listeners:
+                    listener(self.last_result)
+            return self.last_result
+        finally:
+            self._lock.release()
+
+    def _refresh(self):
+        if self.source is not None:
+            self.source.sync()
+        since = self.watermark
+        loans = self.store.load('loans', columns=LOAN_COLUMNS, filter=ds.field('updated_at') > since)
+        payments = self.store.load('payments', columns=PAYMENT_COLUMNS, filter=ds.field('created_at') > since)
+        productivity = self.store.load('productivity', columns=PRODUCTIVITY_COLUMNS,
+                                       filter=ds.field('created_at') > since)
+        borrower_ids = loans['borrower_id'].unique().tolist()
+        borrowers = self.store.load('borrowers', columns=['borrower_id', 'land_area_ha'],
+                                    filter=ds.field('borrower_id').isin(borrower_ids))
+        months = []
+        if len(loans) or len(payments):
+            months = self.cube.merge(loans, payments, borrowers)
+        if len(loans) or len(payments) or len(productivity):
+            for name, target in self.targets.items():
+                if name != 'cube':
+                    target.merge(loans, payments, borrowers, productivity)
+        self.watermark = max([since, loans['updated_at'].max(), payments['created_at'].max(),
+                              productivity['created_at'].max()],
+                             key=lambda ts: ts if pd.notna(ts) else since)
+        book = self.cube.book
+        self.pinned = Pinned(self.watermark, book.axes, book.state)
+        return RefreshResult(len(loans), len(payments), len(productivity), list(months), self.cube.version,
+                             self.watermark)
+
+
+def build_refresher(store, min_interval=MIN_INTERVAL, source=None):
+    """Build the aggregates from the whole store and a refresher watermarked at its newest row."""
+    loans = store.load('loans', columns=LOAN_COLUMNS)
+    payments = store.load('payments', columns=PAYMENT_COLUMNS)
+    borrowers = store.load('borrowers', columns=['borrower_id', 'land_area_ha'])
+    productivity = store.load('productivity', columns=PRODUCTIVITY_COLUMNS)
+    targets = {
+        'cube': cube.build_cube(loans, payments, borrowers),
+        'aging': aging.AgingEngine(loans, payments),
+        'harvest': harvest.HarvestCalendar(loans, payments, productivity),
+    }
+    # After 'aging': the EWS reads the aging engine's merged state
+    targets['ews'] = ews.EarlyWarningEngine(loans, productivity, targets['aging'], store,
+                                           rules=alert_rules.RuleBook(ews.rule_vocabulary(targets['aging'])))
+    # After 'ews': bands join harvests to the EWS engine's loans and borrowers
+    targets['bands'] = productivity_bands.ProductivityBands(targets['ews'], productivity)
+    # Last: month-end snapshots read the cube and the EWS (and through it the aging engine)
+    targets['snapshots'] = snapshots.PeriodSnapshots(store, targets['cube'], targets['ews'])
+    watermark = max(loans['updated_at'].max(), payments['created_at'].max(), productivity['created_at'].max())
+    return IncrementalRefresher(store, targets, watermark, min_interval=min_interval, source=source)
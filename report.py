@@ -0,0 +1,153 @@
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+# Where rendered PDFs are kept (override with KUR_REPORT_DIR)
+REPORT_DIR = os.getenv('KUR_REPORT_DIR', os.path.join(tempfile.gettempdir(), 'kur_reports'))
+# Worker processes rendering PDFs (override with KUR_REPORT_WORKERS)
+REPORT_WORKERS = int(os.getenv('KUR_REPORT_WORKERS', '2'))
+# Finished reports kept before the least recently requested is dropped
+REPORT_CACHE_SIZE = 32
+
+# Card fill and edge colours, keyed like the dashboard's metric-card CSS classes
+CARD_COLORS = {
+    'alert-good': ('#e8f5e9', '#4caf50'),
+    'alert-medium': ('#fff3e0', '#ff9800'),
+    'alert-high': ('#ffebee', '#f44336'),
+}
+
+
+def render_summary(path, context):
+    """Render the board-pack PDF: KPIs and risk cards, then the main charts.
+
+    Runs in a worker process. Charts are drawn with matplotlib's Agg backend into
+    PdfPages, so it needs no browser or network. `context` holds the values and
+    small frames read from the aggregates in the session that asked for the report.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.dates as mdates
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    portfolio = context['portfolio']
+    regional = context['regional'].sort_values('Total_Kredit')
+    aging = context['aging']
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with PdfPages(tmp_path, metadata={'Title': context['title']}) as pdf:
+        # Page 1: header, KPI table and risk cards
+        fig = plt.figure(figsize=(11.69, 8.27))
+        fig.text(0.05, 0.93, context['title'], fontsize=18, weight='bold', color='#1f77b4')
+        fig.text(0.05, 0.89, f"Periode {context['period']}  |  {context['scope']}", fontsize=11, color='#444')
+        ax = fig.add_axes([0.05, 0.35, 0.9, 0.5])
+        ax.axis('off')
+        table = ax.table(cellText=context['kpi'], colLabels=['Indikator', 'Nilai'], loc='upper center',
+                         colWidths=[0.6, 0.4], cellLoc='left')
+        table.auto_set_font_size(False)
+        table.set_fontsize(11)
+        table.scale(1, 1.6)
+        for (row, _), cell in table.get_celld().items():
+            if row == 0:
+                cell.set_facecolor('#1f77b4')
+                cell.set_text_props(color='white', weight='bold')
+        for i, (level, title, share, outstanding) in enumerate(context['risk']):
+            face, edge = CARD_COLORS[level]
+            card = fig.add_axes([0.05 + i * 0.228, 0.08, 0.21, 0.2])
+            card.set_xticks([])
+            card.set_yticks([])
+            card.set_facecolor(face)
+            for spine in card.spines.values():
+                spine.set_color(edge)
+                spine.set_linewidth(2)
+            card.text(0.07, 0.75, title, fontsize=10, weight='bold', transform=card.transAxes)
+            card.text(0.07, 0.4, f"{share:.1f}%", fontsize=20, weight='bold', transform=card.transAxes)
+            card.text(0.07, 0.15, f"Rp {outstanding / 1e9:,.0f} M", fontsize=10, transform=card.transAxes)
+        pdf.savefig(fig)
+        plt.close(fig)
+
+        # Page 2: the main charts
+        fig, axes = plt.subplots(2, 2, figsize=(11.69, 8.27))
+        ax = axes[0, 0]
+        ax.stackplot(portfolio['Bulan'], portfolio['KUR_Outstanding'] / 1e9,
+                     portfolio['KUR_Khusus_Outstanding'] / 1e9, labels=['KUR', 'KUR Khusus'],
+                     colors=['#1f77b4', '#ff7f0e'], alpha=0.8)
+        ax.set_title('Trend Outstanding Kredit')
+        ax.set_ylabel('Miliar Rp')
+        ax.legend(loc='upper left', fontsize=8)
+
+        ax = axes[0, 1]
+        ax.plot(portfolio['Bulan'], portfolio['NPL_Rate'], color='#d62728', marker='o', markersize=3)
+        ax.axhline(5, color='orange', linestyle='--', linewidth=1, label='Batas NPL 5%')
+        ax.set_title('Trend NPL Rate')
+        ax.set_ylabel('%')
+        ax.legend(loc='upper left', fontsize=8)
+
+        ax = axes[1, 0]
+        ax.barh(regional['Region'], regional['Total_Kredit'] / 1e9, color='#1f77b4')
+        ax.set_title('Total Kredit per Region')
+        ax.set_xlabel('Miliar Rp')
+
+        ax = axes[1, 1]
+        positions = range(len(aging))
+        ax.bar([p - 0.2 for p in positions], aging['KUR'] / 1e9, width=0.4, label='KUR', color='#1f77b4')
+        ax.bar([p + 0.2 for p in positions], aging['KUR_Khusus'] / 1e9, width=0.4, label='KUR Khusus',
+               color='#ff7f0e')
+        ax.set_xticks(list(positions), aging['Kategori'], rotation=20, fontsize=8)
+        ax.set_title('Aging Analysis')
+        ax.set_ylabel('Miliar Rp')
+        ax.legend(fontsize=8)
+
+        for ax in axes[0]:
+            ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(ax.xaxis.get_major_locator()))
+        for ax in axes.flat:
+            ax.tick_params(labelsize=8)
+            ax.grid(alpha=0.3)
+        fig.tight_layout()
+        pdf.savefig(fig)
+        plt.close(fig)
+    os.replace(tmp_path, path)
+    return path
+
+
+class ReportQueue:
+    """Process pool rendering PDF reports, with finished reports cached by key.
+
+    The key is (period, filters, data version), so the same board pack asked for
+    again, by any session, is the same future: served at once when finished, or
+    joined while it renders. A merge that changes the slice changes its version
+    and thus the key. Only the last REPORT_CACHE_SIZE reports are kept.
+    """
+
+    def __init__(self, workers=REPORT_WORKERS, max_reports=REPORT_CACHE_SIZE):
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        self.max_reports = max_reports
+        self._pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        self._reports = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The report's future, or None if it was never requested or has been dropped."""
+        with self._lock:
+            return self._reports.get(key)
+
+    def submit(self, key, build_context):
+        """Queue a report unless it is cached or rendering; build_context() is only called on a miss."""
+        with self._lock:
+            future = self._reports.get(key)
+            if future is not None and not (future.done() and future.exception() is not None):
+                self._reports.move_to_end(key)
+                return future
+            path = os.path.join(REPORT_DIR, hashlib.sha1(repr(key).encode()).hexdigest()[:16] + '.pdf')
+            future = self._pool.submit(render_summary, path, build_context())
+            self._reports[key] = future
+            self._reports.move_to_end(key)
+            for old_key in list(self._reports)[:-self.max_reports]:
+                if self._reports[old_key].done():
+                    old = self._reports.pop(old_key)
+                    if old.exception() is None and os.path.exists(old.result()):
+                        os.remove(old.result())
+            return future
@@ -0,0 +1,119 @@
+import argparse
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Low-cardinality labels, held as categoricals. A column name has one dictionary for every table and load;
+# it only grows, so a frame loaded before a new label arrived holds an older dtype: combine frames with concat()
+CATEGORICAL = ['region', 'bank', 'loan_type', 'status', 'payment_method', 'farmer_group', 'land_ownership',
+               'rule', 'priority']
+# Ids, Rupiah amounts (whole Rupiah) and small counts; columns not listed keep the type they are stored with
+FIXED_WIDTH = {
+    'loan_id': pa.int32(),
+    'borrower_id': pa.int32(),
+    'disbursed_amount': pa.int64(),
+    'outstanding_balance': pa.int64(),
+    'payment_amount': pa.int64(),
+    'principal_amount': pa.int64(),
+    'interest_amount': pa.int64(),
+    'total_revenue': pa.int64(),
+    'outstanding': pa.int64(),
+    'collectibility_category': pa.int8(),
+    'experience_years': pa.int8(),
+    'late_days': pa.int16(),
+    'days_past_due': pa.int16(),
+}
+# payment_id and productivity_id stay int64: they are loan_id/borrower_id * 100 + a sequence number
+
+_dictionaries = {}
+_lock = threading.Lock()
+
+
+def dictionary(column, values=()):
+    """The column's shared categorical dtype, grown (kept sorted) to cover `values`."""
+    with _lock:
+        dtype = _dictionaries.get(column)
+        known = dtype.categories if dtype is not None else pd.Index([], dtype=object)
+        new = pd.Index(values).difference(known)
+        if dtype is None or len(new):
+            dtype = pd.CategoricalDtype(known.append(new).sort_values())
+            _dictionaries[column] = dtype
+        return dtype
+
+
+def _categorical(array, column):
+    if pa.types.is_dictionary(array.type):
+        array = array.cast(array.type.value_type)
+    dtype = dictionary(column, pc.unique(array).drop_null().to_pylist())
+    # Codes straight from the Arrow strings: no Python string object per row
+    codes = pc.index_in(array, value_set=pa.array(dtype.categories.tolist(), type=array.type))
+    return pd.Categorical.from_codes(pc.fill_null(codes, -1).to_numpy(), dtype=dtype)
+
+
+def _fixed_width(array, target):
+    if pa.types.is_floating(array.type) and pa.types.is_integer(target):
+        array = pc.round(array)  # amounts are kept in whole Rupiah
+    # A safe cast: an id or count that does not fit raises instead of wrapping around
+    return array.cast(target)
+
+
+def to_frame(table):
+    """Frame of an Arrow table in the canonical schema."""
+    columns = {}
+    for name in table.column_names:
+        array = table.column(name)
+        if name in CATEGORICAL and (pa.types.is_string(array.type) or pa.types.is_large_string(array.type)
+                                    or pa.types.is_dictionary(array.type)):
+            columns[name] = _categorical(array, name)
+        elif name in FIXED_WIDTH and array.type != FIXED_WIDTH[name] and array.null_count == 0:
+            columns[name] = _fixed_width(array, FIXED_WIDTH[name])
+        else:
+            columns[name] = array
+    rest = pa.table({name: array for name, array in columns.items() if isinstance(array, pa.ChunkedArray)})
+    frame = (rest.to_pandas(split_blocks=True, self_destruct=True) if rest.num_columns
+             else pd.DataFrame(index=pd.RangeIndex(table.num_rows)))
+    for name, values in columns.items():
+        if not isinstance(values, pa.ChunkedArray):
+            frame[name] = values
+    return frame[table.column_names]
+
+
+def concat(frames, **kwargs):
+    """pd.concat of frames in the canonical schema, categoricals kept.
+
+    pandas falls back to object when categorical dtypes differ, as they do once a
+    refresh has grown a dictionary; each categorical column is first moved to the
+    column's current (superset) dictionary.
+    """
+    frames = [frame.astype({name: dictionary(name) for name in frame.columns
+                            if name in CATEGORICAL and isinstance(frame[name].dtype, pd.CategoricalDtype)})
+              for frame in frames]
+    return pd.concat(frames, **kwargs)
+
+
+def memory_mb(frame):
+    """Memory a frame holds, strings included, in MB."""
+    return frame.memory_usage(index=True, deep=True).sum() / 2**20
+
+
+def main():
+    from data_store import STORE_DIR, TABLES, DataStore
+
+    parser = argparse.ArgumentParser(description='Memory per table with object strings vs in the canonical schema.')
+    parser.add_argument('--store', default=STORE_DIR, help='store directory')
+    args = parser.parse_args()
+
+    store = DataStore(args.store)
+    for name in TABLES:
+        table = store.scan(name)
+        table = table.drop_columns([c for c in ('month',) if c in table.column_names])
+        plain = table.to_pandas()
+        plain = plain.astype({c: object for c in plain.select_dtypes(include=['object', 'string']).columns})
+        print(f"{name:>12}: {table.num_rows:>12,} baris, {memory_mb(plain):10,.1f} MB -> "
+              f"{memory_mb(to_frame(table)):9,.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
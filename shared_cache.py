@@ -0,0 +1,128 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+import pyarrow as pa
+
+# Cache files shared by every dashboard process on the host (override with KUR_SHARED_CACHE_DIR)
+SHARED_CACHE_DIR = os.getenv('KUR_SHARED_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'kur_shared_cache'))
+# Disk cap for all cached results together, and how long one result stays valid
+SHARED_CACHE_MB = float(os.getenv('KUR_SHARED_CACHE_MB', '512'))
+SHARED_CACHE_TTL = int(os.getenv('KUR_SHARED_CACHE_TTL', '3600'))
+# Seconds between eviction sweeps of the directory
+SWEEP_INTERVAL = 30
+
+
+class SharedCache:
+    """Arrow IPC files keyed by (query, data version), memory-mapped on read.
+
+    One process computes a result and writes it under a temporary name, then
+    renames it into place, so readers see a whole file or none. Every other
+    process on the host maps the same file: its buffers live once in the page
+    cache, not once per replica, and numeric columns reach numpy without a copy.
+    A file's mtime is when it was written (for the TTL), its atime when it was last
+    read (for size-bounded eviction, least recently read first).
+    """
+
+    def __init__(self, root=SHARED_CACHE_DIR, max_mb=SHARED_CACHE_MB, ttl=SHARED_CACHE_TTL):
+        self.root = root
+        self.max_bytes = int(max_mb * 2**20)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        """Stable file key for a query and its data version; parts must have a stable repr."""
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.arrow")
+
+    def get(self, key):
+        """The cached table, memory-mapped, or None if missing or expired."""
+        path = self._path(key)
+        try:
+            written = os.stat(path).st_mtime
+            if time.time() - written > self.ttl:
+                os.remove(path)
+                return None
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+            os.utime(path, (time.time(), written))
+        except FileNotFoundError:
+            return None
+        return table
+
+    def put(self, key, table):
+        tmp_path = os.path.join(self.root, f".{key}.{uuid.uuid4().hex[:8]}.tmp")
+        with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, self._path(key))
+        self.sweep()
+        cached = self.get(key)
+        return table if cached is None else cached
+
+    def table(self, key, compute, current=None):
+        """The cached table for key, or compute() -> pa.Table stored for every process.
+
+        `current`, if given, is asked after compute(): False means the data the key
+        names has moved on meanwhile, and the result is returned but not stored.
+        """
+        table = self.get(key)
+        with self._lock:
+            if table is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if table is not None:
+            return table
+        table = compute()
+        return table if current is not None and not current() else self.put(key, table)
+
+    def frame(self, key, compute, current=None):
+        """Like table(), for a function returning a DataFrame."""
+        table = self.table(key, lambda: pa.Table.from_pandas(compute(), preserve_index=False), current)
+        return table.to_pandas(split_blocks=True)
+
+    def sweep(self, force=False):
+        """Delete expired files, then the least recently read until the cache fits its cap."""
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_sweep < SWEEP_INTERVAL:
+                return
+            self._last_sweep = now
+        entries = []
+        for entry in os.scandir(self.root):
+            try:
+                stat = entry.stat()
+                if now - stat.st_mtime > self.ttl:  # expired, or a .tmp left by a writer that died
+                    os.remove(entry.path)
+                elif entry.name.endswith('.arrow'):
+                    entries.append((stat.st_atime, stat.st_size, entry.path))
+            except FileNotFoundError:
+                continue  # removed by another process's sweep
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    @property
+    def bytes(self):
+        total = 0
+        for entry in os.scandir(self.root):
+            try:
+                total += entry.stat().st_size if entry.name.endswith('.arrow') else 0
+            except FileNotFoundError:
+                pass
+        return total
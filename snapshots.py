@@ -0,0 +1,320 @@
+import os
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from aggregates import AGING_LABELS, SEGMENTS, TYPE_COLUMNS
+from aging import COLLECTIBILITY_LABELS, _days
+from cube import DIMENSIONS, M, N_BUCKETS, _ratio
+from ews import Rule
+
+# Closed months snapshotted at startup, newest first, when missing (override with KUR_SNAPSHOT_MONTHS)
+SNAPSHOT_MONTHS = int(os.getenv('KUR_SNAPSHOT_MONTHS', '24'))
+
+# A snapshot's cells: the cube's dimensions apart from the month
+CELL_DIMENSIONS = DIMENSIONS[1:]
+# Additive measures per cell: the month's cube measures, then the book's state at the month end
+BOOK_MEASURES = (
+    ['disbursed', 'outstanding']
+    + [f'principal_{b}' for b in range(N_BUCKETS)]
+    + [f'paid_{b}' for b in range(N_BUCKETS)]
+    + [f'aging_{b}' for b in range(N_BUCKETS)]
+    + [f'outstanding_kol{c}' for c in range(1, 6)]
+    + [f'loans_kol{c}' for c in range(1, 6)]
+    + ['debtors']
+)
+B = {name: i for i, name in enumerate(BOOK_MEASURES)}
+# Per cell and (farmer group, experienced) pair; the four segments overlap, these pairs do not
+SEGMENT_MEASURES = ['debtors', 'disbursed', 'live', 'npl']
+S = {name: i for i, name in enumerate(SEGMENT_MEASURES)}
+# Layout of the snapshot files; a file of another layout is rebuilt
+LAYOUT = 2
+
+
+def period_of(value):
+    return np.datetime64(pd.Timestamp(value).date(), 'M')
+
+
+def _debtors(cells, borrowers, order, keep, n_cells):
+    """Borrowers per cell among the kept loans, each counted once, in the cell of their last loan in `order`.
+
+    `order` sorts the loans by borrower, then by recency; like the cube's debtor
+    attribution, this keeps the count additive across cells.
+    """
+    rows = order[keep[order]]
+    if not len(rows):
+        return np.zeros(n_cells)
+    owner = borrowers[rows]
+    last = rows[np.append(owner[1:] != owner[:-1], True)]
+    return np.bincount(cells[last], minlength=n_cells).astype(float)
+
+
+class Snapshot:
+    """The dashboard aggregates of one closed month, frozen at its month end.
+
+    Measures are held per region x bank x loan_type x masa_tanam cell, so any
+    filter combination is a slice and a sum over a few dozen cells. Arrays are
+    read-only; a snapshot never changes once the month is closed. Debtors are
+    counted as of the month end: a borrower with a live loan then, once, in the
+    cell of their most recent one (the cube's attribution, applied to that day).
+    """
+
+    def __init__(self, period, axes, book, segments, alerts, rules):
+        self.period = np.datetime64(period, 'M')
+        self.axes = axes
+        self.book = book
+        self.segments = segments
+        self.alerts = alerts
+        self.rules = rules
+        for array in (book, segments, alerts):
+            array.flags.writeable = False
+
+    def _select(self, array, keep=(), until=None, region=None, bank=None, loan_type=None, masa_tanam=None):
+        """Sum over the cell dimensions not in `keep`, after slicing by the filters (`until` is the period)."""
+        values = dict(region=region, bank=bank, loan_type=loan_type, masa_tanam=masa_tanam)
+        for axis, dim in enumerate(CELL_DIMENSIONS):
+            if values[dim] is not None:
+                array = array[(slice(None),) * axis + (np.flatnonzero(self.axes[dim] == values[dim]),)]
+        return array.sum(axis=tuple(axis for axis, dim in enumerate(CELL_DIMENSIONS) if dim not in keep))
+
+    def labels(self, dim, value=None):
+        return self.axes[dim] if value is None else self.axes[dim][self.axes[dim] == value]
+
+    def kpi(self, **filters):
+        """Headline figures of the month: outstanding, disbursed, NPL, collection and active debtors."""
+        cells = self._select(self.book, **filters)
+        principal = cells[B['principal_0']:B['principal_0'] + N_BUCKETS]
+        paid = cells[B['paid_0']:B['paid_0'] + N_BUCKETS]
+        return {
+            'outstanding': cells[B['outstanding']],
+            'disbursed': cells[B['disbursed']],
+            'npl_rate': _ratio(principal[-1:], principal.sum(keepdims=True))[0],
+            'collection_rate': _ratio(paid[:2].sum(keepdims=True), paid.sum(keepdims=True))[0],
+            'debtors': int(cells[B['debtors']]),
+        }
+
+    def aging(self, **filters):
+        """Outstanding per aging bucket and loan type, like AgingEngine.aging."""
+        cells = self._select(self.book, ('loan_type',), **filters)
+        frame = pd.DataFrame({'Kategori': AGING_LABELS})
+        types = self.labels('loan_type', filters.get('loan_type'))
+        for loan_type, col in TYPE_COLUMNS.items():
+            hits = np.flatnonzero(types == loan_type)
+            frame[col] = cells[hits, B['aging_0']:B['aging_0'] + N_BUCKETS].sum(axis=0)
+        return frame
+
+    def collectibility(self, **filters):
+        """Outstanding, loan count and share of the book per collectibility category, like AgingEngine's."""
+        cells = self._select(self.book, **filters)
+        outstanding = cells[B['outstanding_kol1']:B['outstanding_kol1'] + 5]
+        total = outstanding.sum()
+        return pd.DataFrame({
+            'Kolektibilitas': np.arange(1, 6),
+            'Kategori': COLLECTIBILITY_LABELS,
+            'Outstanding': outstanding,
+            'Jumlah_Kredit': cells[B['loans_kol1']:B['loans_kol1'] + 5].astype(np.int64),
+            'Persentase': 100 * outstanding / total if total else np.zeros(5),
+        })
+
+    def segment_frame(self, **filters):
+        """Debtors, credit and NPL per farmer segment as of the month end, like aggregates.segment_frame.
+
+        A borrower counts once, in the cell of their most recent loan disbursed by then.
+        """
+        pairs = self._select(self.segments, **filters)  # (farmer group, experienced, measure)
+        by_segment = {
+            'Petani Individu': pairs[0].sum(axis=0),
+            'Kelompok Tani': pairs[1].sum(axis=0),
+            'Pemula (<2 tahun)': pairs[:, 0].sum(axis=0),
+            'Berpengalaman (>2 tahun)': pairs[:, 1].sum(axis=0),
+        }
+        return pd.DataFrame([{
+            'Segmen': segment,
+            'Jumlah': int(by_segment[segment][S['debtors']]),
+            'Total_Kredit': by_segment[segment][S['disbursed']],
+            'NPL_Rate': (100 * by_segment[segment][S['npl']] / by_segment[segment][S['live']]
+                         if by_segment[segment][S['live']] else 0.0),
+        } for segment in SEGMENTS])
+
+    def alert_summary(self, **filters):
+        """Debtors and outstanding per rule, like EarlyWarningEngine.summary."""
+        cells = self._select(self.alerts, **filters)
+        return pd.DataFrame([{
+            'Prioritas': rule.priority,
+            'Jenis Risiko': rule.label,
+            'Jumlah Debitur': int(debtors),
+            'Potensi Dampak': outstanding,
+            'Tindakan': rule.action,
+        } for rule, (debtors, outstanding) in zip(self.rules, cells)],
+            index=pd.Index([rule.name for rule in self.rules], name='rule'))
+
+    def save(self, path):
+        arrays = {f'axis_{dim}': np.asarray(labels, dtype=str) for dim, labels in self.axes.items()}
+        arrays.update({f'rule_{field}': np.asarray([getattr(rule, field) for rule in self.rules], dtype=str)
+                       for field in Rule._fields})
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, layout=np.asarray(LAYOUT), period=np.asarray(str(self.period)), book=self.book,
+                     segments=self.segments, alerts=self.alerts, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """The snapshot in a file, or None if the file has another layout."""
+        with np.load(path) as f:
+            if 'layout' not in f.files or int(f['layout']) != LAYOUT:
+                return None
+            axes = {dim: f[f'axis_{dim}'] for dim in CELL_DIMENSIONS}
+            rules = [Rule(*fields) for fields in zip(*(f[f'rule_{field}'].tolist() for field in Rule._fields))]
+            return cls(str(f['period']), axes, f['book'], f['segments'], f['alerts'], rules)
+
+
+class PeriodSnapshots:
+    """Month-end snapshots of the dashboard aggregates, one per closed month.
+
+    A month is closed once the data reaches the next month. Its snapshot takes the
+    month's cube cells, the aging state at the month end, the debtors and farmer
+    segments then, and the early-warning rules then in force, and is written next
+    to the store; it is never recomputed (a file of an older layout is rebuilt).
+    As a refresher target, every merge closes the months the new data has moved
+    past, so picking a past period, or the previous month for a delta, is a
+    dictionary lookup.
+    """
+
+    def __init__(self, store, cube, ews_engine, months=SNAPSHOT_MONTHS):
+        self.store = store
+        self.cube = cube
+        self.ews = ews_engine
+        self.aging = ews_engine.aging
+        self.months = months
+        self.root = store.path('snapshots')
+        self._snapshots = {}
+        self._open = period_of(self.aging.last_date)
+        self._lock = threading.Lock()
+        self._building = threading.Lock()
+        if os.path.isdir(self.root):
+            for name in sorted(os.listdir(self.root)):
+                if name.endswith('.npz'):
+                    snapshot = Snapshot.load(os.path.join(self.root, name))
+                    if snapshot is not None:
+                        self._snapshots[snapshot.period] = snapshot
+
+    def get(self, until):
+        """The snapshot of the month `until` falls in, or None while that month is open.
+
+        A closed month the backfill has not reached yet is built on the spot, so a
+        month is read from the same source whether or not the backfill has finished.
+        """
+        if until is None:
+            return None
+        period = period_of(until)
+        snapshot = self._snapshots.get(period)
+        if snapshot is None and period in self.closed():
+            snapshot = self.close(period)
+        return snapshot
+
+    @property
+    def periods(self):
+        return sorted(self._snapshots)
+
+    def closed(self):
+        """Months with data that have ended, newest last: the snapshot window ending before the open month."""
+        months = self.cube.axes['month']
+        open_month = period_of(self.aging.last_date)
+        return list(months[months < open_month][-self.months:]) if self.months else []
+
+    def merge(self, loans=None, payments=None, borrowers=None, productivity=None):
+        """Close the months new data has moved past; older missing months are left to start()."""
+        for period in self.closed():
+            if period >= self._open:
+                self.close(period)
+        self._open = period_of(self.aging.last_date)
+
+    def close(self, period):
+        """Build, store and keep the snapshot of one month."""
+        period = np.datetime64(period, 'M')
+        # One build at a time: a page asking for a month the backfill is building waits for it
+        with self._building:
+            with self._lock:
+                if period in self._snapshots:
+                    return self._snapshots[period]
+            snapshot = self._build(period)
+            os.makedirs(self.root, exist_ok=True)
+            snapshot.save(os.path.join(self.root, f"{period}.npz"))
+            with self._lock:
+                self._snapshots[period] = snapshot
+                return snapshot
+
+    def _build(self, period):
+        engine = self.ews
+        # One merge's cube: its axes and cells are read from the same CubeState
+        cube = self.cube.book
+        axes = {dim: np.asarray(cube.axes[dim]).astype(str) for dim in CELL_DIMENSIONS}
+        shape = tuple(len(axes[dim]) for dim in CELL_DIMENSIONS)
+        n_cells = int(np.prod(shape))
+
+        # The month's own cube cells, and the balance built up to its end
+        data = cube.data.reshape(len(cube.axes['month']), n_cells, -1)
+        book = np.zeros((n_cells, len(BOOK_MEASURES)))
+        m = int(np.searchsorted(cube.axes['month'], period))
+        if m < len(cube.axes['month']) and cube.axes['month'][m] == period:
+            book[:, B['disbursed']] = data[m, :, M['disbursed']]
+            book[:, B['outstanding']] = (data[:m + 1, :, M['disbursed']] - data[:m + 1, :, M['repaid']]).sum(axis=0)
+            for name in ('principal', 'paid'):
+                book[:, B[f'{name}_0']:B[f'{name}_0'] + N_BUCKETS] = data[m, :, M[f'{name}_0']:M[f'{name}_0'] + N_BUCKETS]
+
+        # Every loan as of the last day of the month, in the EWS engine's loan order; the loan
+        # dimensions come with the aging state, from the book it was evaluated on
+        day = (period + 1).astype('datetime64[D]') - 1
+        state, position, rules, masks = engine.hits(day)
+        cells = np.ravel_multi_index(tuple(
+            pd.Index(axes[dim]).get_indexer(state['labels'][dim].astype(str))[state['codes'][dim][position]]
+            for dim in CELL_DIMENSIONS), shape)
+        outstanding = state['outstanding'][position]
+        live = state['live'][position]
+        collectibility = state['collectibility'][position]
+        for b in range(N_BUCKETS):
+            book[:, B[f'aging_{b}']] = np.bincount(cells, weights=np.where(state['bucket'][position] == b,
+                                                                         outstanding, 0.0), minlength=n_cells)
+        for c in range(1, 6):
+            kol = live & (collectibility == c)
+            book[:, B[f'outstanding_kol{c}']] = np.bincount(cells[kol], weights=outstanding[kol], minlength=n_cells)
+            book[:, B[f'loans_kol{c}']] = np.bincount(cells[kol], minlength=n_cells)
+        # Loans by borrower, then by disbursement: a borrower's most recent loan comes last
+        disbursed_on = state['disbursed_on'][position]
+        order = np.lexsort((engine.loan_ids, disbursed_on, engine.borrower_codes))
+        book[:, B['debtors']] = _debtors(cells, engine.borrower_codes, order, live, n_cells)
+
+        # Segments: each loan also falls in its borrower's (farmer group, experienced) pair
+        borrowers = self.store.load('borrowers', columns=['borrower_id', 'farmer_group', 'experience_years'])
+        borrowers = borrowers.drop_duplicates('borrower_id').set_index('borrower_id').reindex(engine.borrower_ids)
+        pairs = (cells * 4 + borrowers['farmer_group'].notna().to_numpy() * 2
+                 + (borrowers['experience_years'] >= 2).to_numpy())
+        disbursed = disbursed_on <= _days(day)[()]
+        npl = live & (collectibility >= 3)
+        segments = np.stack([
+            _debtors(pairs, engine.borrower_codes, order, disbursed, n_cells * 4),
+            np.bincount(pairs[disbursed], weights=state['disbursed'][position][disbursed], minlength=n_cells * 4),
+            np.bincount(pairs[live], weights=outstanding[live], minlength=n_cells * 4),
+            np.bincount(pairs[npl], weights=outstanding[npl], minlength=n_cells * 4),
+        ], axis=-1)
+
+        alerts = np.stack([np.stack([
+            _debtors(cells, engine.borrower_codes, order, masks[rule.name], n_cells),
+            np.bincount(cells[masks[rule.name]], weights=outstanding[masks[rule.name]], minlength=n_cells),
+        ], axis=-1) for rule in rules], axis=1) if rules else np.zeros((n_cells, 0, 2))
+
+        return Snapshot(period, axes, book.reshape(shape + (len(BOOK_MEASURES),)),
+                        segments.reshape(shape + (2, 2, len(SEGMENT_MEASURES))),
+                        alerts.reshape(shape + (len(rules), 2)), rules)
+
+    def start(self):
+        """Build the missing snapshots of the window on a daemon thread, newest first."""
+        def backfill():
+            for period in reversed(self.closed()):
+                self.close(period)
+
+        threading.Thread(target=backfill, name='kur-snapshots', daemon=True).start()
+        return self
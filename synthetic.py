@@ -0,0 +1,230 @@
+import argparse
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Master data used by the generator (mirrors config.py in SETUP_GUIDE.md)
+REGIONS = ['Jawa Timur', 'Jawa Tengah', 'Lampung', 'Sumatera Selatan', 'Sulawesi Selatan']
+REGION_WEIGHTS = [0.34, 0.22, 0.18, 0.14, 0.12]
+BANKS = ['BRI', 'BNI', 'Mandiri', 'BTN']
+BANK_WEIGHTS = [0.45, 0.25, 0.20, 0.10]
+LOAN_TYPES = ['KUR', 'KUR Khusus']
+INTEREST_RATES = {'KUR': 6.0, 'KUR Khusus': 3.0}
+
+
+def _month_diff(later, earlier):
+    return (later.astype('datetime64[M]') - earlier.astype('datetime64[M]')).astype(np.int64)
+
+
+def _labels(prefix, numbers, width):
+    return np.char.add(prefix, np.char.zfill(numbers.astype(str), width))
+
+
+def generate_loan_book(n_loans=20000, start='2024-01-01', end='2025-11-30', seed=42,
+                       first_loan_id=1, first_borrower_id=1):
+    """Generate loan-level loans, payments, borrowers and productivity tables.
+
+    A call produces a self-contained slice of the book: its borrowers only hold its
+    loans, and ids start at the given offsets. Payment and productivity ids are
+    derived from the loan/borrower id, so slices generated independently never clash.
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end)
+
+    # Borrowers: roughly 1.25 loans per farmer
+    n_borrowers = max(1, int(n_loans * 0.8))
+    borrower_id = np.arange(first_borrower_id, first_borrower_id + n_borrowers, dtype=np.int64)
+    borrower_region = rng.choice(REGIONS, n_borrowers, p=REGION_WEIGHTS)
+    in_group = rng.random(n_borrowers) < 0.36
+    group_no = (first_borrower_id + rng.integers(0, n_borrowers, n_borrowers)) // 25
+    land_area = np.round(rng.gamma(4.0, 0.9, n_borrowers) + 0.5, 2)
+    borrowers = pd.DataFrame({
+        'borrower_id': borrower_id,
+        'name': _labels('Petani ', borrower_id, 8),
+        'region': borrower_region,
+        'farmer_group': np.where(in_group, _labels('Kelompok Tani ', group_no, 6), None),
+        'experience_years': rng.choice([0, 1, 2, 3, 5, 8, 12, 20], n_borrowers,
+                                       p=[0.06, 0.09, 0.15, 0.15, 0.2, 0.15, 0.12, 0.08]),
+        'land_area_ha': land_area,
+        'land_ownership': rng.choice(['Own', 'Rent', 'Mixed'], n_borrowers, p=[0.55, 0.3, 0.15]),
+        'created_at': start - pd.to_timedelta(rng.integers(0, 720, n_borrowers), unit='D'),
+    })
+
+    # Loans
+    loan_id = np.arange(first_loan_id, first_loan_id + n_loans, dtype=np.int64)
+    owner = rng.integers(0, n_borrowers, n_loans)
+    span_days = (end - start).days
+    disbursement_date = np.datetime64(start.date(), 'D') + rng.integers(0, span_days, n_loans)
+    loan_type = np.where(rng.random(n_loans) < 0.62, 'KUR', 'KUR Khusus')
+    tenor = rng.choice([12, 18, 24], n_loans, p=[0.6, 0.25, 0.15])
+    maturity_date = disbursement_date + np.round(tenor * 30.4375).astype('timedelta64[D]')
+    per_ha = rng.integers(6, 13, n_loans) * 1_000_000
+    disbursed_amount = np.minimum(np.round(land_area[owner] * per_ha, -5), 500_000_000).astype(np.int64)
+    interest_rate = np.where(loan_type == 'KUR', INTEREST_RATES['KUR'], INTEREST_RATES['KUR Khusus'])
+
+    # Each loan carries a latent risk level that drives its late payments
+    risk = rng.beta(0.6, 9.0, n_loans)
+    risk[borrowers['experience_years'].to_numpy()[owner] < 2] *= 1.6
+    risk = np.clip(risk, 0, 0.95)
+
+    # Payments: one monthly installment from the month after disbursement
+    n_due = np.minimum(tenor, np.maximum(_month_diff(np.datetime64(end.date(), 'D'), disbursement_date), 0))
+    pay_loan = np.repeat(np.arange(n_loans), n_due)
+    offsets = np.arange(n_due.sum()) - np.repeat(np.cumsum(n_due) - n_due, n_due) + 1
+    due_date = disbursement_date[pay_loan] + np.round(offsets * 30.4375).astype('timedelta64[D]')
+    late = rng.random(len(pay_loan)) < risk[pay_loan]
+    # Severity escalates with the loan's risk and with the installment number
+    severity = rng.exponential(10 + 900 * risk[pay_loan] ** 1.5 * np.sqrt(offsets / 12), len(pay_loan))
+    late_days = np.where(late, np.ceil(severity), 0).astype(np.int64)
+    payment_date = due_date + late_days.astype('timedelta64[D]')
+    # A small share of risky loans stops paying altogether part-way through the tenor
+    stop_at = np.where(rng.random(n_loans) < risk * 0.6, rng.integers(2, 13, n_loans), np.iinfo(np.int64).max)
+    paid = (payment_date <= np.datetime64(end.date(), 'D')) & (offsets < stop_at[pay_loan])
+
+    pay_loan = pay_loan[paid]
+    installment = offsets[paid]
+    # Whole-Rupiah installments; the last one takes the remainder, so a loan repays its plafond exactly
+    principal = disbursed_amount[pay_loan] // tenor[pay_loan]
+    principal = np.where(installment == tenor[pay_loan],
+                         disbursed_amount[pay_loan] - principal * (tenor[pay_loan] - 1), principal)
+    interest = np.round(disbursed_amount[pay_loan] * interest_rate[pay_loan] / 1200).astype(np.int64)
+    payments = pd.DataFrame({
+        'payment_id': loan_id[pay_loan] * 100 + installment,
+        'loan_id': loan_id[pay_loan],
+        'payment_date': payment_date[paid].astype('datetime64[ns]'),
+        'payment_amount': principal + interest,
+        'principal_amount': principal,
+        'interest_amount': interest,
+        'late_days': late_days[paid],
+        'payment_method': rng.choice(['Transfer', 'Potong Hasil Panen', 'Tunai'], len(pay_loan),
+                                     p=[0.55, 0.35, 0.10]),
+    })
+    payments['created_at'] = payments['payment_date'] + pd.Timedelta(hours=18)
+
+    # Balance and collectibility follow from the payment history
+    principal_paid = np.bincount(pay_loan, weights=principal, minlength=n_loans).astype(np.int64)
+    outstanding = np.maximum(disbursed_amount - principal_paid, 0)
+    missed = n_due - np.bincount(pay_loan, minlength=n_loans)
+    last_late = np.zeros(n_loans, dtype=np.int64)
+    last_late[pay_loan] = late_days[paid]  # installments are ordered, so the last write wins
+    days_past_due = np.maximum(last_late, missed * 30)
+    collectibility = np.digitize(days_past_due, [1, 91, 121, 181]) + 1
+    collectibility[outstanding == 0] = 1
+    status = np.where(outstanding == 0, 'Closed', np.where(collectibility == 5, 'Default', 'Active'))
+
+    loans = pd.DataFrame({
+        'loan_id': loan_id,
+        'borrower_id': borrower_id[owner],
+        'loan_type': loan_type,
+        'disbursement_date': disbursement_date.astype('datetime64[ns]'),
+        'maturity_date': maturity_date.astype('datetime64[ns]'),
+        'disbursed_amount': disbursed_amount,
+        'outstanding_balance': outstanding,
+        'interest_rate': interest_rate,
+        'region': borrower_region[owner],
+        'bank': rng.choice(BANKS, n_loans, p=BANK_WEIGHTS),
+        'status': status,
+        'collectibility_category': collectibility,
+        'created_at': disbursement_date.astype('datetime64[ns]'),
+        'updated_at': end - pd.to_timedelta(rng.integers(0, 30, n_loans), unit='D'),
+    })
+
+    # Productivity: one harvest per borrower per year, mostly in the dry season
+    years = np.arange(start.year, end.year + 1)
+    prod_owner = np.tile(np.arange(n_borrowers), len(years))
+    prod_year = np.repeat(years, n_borrowers)
+    harvest_month = rng.choice(np.arange(1, 13), len(prod_owner),
+                               p=[0.04, 0.04, 0.05, 0.07, 0.1, 0.14, 0.16, 0.15, 0.11, 0.07, 0.04, 0.03])
+    harvest_date = pd.to_datetime(pd.DataFrame({'year': prod_year, 'month': harvest_month,
+                                                'day': rng.integers(1, 29, len(prod_owner))}))
+    keep = np.asarray(harvest_date <= end)
+    base_yield = rng.normal(80, 16, n_borrowers)
+    yield_ha = np.round(np.clip(base_yield[prod_owner] + rng.normal(0, 6, len(prod_owner)), 35, 140), 2)
+    price = np.round(680 + 25 * np.sin(harvest_month / 12 * 2 * np.pi) + rng.normal(0, 10, len(prod_owner)), 2)
+    area = land_area[prod_owner]
+    productivity = pd.DataFrame({
+        'productivity_id': borrower_id[prod_owner] * 100 + (prod_year - start.year),
+        'borrower_id': borrower_id[prod_owner],
+        'harvest_date': harvest_date,
+        'land_area_ha': area,
+        'harvest_amount_ton': np.round(area * yield_ha, 2),
+        'productivity_ton_per_ha': yield_ha,
+        'market_price_per_kg': price,
+        'total_revenue': np.round(area * yield_ha * 1000 * price).astype(np.int64),
+    })[keep].reset_index(drop=True)
+    productivity['created_at'] = productivity['harvest_date'] + pd.Timedelta(days=3)
+
+    return {
+        'loans': loans,
+        'payments': payments,
+        'borrowers': borrowers,
+        'productivity': productivity,
+    }
+
+
+def _write_chunk(root, chunk, n_loans, loans_per_chunk, start, end, seed):
+    from data_store import DataStore
+
+    first = chunk * loans_per_chunk
+    book = generate_loan_book(
+        n_loans, start=start, end=end, seed=np.random.SeedSequence([seed, chunk]),
+        first_loan_id=first + 1, first_borrower_id=int(first * 0.8) + 1,
+    )
+    store = DataStore(root)
+    for name, frame in book.items():
+        store.write(name, frame, part=f'{chunk:05d}')
+    return {name: len(frame) for name, frame in book.items()}
+
+
+def generate_to_store(store, n_loans, chunk_size=250000, workers=1, start='2024-01-01', end='2025-11-30',
+                      seed=42, overwrite=True):
+    """Stream a synthetic book of n_loans into the store, one bounded chunk at a time.
+
+    Each chunk is generated from its own seed, so the result does not depend on
+    the number of workers; memory stays proportional to chunk_size per worker.
+    """
+    if overwrite:
+        for name in os.listdir(store.root) if os.path.isdir(store.root) else []:
+            shutil.rmtree(store.path(name), ignore_errors=True)
+    chunks = [(c, min(chunk_size, n_loans - c * chunk_size)) for c in range(-(-n_loans // chunk_size))]
+    jobs = [(store.root, c, size, chunk_size, start, end, seed) for c, size in chunks]
+    totals = {}
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_write_chunk, *zip(*jobs)))
+    else:
+        results = [_write_chunk(*job) for job in jobs]
+    for result in results:
+        for name, rows in result.items():
+            totals[name] = totals.get(name, 0) + rows
+    return totals
+
+
+def main():
+    from data_store import STORE_DIR, DataStore
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic KUR loan book into the columnar store.')
+    parser.add_argument('--loans', type=int, default=20000, help='number of loans (10k to 50M)')
+    parser.add_argument('--chunk-size', type=int, default=250000, help='loans generated per chunk')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes')
+    parser.add_argument('--store', default=STORE_DIR, help='store directory')
+    parser.add_argument('--start', default='2024-01-01')
+    parser.add_argument('--end', default='2025-11-30')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    totals = generate_to_store(DataStore(args.store), args.loans, chunk_size=args.chunk_size,
+                               workers=args.workers, start=args.start, end=args.end, seed=args.seed)
+    for name, rows in totals.items():
+        print(f'{name:>12}: {rows:>12,} rows')
+    print(f'Generated in {time.perf_counter() - started:.1f}s into {args.store}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import datetime
+import json
+import os
+import threading
+import time
+from collections import Counter, namedtuple
+
+# Recorded filter usage, kept across restarts so a fresh deploy warms what users actually open
+USAGE_FILE = os.getenv('KUR_WARMUP_USAGE', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                        'data', 'warmup_usage.json'))
+# Seconds one warm-up may run, and how many views it covers at most
+WARMUP_SECONDS = float(os.getenv('KUR_WARMUP_SECONDS', '60'))
+WARMUP_VIEWS = 40
+# A warm-up only works while no session has rerun for this many seconds
+IDLE_SECONDS = 1.0
+
+WarmupResult = namedtuple('WarmupResult', ['reason', 'views', 'seconds', 'cancelled'])
+
+
+def _encode(filters):
+    # Usage is counted per combination of the other filters; the period is chosen when warming
+    return json.dumps({k: v for k, v in filters.items() if k != 'until'}, sort_keys=True)
+
+
+def period_ends(today=None):
+    """The dates the Periode input most often holds: today, and the last day of the previous month."""
+    today = today or datetime.date.today()
+    return [today, today.replace(day=1) - datetime.timedelta(days=1)]
+
+
+class CacheWarmer:
+    """Precomputes the most used dashboard views in a background thread.
+
+    Sessions record the filters of every rerun. At startup, and after every
+    refresh that merged new rows, the warmer runs `warm(filters)` for the
+    default view, then for recorded and candidate views by usage, so the first
+    real session finds them cached. A run stops at its time box, yields while
+    any session is rerunning, and is cancelled when a newer run starts.
+    """
+
+    def __init__(self, warm, candidates, usage_file=USAGE_FILE, budget=WARMUP_SECONDS, max_views=WARMUP_VIEWS):
+        self.warm_view = warm
+        self.candidates = candidates
+        self.usage_file = usage_file
+        self.budget = budget
+        self.max_views = max_views
+        self.usage = Counter(self._load_usage())
+        self.last_run = None
+        self._last_activity = 0.0
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def _load_usage(self):
+        if not os.path.exists(self.usage_file):
+            return {}
+        with open(self.usage_file) as f:
+            return json.load(f)
+
+    def _save_usage(self):
+        os.makedirs(os.path.dirname(self.usage_file), exist_ok=True)
+        tmp_path = f"{self.usage_file}.tmp"
+        with self._lock:
+            usage = dict(self.usage.most_common(200))
+        with open(tmp_path, 'w') as f:
+            json.dump(usage, f)
+        os.replace(tmp_path, self.usage_file)
+
+    def record(self, filters):
+        """Count a session rerun with these filters; also marks live activity."""
+        with self._lock:
+            self.usage[_encode(filters)] += 1
+        self._last_activity = time.monotonic()
+
+    def views(self, today=None):
+        """Views to warm, in order: the first candidate (the default view), then by recorded usage.
+
+        Each filter combination is warmed for the current and the previous period.
+        """
+        candidates = [_encode(filters) for filters in self.candidates()]
+        with self._lock:
+            usage = dict(self.usage)
+        ranked = sorted(dict.fromkeys(candidates[1:] + list(usage)), key=lambda key: -usage.get(key, 0))
+        views = [{**json.loads(key), 'until': until}
+                 for key in dict.fromkeys(candidates[:1] + ranked) for until in period_ends(today)]
+        return views[:self.max_views]
+
+    def _run(self, cancel, reason):
+        started = time.monotonic()
+        deadline = started + self.budget
+        warmed = 0
+        try:
+            for filters in self.views():
+                while time.monotonic() - self._last_activity < IDLE_SECONDS and time.monotonic() < deadline:
+                    if cancel.wait(0.2):
+                        break
+                if cancel.is_set() or time.monotonic() >= deadline:
+                    break
+                self.warm_view(filters)
+                warmed += 1
+        finally:
+            self.last_run = WarmupResult(reason, warmed, time.monotonic() - started, cancel.is_set())
+            self._save_usage()
+
+    def start(self, reason='startup'):
+        """Cancel a warm-up in progress and start a new one."""
+        self.cancel()
+        self._cancel = cancel = threading.Event()
+        threading.Thread(target=self._run, args=(cancel, reason), name='kur-warmup', daemon=True).start()
+        return self
+
+    def cancel(self):
+        """Stop the running warm-up after the view it is warming; does not wait for it."""
+        self._cancel.set()